@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+import sys
+from linga.benchmark import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,6 +2,7 @@
 from linga.app import app, db, login_manager
 from linga.auth import User
 from linga.comics import ComicMetadata
+from linga.catalog import CatalogBook, CatalogDir
 import linga.views
 
 if __name__ == '__main__':
@@ -1,8 +1,9 @@
 """Main application initilization."""
 import os.path
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
+from linga.storage import TunedSQLAlchemy
 
 BOOK_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'books'))
 # Make sure to add your own secret key in config.py
@@ -12,12 +13,86 @@ ENV_KEY = 'LINGA_CONFIG_FILE'
 CONFIG_FILE = os.environ[ENV_KEY] if os.environ.get(ENV_KEY) else '../config.py'
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Use WAL journaling, pooled connections and the settings below for SQLite files
+SQLITE_TUNING = True
+SQLITE_SYNCHRONOUS = 'NORMAL'
+# Milliseconds to wait for another connection's write lock before failing
+SQLITE_BUSY_TIMEOUT = 5000
+SQLITE_POOL_SIZE = 5
+
+# Seconds a logged in user's account is reused between requests; 0 loads it every time
+USER_CACHE_TTL = 60
+
+# Minimum number of seconds between library rescans triggered by the book list
+CATALOG_RESCAN_INTERVAL = 60
+# Keep the catalog current with a background file watcher instead of rescanning
+CATALOG_WATCH = False
+# Seconds between rescans when the watcher has to fall back to polling
+CATALOG_WATCH_INTERVAL = 30
+# Number of directories listed at once when walking the whole library
+SCAN_WORKERS = 8
+
+# Maximum number of archives kept open between requests; 0 disables the cache
+ARCHIVE_CACHE_SIZE = 16
+# Maximum bytes of pages unpacked from RAR books; 0 always reads RAR pages from the archive
+RAR_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+# Number of RAR books unpacked at once
+RAR_EXTRACT_WORKERS = 1
+
+# Directory for generated files such as thumbnails
+CACHE_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'cache'))
+# Thumbnail bounding box in pixels, and the maximum bytes of cached thumbnails
+THUMBNAIL_SIZE = 64
+THUMBNAIL_CACHE_SIZE = 256 * 1024 * 1024
+# Bounding box in pixels for book cover images
+COVER_SIZE = 200
+# Number of thumbnails in each sprite sheet, and the sheet width in thumbnails
+SPRITE_PAGES = 100
+SPRITE_COLUMNS = 10
+# Entries per page of the directory listing API, and the most a client can ask for
+DIR_PAGE_SIZE = 200
+DIR_PAGE_MAX_SIZE = 1000
+
+# Page turns read ahead after each page is served; 0 disables read-ahead
+PREFETCH_PAGES = 2
+# Number of threads reading pages ahead
+PREFETCH_WORKERS = 2
+# Maximum bytes of page images kept in memory
+PAGE_CACHE_SIZE = 64 * 1024 * 1024
+# Maximum bytes of encoded page manifests kept in memory
+MANIFEST_CACHE_SIZE = 4 * 1024 * 1024
+# Number of threads reading page sizes for manifests that don't have them yet
+PAGE_SIZE_WORKERS = 1
+
+# Maximum bytes of scaled page images cached on disk
+PAGE_VARIANT_CACHE_SIZE = 1024 * 1024 * 1024
+# Requested page sizes are rounded up to a multiple of this many pixels, up to the maximum
+PAGE_VARIANT_STEP = 128
+PAGE_VARIANT_MAX_SIZE = 4096
+# Encoder quality for scaled JPEG and WebP pages
+PAGE_VARIANT_QUALITY = 85
+
+# Seconds between writes of queued reading progress; 0 writes every update at once
+PROGRESS_FLUSH_INTERVAL = 5
+
+# Record request and stage timings and serve them at /metrics
+METRICS_ENABLED = True
+# Addresses allowed to read /metrics; empty allows everyone.  Behind a reverse proxy
+# every request comes from the proxy's address unless TRUSTED_PROXIES is set.
+METRICS_ALLOWED_ADDRESSES = ['127.0.0.1', '::1']
+# Log requests taking at least this many seconds, with the time spent in each stage; 0 disables
+SLOW_REQUEST_TIME = 0
+# Number of reverse proxies in front of the app whose X-Forwarded-For header is trusted
+# for the client address; 0 uses the connecting address
+TRUSTED_PROXIES = 0
 
 app = Flask(__name__) #pylint: disable=invalid-name
 app.config.from_object(__name__)
 app.config.from_pyfile(CONFIG_FILE, silent=True)
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
 
-db = SQLAlchemy(app) #pylint: disable=invalid-name
+db = TunedSQLAlchemy(app) #pylint: disable=invalid-name
 
 login_manager = LoginManager() #pylint: disable=invalid-name
 # Try to accomodate old versions of flask-login
@@ -0,0 +1,180 @@
+"""Share open comic archives between requests."""
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from linga.app import get_config
+
+# Zip local file header: signature, version, flags, method, time, date, CRC,
+# compressed size, uncompressed size, name length, extra field length.
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+ZIP_LOCAL_SIGNATURE = b'PK\x03\x04'
+ZIP_FLAG_ENCRYPTED = 0x1
+
+_archive_cache = None #pylint: disable=invalid-name
+
+def get_archive_cache():
+    """Get the process-wide archive cache, creating it on first use."""
+    global _archive_cache #pylint: disable=global-statement,invalid-name
+    if _archive_cache is None:
+        _archive_cache = ArchiveCache(get_config('ARCHIVE_CACHE_SIZE'))
+    return _archive_cache
+
+def archive_key(path):
+    """Get a key identifying the current version of an archive file."""
+    info = os.stat(path)
+    return (path, info.st_mtime, info.st_size)
+
+def close_archive(archive):
+    """Close an archive reader, if it holds anything open."""
+    close = getattr(archive, 'close', None)
+    if close is not None:
+        close()
+
+def open_stored_entry(path, header_offset, size):
+    """Open an uncompressed zip member straight from the archive file.
+
+    Returns None if there isn't an unencrypted zip member at header_offset,
+    in which case the caller should go through the archive reader instead.
+    """
+    fh = open(path, 'rb')
+    try:
+        fh.seek(header_offset)
+        header = fh.read(ZIP_LOCAL_HEADER.size)
+        if len(header) == ZIP_LOCAL_HEADER.size:
+            fields = ZIP_LOCAL_HEADER.unpack(header)
+            if (fields[0] == ZIP_LOCAL_SIGNATURE and fields[3] == 0
+                    and not fields[2] & ZIP_FLAG_ENCRYPTED):
+                start = header_offset + ZIP_LOCAL_HEADER.size + fields[9] + fields[10]
+                return EntryFile(fh, start, size)
+    except Exception:
+        fh.close()
+        raise
+    fh.close()
+    return None
+
+
+class EntryFile(object):
+    """Read-only file object for a byte range within a larger file.
+
+    fileno() is the underlying file's, positioned at the current read offset,
+    so WSGI servers with sendfile support can send the range without copying
+    it through Python.
+    """
+
+    def __init__(self, fh, start, length):
+        self.fh = fh
+        self.start = start
+        self.length = length
+        self.pos = 0
+        self.fh.seek(start)
+
+    def read(self, size=-1):
+        remaining = self.length - self.pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.fh.read(size)
+        self.pos += len(data)
+        return data
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self.pos = min(max(offset, 0), self.length)
+        self.fh.seek(self.start + self.pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def fileno(self):
+        return self.fh.fileno()
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ArchiveCache(object):
+    """Bounded LRU cache of open archive readers.
+
+    Entries are keyed by path, mtime and size, so a changed file is reopened
+    rather than served from a stale directory. Evicted readers are closed to
+    release their file descriptors.
+    """
+
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        self.handles = OrderedDict()
+        self.lock = threading.Lock()
+        self.opening = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, opener):
+        """Get an open reader for path, calling opener(path) if there isn't one."""
+        if self.max_open <= 0:
+            return opener(path)
+
+        key = archive_key(path)
+        with self.lock:
+            archive = self._lookup(key)
+            if archive is not None:
+                return archive
+            key_lock = self.opening.setdefault(key, threading.Lock())
+
+        # Only one thread parses a given archive; the others wait and share it.
+        with key_lock:
+            with self.lock:
+                archive = self._lookup(key)
+                if archive is not None:
+                    return archive
+            archive = opener(path)
+            with self.lock:
+                self.misses += 1
+                self.opening.pop(key, None)
+                evicted = [self.handles.pop(k) for k in list(self.handles) if k[0] == path]
+                self.handles[key] = archive
+                while len(self.handles) > self.max_open:
+                    evicted.append(self.handles.popitem(last=False)[1])
+        for item in evicted:
+            close_archive(item)
+        return archive
+
+    def _lookup(self, key):
+        """Find a cached reader and mark it as recently used.  Call with the lock held."""
+        archive = self.handles.get(key)
+        if archive is not None:
+            self.handles.move_to_end(key)
+            self.hits += 1
+        return archive
+
+    def discard(self, path):
+        """Close and forget any readers for path."""
+        with self.lock:
+            evicted = [self.handles.pop(k) for k in list(self.handles) if k[0] == path]
+        for item in evicted:
+            close_archive(item)
+
+    def clear(self):
+        """Close every cached reader."""
+        with self.lock:
+            evicted = list(self.handles.values())
+            self.handles.clear()
+        for item in evicted:
+            close_archive(item)
+
+    def __len__(self):
+        return len(self.handles)
@@ -1,13 +1,31 @@
+import threading
+import time
 from datetime import datetime
 import werkzeug.security
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
 from linga import db, login_manager
+from linga.app import get_config
 
 login_manager.login_view = 'user_login'
 
+# Columns copied into the user cache
+USER_FIELDS = ('user_id', 'email', 'password', 'created', 'last_login')
+
 @login_manager.user_loader
 def load_user(userid):
-    return get_user_by_id(userid)
+    try:
+        userid = int(userid)
+    except (TypeError, ValueError):
+        return None
+    cache = get_user_cache()
+    user = cache.get(userid)
+    if user is None:
+        user = get_user_by_id(userid)
+        if user is not None:
+            cache.put(user)
+    return user
 
 def user_query():
     return db.session.query(User)
@@ -22,6 +40,57 @@ def get_user_by_id(user_id):
         .filter_by(user_id=user_id) \
         .first()
 
+
+class UserCache(object):
+    """Keeps the columns of recently loaded users so requests can skip the user query.
+
+    Each get() builds a new detached User, so requests never share an
+    object.  Entries expire after USER_CACHE_TTL seconds, and are dropped
+    as soon as the user row is updated or deleted in this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Get a detached copy of a cached user, or None."""
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is None or entry[0] < time.time():
+                self.users.pop(user_id, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            fields = entry[1]
+        user = User.__mapper__.class_manager.new_instance()
+        for name, value in zip(USER_FIELDS, fields):
+            setattr(user, name, value)
+        make_transient_to_detached(user)
+        return user
+
+    def put(self, user):
+        """Cache a user's columns for USER_CACHE_TTL seconds."""
+        ttl = get_config('USER_CACHE_TTL')
+        if ttl <= 0:
+            return
+        fields = tuple(getattr(user, name) for name in USER_FIELDS)
+        with self.lock:
+            self.users[user.user_id] = (time.time() + ttl, fields)
+
+    def discard(self, user_id):
+        """Drop a user from the cache."""
+        with self.lock:
+            self.users.pop(user_id, None)
+
+_user_cache = UserCache() #pylint: disable=invalid-name
+
+def get_user_cache():
+    """Get the process-wide user cache."""
+    return _user_cache
+
 class User(db.Model, UserMixin):
     __tablename__ = 'linga_users'
 
@@ -47,3 +116,9 @@ class User(db.Model, UserMixin):
     def check_password(self, password):
         """Validate user password"""
         return werkzeug.security.check_password_hash(self.password, password)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_user(mapper, connection, target): #pylint: disable=unused-argument
+    """Stop serving a cached copy of a user once the row changes."""
+    get_user_cache().discard(target.user_id)
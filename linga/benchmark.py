@@ -0,0 +1,243 @@
+"""Time the library, page and thumbnail paths against a generated library."""
+
+import argparse
+import io
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from PIL import Image
+
+from linga.app import (app, db)
+from linga.auth import User
+from linga.catalog import LibraryCatalog
+from linga.comics import (Comic, ComicLister, remove_sep)
+from linga.migrations import upgrade_database
+
+# Books per directory at each level of a generated library.
+DIR_FANOUT = 4
+# Password for the user the benchmark logs in as.
+BENCH_PASSWORD = 'benchmark'
+
+def make_page_image(size):
+    """Get an encoded JPEG page of the given size."""
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+def book_relpath(index, depth):
+    """Get the relative path of the index'th book in a library depth directories deep."""
+    parts = []
+    for level in range(depth):
+        parts.append('d%d' % (index // DIR_FANOUT ** (level + 1) % DIR_FANOUT))
+    parts.append('book-%05d' % index)
+    return os.path.join(*parts)
+
+def write_zip(path, pages, data, stored):
+    compression = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        for page in range(pages):
+            zf.writestr('%04d.jpg' % page, data)
+
+def write_rar(path, pages, data, stored):
+    """Write a RAR book with the rar command line tool."""
+    rar = shutil.which('rar')
+    if rar is None:
+        raise RuntimeError('The rar tool is needed to generate RAR books')
+    work = tempfile.mkdtemp()
+    try:
+        names = []
+        for page in range(pages):
+            names.append('%04d.jpg' % page)
+            with open(os.path.join(work, names[-1]), 'wb') as fh:
+                fh.write(data)
+        subprocess.check_call([rar, 'a', '-idq', '-m0' if stored else '-m3',
+                               os.path.abspath(path)] + names, cwd=work)
+    finally:
+        shutil.rmtree(work)
+
+def make_library(path, books, depth=2, pages=20, fmt='zip', stored=True, page_size=(800, 1200)):
+    """Generate a library of identical books and return their relative paths."""
+    data = make_page_image(page_size)
+    ext = '.cbr' if fmt == 'rar' else '.cbz'
+    write = write_rar if fmt == 'rar' else write_zip
+    ret = []
+    for index in range(books):
+        relpath = book_relpath(index, depth) + ext
+        full_path = os.path.join(path, relpath)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        write(full_path, pages, data, stored)
+        ret.append(relpath)
+    return ret
+
+def summarize(times):
+    """Get statistics in seconds for a list of timings."""
+    times = sorted(times)
+    count = len(times)
+    total = sum(times)
+    return {
+        'count': count,
+        'total': total,
+        'mean': total / count,
+        'median': times[count // 2],
+        'min': times[0],
+        'p95': times[min(count - 1, int(count * 0.95))],
+        'max': times[-1],
+        'ops_per_sec': count / total if total else None,
+    }
+
+def time_calls(func, args_list):
+    """Call func once for each item of args_list and summarize the timings."""
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+class Benchmark(object):
+    """Runs the benchmarks against a library in a scratch directory."""
+
+    def __init__(self, base, relpaths, pages, repeat=3, sample=10):
+        self.base = base
+        self.books_path = os.path.join(base, 'books')
+        self.relpaths = relpaths
+        self.pages = pages
+        self.repeat = repeat
+        self.sample = relpaths[:sample]
+        self.client = None
+
+    def setup_app(self):
+        """Point the app at the scratch library and log in a test client."""
+        app.config.update({
+            'BOOK_PATH': self.books_path,
+            'CACHE_PATH': os.path.join(self.base, 'cache'),
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.base, 'bench.db'),
+            'PREFETCH_PAGES': 0,
+            'PROGRESS_FLUSH_INTERVAL': 0,
+            'CATALOG_WATCH': False,
+        })
+        upgrade_database(db)
+        user = User('bench@example.com', BENCH_PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        self.client = app.test_client()
+        res = self.client.post('/user/login', data={'email': user.email,
+                                                    'password': BENCH_PASSWORD})
+        if res.status_code != 302:
+            raise RuntimeError('Benchmark user could not log in')
+
+    def get(self, url):
+        res = self.client.get(url)
+        res.get_data()
+        if res.status_code != 200:
+            raise RuntimeError('GET %s returned %d' % (url, res.status_code))
+
+    def page_urls(self, endpoint):
+        return [('/books/%s/%s/%d' % (endpoint, remove_sep(relpath), page),)
+                for relpath in self.sample for page in range(1, self.pages + 1)]
+
+    def run(self):
+        """Run every benchmark and return the results by name."""
+        self.setup_app()
+        results = {}
+        catalog = LibraryCatalog(self.books_path)
+        results['catalog_scan'] = time_calls(catalog.rescan, [()])
+        results['catalog_rescan'] = time_calls(catalog.rescan, [()] * self.repeat)
+        results['list_entries'] = time_calls(catalog.get_entries, [()] * self.repeat)
+        entries = catalog.get_entries()
+        results['group_by_path'] = time_calls(ComicLister(self.books_path).group_by_path,
+                                              [(entries,)] * self.repeat)
+        results['list_dir'] = time_calls(self.get, [('/books/dir/',)] * self.repeat)
+
+        with app.test_request_context():
+            opened = [Comic(os.path.join(self.books_path, relpath)) for relpath in self.sample]
+            calls = [(book, page) for book in opened for page in range(self.pages)]
+            results['get_file_cold'] = time_calls(lambda book, page: book.get_file(page), calls)
+            results['get_file_warm'] = time_calls(lambda book, page: book.get_file(page), calls)
+
+        for endpoint, name in [('page', 'show_page'), ('pagethumb', 'show_pagethumb')]:
+            urls = self.page_urls(endpoint)
+            results[name + '_cold'] = time_calls(self.get, urls)
+            results[name + '_warm'] = time_calls(self.get, urls * self.repeat)
+        return results
+
+
+def compare(old, new, out):
+    """Print the change in median time of each benchmark between two result files."""
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['median']
+        after = new['results'][name]['median']
+        change = (after - before) / before * 100 if before else 0.0
+        out.write('%-22s %10.3fms %10.3fms %+7.1f%%\n' % (name, before * 1000, after * 1000,
+                                                         change))
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(
+        description='Benchmark book listing, page and thumbnail serving on a generated library.')
+    parser.add_argument('--books', type=int, default=200, help='Number of books')
+    parser.add_argument('--depth', type=int, default=2, help='Directory levels above the books')
+    parser.add_argument('--pages', type=int, default=20, help='Pages per book')
+    parser.add_argument('--format', choices=['zip', 'rar'], default='zip', help='Archive type')
+    parser.add_argument('--deflate', action='store_true',
+                        help='Compress pages instead of storing them')
+    parser.add_argument('--page-size', type=int, nargs=2, default=[800, 1200],
+                        metavar=('WIDTH', 'HEIGHT'), help='Page image size')
+    parser.add_argument('--sample', type=int, default=10,
+                        help='Number of books whose pages are read')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions of warm runs')
+    parser.add_argument('--output', default='', help='Write the JSON results to this file')
+    parser.add_argument('--compare', default='', help='Earlier results file to compare with')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the generated library")
+    args = parser.parse_args(argv)
+
+    base = tempfile.mkdtemp(prefix='linga-bench-')
+    try:
+        relpaths = make_library(os.path.join(base, 'books'), args.books, args.depth, args.pages,
+                                args.format, not args.deflate, tuple(args.page_size))
+        bench = Benchmark(base, relpaths, args.pages, args.repeat, args.sample)
+        report = {
+            'config': {
+                'books': args.books,
+                'depth': args.depth,
+                'pages': args.pages,
+                'format': args.format,
+                'stored': not args.deflate,
+                'page_size': args.page_size,
+                'sample': args.sample,
+                'repeat': args.repeat,
+            },
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': bench.run(),
+        }
+    finally:
+        if args.keep:
+            out.write('Library kept in %s\n' % base)
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            fh.write(data + '\n')
+    else:
+        out.write(data + '\n')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            compare(json.load(fh), report, out)
+    return 0
@@ -0,0 +1,324 @@
+"""Persistent index of the comic books available in the library."""
+
+import os
+import os.path
+import time
+from concurrent.futures import (ThreadPoolExecutor, wait, FIRST_COMPLETED)
+
+from sqlalchemy import (func, case, and_, or_)
+from sqlalchemy.exc import IntegrityError
+
+from linga.app import (get_config, db)
+from linga.comics import (BookEntry, filename_to_bookname)
+from linga.scanner import stat_dir
+from linga.search import (index_books, unindex_books, unindex_dirs)
+
+# Time of the last rescan for each base path, used to throttle refresh().
+_last_scan = {} #pylint: disable=invalid-name
+# Base paths that a background watcher is keeping up to date.
+_watched = set() #pylint: disable=invalid-name
+
+def set_watched(base_path, watched=True):
+    """Mark a library as kept current by a watcher, so requests skip rescans."""
+    if watched:
+        _watched.add(base_path)
+    else:
+        _watched.discard(base_path)
+
+def parent_relpath(relpath):
+    """Get the relative path of the directory containing an item."""
+    return os.path.dirname(relpath)
+
+def is_under_any(relpath, roots):
+    """Determine if a relative path is one of roots or inside one of them."""
+    for root in roots:
+        if root == '' or relpath == root or relpath.startswith(root + os.sep):
+            return True
+    return False
+
+def catalog_query():
+    """Get the query object for catalogued books."""
+    return db.session.query(CatalogBook)
+
+def subtree_range(relpath):
+    """Get the (low, high) bounds of the relative paths strictly inside a directory.
+
+    Everything under 'a/b' sorts between 'a/b/' and 'a/b0', so counting a
+    subtree is a range scan of the relpath index.
+    """
+    return (relpath + os.sep, relpath + chr(ord(os.sep) + 1))
+
+
+class LibraryCatalog(object):
+    """Keeps the catalog tables in sync with the book directory."""
+
+    def __init__(self, base_path=''):
+        self.base_path = base_path if base_path else get_config('BOOK_PATH')
+
+    def full_path(self, relpath):
+        """Get the real path for a path relative to the library root."""
+        return os.path.join(self.base_path, relpath) if relpath else self.base_path
+
+    def refresh(self, max_age=None):
+        """Rescan the library if it hasn't been scanned in the last max_age seconds.
+
+        Libraries kept current by a CatalogWatcher are never rescanned here.
+        """
+        if self.base_path in _watched:
+            return
+        if max_age is None:
+            max_age = get_config('CATALOG_RESCAN_INTERVAL')
+        last = _last_scan.get(self.base_path)
+        if last is None or time.time() - last >= max_age:
+            self.rescan()
+
+    def rescan(self):
+        """Bring the catalog up to date and return the number of directories listed.
+
+        Only directories whose mtime differs from the stored value are listed,
+        so an unchanged library costs one stat() per directory.
+        """
+        listed = self._sync([''], False)
+        _last_scan[self.base_path] = time.time()
+        return listed
+
+    def update_dirs(self, relpaths):
+        """Relist the given directories, whatever their mtime, and sync their subtrees."""
+        return self._sync(list(relpaths), True)
+
+    def _sync(self, roots, force):
+        """Sync the directories under roots, retrying once if another scan beat us to them.
+
+        Two requests can find the same stale directory and both try to add
+        its rows.  The loser's insert fails, and by then the winner's rows are
+        committed, so the second pass only lists what is still out of date.
+        """
+        try:
+            return self._walk(roots, force)
+        except IntegrityError:
+            db.session.rollback()
+            return self._walk(roots, force)
+
+    def _walk(self, roots, force):
+        """Walk the directories under roots, listing the ones that changed.
+
+        Directories are checked and listed by SCAN_WORKERS threads at once,
+        while the catalog tables are updated here as their results arrive.
+        """
+        known = {}
+        children = {}
+        for item in db.session.query(CatalogDir):
+            known[item.relpath] = item
+            children.setdefault(item.parent, []).append(item.relpath)
+
+        seen = set()
+        listed = 0
+        forced = set(roots) if force else set()
+        with ThreadPoolExecutor(max_workers=get_config('SCAN_WORKERS')) as executor:
+            running = {}
+
+            def submit(relpath):
+                if relpath in seen:
+                    return
+                seen.add(relpath)
+                entry = known.get(relpath)
+                known_mtime = entry.mtime if entry is not None and relpath not in forced else None
+                running[executor.submit(stat_dir, self.full_path(relpath), known_mtime)] = relpath
+
+            for relpath in roots:
+                submit(relpath)
+            while running:
+                done = wait(running, return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    relpath = running.pop(future)
+                    try:
+                        mtime, listing = future.result()
+                    except OSError:
+                        seen.discard(relpath)
+                        continue
+                    if listing is None:
+                        subdirs = children.get(relpath, [])
+                    else:
+                        subdirs = self._sync_dir(relpath, mtime, known.get(relpath), listing)
+                        listed += 1
+                    for subdir in subdirs:
+                        submit(subdir)
+
+        removed = [path for path in known
+                   if path not in seen and is_under_any(path, roots)]
+        self._remove_dirs(removed)
+        db.session.commit()
+        return listed
+
+    def _sync_dir(self, relpath, mtime, entry, listing):
+        """Sync the books of a listed directory and return its subdirectories."""
+        books, dirs = listing
+        prefix = os.path.join(relpath, '') if relpath else ''
+        subdirs = [prefix + name for name in dirs]
+        found = dict((prefix + name, info) for name, info in books.items())
+
+        removed = []
+        for book in catalog_query().filter_by(parent=relpath):
+            info = found.pop(book.relpath, None)
+            if info is None:
+                removed.append(book.relpath)
+                db.session.delete(book)
+            else:
+                book.size = info.st_size
+                book.mtime = info.st_mtime
+        # The search index is keyed by book_id, so it's updated while
+        # removed rows still exist and once added rows have been inserted.
+        unindex_books(db.session.connection(), removed)
+        for item_relpath, info in found.items():
+            db.session.add(CatalogBook(item_relpath, info.st_size, info.st_mtime))
+        if found:
+            db.session.flush()
+            index_books(db.session.connection(), list(found))
+
+        if entry is None:
+            entry = CatalogDir(relpath)
+            db.session.add(entry)
+        entry.mtime = mtime
+        return subdirs
+
+    def _remove_dirs(self, relpaths):
+        """Drop directories that no longer exist, along with their books."""
+        # Keep the IN clause well under SQLite's bound parameter limit.
+        chunk_size = 500
+        for start in range(0, len(relpaths), chunk_size):
+            chunk = relpaths[start:start + chunk_size]
+            unindex_dirs(db.session.connection(), chunk)
+            catalog_query() \
+                .filter(CatalogBook.parent.in_(chunk)) \
+                .delete(synchronize_session=False)
+            db.session.query(CatalogDir) \
+                .filter(CatalogDir.relpath.in_(chunk)) \
+                .delete(synchronize_session=False)
+
+    def has_dir(self, relpath):
+        """Check if a directory is in the catalog."""
+        return db.session.query(CatalogDir.relpath).filter_by(relpath=relpath).first() is not None
+
+    def count_dir(self, relpath):
+        """Get the number of subdirectories and books directly in a directory."""
+        dirs = db.session.query(CatalogDir).filter_by(parent=relpath).count()
+        books = catalog_query().filter_by(parent=relpath).count()
+        return dirs, books
+
+    def count_subtree_books(self, relpaths):
+        """Get the number of books under each directory in relpaths, subdirectories included.
+
+        The directories mustn't contain each other.  Each query counts a
+        chunk of them at once, grouping the books by the range they fall in.
+        """
+        ret = dict((relpath, 0) for relpath in relpaths)
+        if '' in ret:
+            ret[''] = catalog_query().count()
+            return ret
+        # Each directory takes four bound parameters.
+        chunk_size = 200
+        for start in range(0, len(relpaths), chunk_size):
+            ranges = []
+            for relpath in relpaths[start:start + chunk_size]:
+                low, high = subtree_range(relpath)
+                ranges.append((and_(CatalogBook.relpath > low, CatalogBook.relpath < high),
+                               relpath))
+            subtree = case(ranges)
+            rows = db.session.query(subtree, func.count(CatalogBook.relpath)) \
+                .filter(or_(*[condition for condition, _ in ranges])) \
+                .group_by(subtree)
+            for relpath, count in rows:
+                ret[relpath] = count
+        return ret
+
+    def count_subdirs(self, relpaths):
+        """Get the number of direct subdirectories of each directory in relpaths."""
+        ret = dict((relpath, 0) for relpath in relpaths)
+        if relpaths:
+            rows = db.session.query(CatalogDir.parent, func.count(CatalogDir.relpath)) \
+                .filter(CatalogDir.parent.in_(relpaths)) \
+                .group_by(CatalogDir.parent)
+            for parent, count in rows:
+                ret[parent] = count
+        return ret
+
+    def list_dir(self, relpath, offset=0, limit=None):
+        """Get one page of a directory's entries, subdirectories first, each sorted by path.
+
+        Returns a tuple of the CatalogDir rows and the BookEntry objects in the page.
+        """
+        dir_count = db.session.query(CatalogDir).filter_by(parent=relpath).count()
+        dirs = []
+        if offset < dir_count:
+            query = db.session.query(CatalogDir) \
+                .filter_by(parent=relpath) \
+                .order_by(CatalogDir.relpath) \
+                .offset(offset)
+            dirs = (query.limit(limit) if limit is not None else query).all()
+        if limit is not None:
+            limit -= len(dirs)
+            if limit <= 0:
+                return dirs, []
+        query = db.session.query(CatalogBook.relpath, CatalogBook.size, CatalogBook.mtime) \
+            .filter_by(parent=relpath) \
+            .order_by(CatalogBook.relpath) \
+            .offset(max(offset - dir_count, 0))
+        books = [BookEntry(*row) for row in (query.limit(limit) if limit is not None else query)]
+        return dirs, books
+
+    def get_book_list(self):
+        """Get the relative paths of all catalogued books, sorted."""
+        return [row.relpath for row in
+                db.session.query(CatalogBook.relpath).order_by(CatalogBook.relpath)]
+
+    def get_entries(self):
+        """Get the catalogued books as lightweight BookEntry objects, sorted by path."""
+        # Plain column rows skip the session's identity map.
+        rows = db.session.query(CatalogBook.relpath, CatalogBook.size, CatalogBook.mtime) \
+            .order_by(CatalogBook.relpath)
+        return [BookEntry(relpath, size, mtime) for relpath, size, mtime in rows]
+
+
+class CatalogDir(db.Model):
+    __tablename__ = 'linga_catalog_dirs'
+    # Covers listing a directory's subdirectories in order.
+    __table_args__ = (
+        db.Index('ix_linga_catalog_dirs_parent_relpath', 'parent', 'relpath'),
+    )
+
+    relpath = db.Column(db.String(256), nullable=False, primary_key=True)
+    parent = db.Column(db.String(256), nullable=True)
+    mtime = db.Column(db.Float, nullable=False, default=0)
+
+    def __init__(self, relpath='', mtime=0):
+        self.relpath = relpath
+        self.parent = parent_relpath(relpath) if relpath else None
+        self.mtime = mtime
+
+    def dir_name(self):
+        return os.path.basename(self.relpath)
+
+
+class CatalogBook(db.Model):
+    __tablename__ = 'linga_catalog_books'
+    # Covers listing a directory's books in order, and finding a book by path.
+    __table_args__ = (
+        db.Index('ix_linga_catalog_books_parent_relpath', 'parent', 'relpath'),
+        db.Index('ix_linga_catalog_books_relpath', 'relpath', unique=True),
+    )
+
+    # Keys the search index.  Unlike an implicit SQLite rowid, VACUUM keeps it.
+    book_id = db.Column(db.Integer, primary_key=True)
+    relpath = db.Column(db.String(256), nullable=False)
+    parent = db.Column(db.String(256), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    mtime = db.Column(db.Float, nullable=False, default=0)
+
+    def __init__(self, relpath='', size=0, mtime=0):
+        self.relpath = relpath
+        self.parent = parent_relpath(relpath)
+        self.size = size
+        self.mtime = mtime
+
+    def book_name(self):
+        return filename_to_bookname(self.relpath)
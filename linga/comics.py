@@ -2,14 +2,21 @@
 
 import re
 import os
+import json
 import os.path
 import zipfile
 from datetime import datetime
 
 import rarfile
 from flask import url_for
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
 
 from linga.app import (get_config, db)
+from linga.archives import (get_archive_cache, archive_key, open_stored_entry)
+from linga.rarcache import get_rar_cache
+from linga.metrics import timed
+from linga.thumbnails import (thumbnail_size, image_dimensions)
 
 COMIC_ARCHIVE_EXTENSIONS = ['.cbz', '.zip', '.cbr', '.rar']
 COMIC_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif']
@@ -49,6 +56,13 @@ def add_sep(path, fake_sep='--'):
     """Convert a pseudo-path into a real path."""
     return path.replace(fake_sep, os.sep)
 
+def url_template(endpoint, key, **values):
+    """Get the URL of an endpoint with {key} in place of its last path segment."""
+    # Not 0, which some endpoints route to a different URL by default.
+    values[key] = 1
+    url, query_mark, query = url_for(endpoint, **values).partition('?')
+    return '%s/{%s}%s%s' % (url.rpartition('/')[0], key, query_mark, query)
+
 def is_supported_format(file_path):
     """Determine if a file has a supported extension."""
     name, ext = os.path.splitext(file_path) #pylint: disable=unused-variable
@@ -68,6 +82,16 @@ def get_mime_type(file_name):
         return 'application/rar'
     return 'application/octet-stream'
 
+@timed('archive_open')
+def open_archive(path):
+    """Open a comic archive for reading."""
+    if get_mime_type(path) == 'application/rar':
+        try:
+            return rarfile.RarFile(path, 'r')
+        except Exception as ex:
+            return zipfile.ZipFile(path, 'r')
+    return zipfile.ZipFile(path, 'r')
+
 def filename_to_bookname(path):
     """Convet a file name into a book name."""
     return re.sub(r"[-_]+", ' ', os.path.splitext(os.path.basename(path))[0])
@@ -90,6 +114,58 @@ def get_metadata(user_id, bookpath):
         .filter_by(user_id=user_id, book_relpath=bookpath) \
         .first()
 
+def manifest_entry(file_name, info):
+    """Get the manifest record for a page from its archive member info."""
+    return {
+        'name': file_name,
+        'file_size': info.file_size,
+        'compress_size': info.compress_size,
+        'compress_type': info.compress_type,
+        'header_offset': getattr(info, 'header_offset', None),
+        'crc': getattr(info, 'CRC', None),
+    }
+
+def load_manifest(path, build):
+    """Get the stored page manifest for an archive, calling build() if it's out of date.
+
+    Manifests are read and written on a connection of their own, so storing
+    one never commits or rolls back the request's session.
+    """
+    try:
+        fullpath, mtime, size = archive_key(os.path.abspath(path))
+    except OSError:
+        return build()
+
+    manifests = PageManifest.__table__
+    try:
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                select([manifests.c.mtime, manifests.c.size, manifests.c.pages])
+                .where(manifests.c.book_path == fullpath)).first()
+    except SQLAlchemyError:
+        return build()
+    if row is not None and row.mtime == mtime and row.size == size:
+        return json.loads(row.pages)
+
+    with timed('manifest_build'):
+        pages = build()
+    store_manifest(fullpath, mtime, size, pages)
+    return pages
+
+def store_manifest(fullpath, mtime, size, pages):
+    """Save the page manifest for a version of an archive."""
+    manifests = PageManifest.__table__
+    values = {'mtime': mtime, 'size': size, 'pages': json.dumps(pages, separators=(',', ':'))}
+    try:
+        with db.engine.begin() as connection:
+            updated = connection.execute(
+                manifests.update().where(manifests.c.book_path == fullpath).values(**values))
+            if updated.rowcount == 0:
+                connection.execute(manifests.insert().values(book_path=fullpath, **values))
+    except SQLAlchemyError:
+        # Most likely another request stored the same manifest first.
+        pass
+
 class InvalidPageError(IndexError):
     """Exception for invalid pages."""
     def __init__(self, page=0):
@@ -106,6 +182,8 @@ class Comic(object):
         self.current_file_index = -1
         self.archive = archive
         self.file_list = []
+        self.manifest = None
+        self._file_key = None
         self._metadata = None
 
     def metadata(self, userid):
@@ -136,45 +214,186 @@ class Comic(object):
         """Get the MIME type of the book file."""
         return get_mime_type(self.path)
 
+    def file_key(self):
+        """Get the path, mtime and size identifying the current version of the archive."""
+        if self._file_key is None:
+            self._file_key = archive_key(os.path.abspath(self.path))
+        return self._file_key
+
+    def version(self):
+        """Get a short token that changes whenever the archive file changes."""
+        fullpath, mtime, size = self.file_key() #pylint: disable=unused-variable
+        return '%x-%x' % (int(mtime * 1000), size)
+
+    def mtime(self):
+        """Get the modification time of the archive file."""
+        return self.file_key()[1]
+
+    def page_etag(self, index):
+        """Get an entity tag for a page, based on the archive version and the page CRC."""
+        try:
+            page = self.get_manifest()[index]
+        except IndexError:
+            raise InvalidPageError(index)
+        return '%s-%d-%08x' % (self.version(), index, page['crc'] or 0)
+
     def get_archive(self):
         """Get the archive file for the book."""
         if not self.archive:
-            if self.mimetype() == 'application/rar':
-                try:
-                    self.archive = rarfile.RarFile(self.path, 'r')
-                except Exception as ex:
-                    self.archive = zipfile.ZipFile(self.path, 'r')
-            else:
-                self.archive = zipfile.ZipFile(self.path, 'r')
+            self.archive = get_archive_cache().get(self.path, open_archive)
         return self.archive
 
+    def unpacked_page(self, file_name):
+        """Open a page unpacked by the RAR extraction cache, or get None if it isn't there."""
+        if self.mimetype() != 'application/rar' or get_config('RAR_CACHE_SIZE') <= 0:
+            return None
+        path = get_rar_cache().get(self.path, self.file_key(), file_name, self.get_file_list())
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except OSError:
+            # Evicted since the lookup.
+            return None
+
+    @timed('page_read')
+    def read_file(self, file_name):
+        """Read a file from the archive."""
+        unpacked = self.unpacked_page(file_name)
+        if unpacked is not None:
+            with unpacked:
+                return unpacked.read()
+        try:
+            return self.get_archive().read(file_name)
+        except ValueError:
+            # Another request evicted and closed the shared reader, so reopen it.
+            self.archive = None
+            return self.get_archive().read(file_name)
+
+    def get_manifest(self):
+        """Get the page manifest - the archive details of each page, in reading order."""
+        if self.manifest is None:
+            self.manifest = load_manifest(self.path, self.build_manifest)
+        return self.manifest
+
+    def build_manifest(self):
+        """Read the page manifest from the archive directory.
+
+        Page sizes aren't included, since reading them opens every page;
+        measure_pages() adds them later.
+        """
+        archive = self.get_archive()
+        pages = []
+        for file_name in archive.namelist():
+            if is_supported_image(file_name):
+                pages.append(manifest_entry(file_name, archive.getinfo(file_name)))
+        pages.sort(key=lambda page: page['name'])
+        return pages
+
+    def has_page_sizes(self):
+        """Check if the manifest records the size of every page."""
+        return all(page.get('width') is not None and page.get('height') is not None
+                   for page in self.get_manifest())
+
+    def measure_pages(self, unpacked_only=False):
+        """Read the size of each page from its image header and store it in the manifest.
+
+        This opens every page, so it's for pregenerate.py and background jobs
+        rather than requests.  With unpacked_only set, RAR books are only
+        measured from pages the RAR cache has unpacked, and False is
+        returned if some of them aren't there yet.  Pages that can't be read
+        are left without a size.
+        """
+        rar = unpacked_only and self.mimetype() == 'application/rar' and \
+            get_config('RAR_CACHE_SIZE') > 0
+        pages = [dict(page) for page in self.get_manifest()]
+        archive = None
+        try:
+            for page in pages:
+                page.pop('width', None)
+                page.pop('height', None)
+                stream = self.unpacked_page(page['name'])
+                if stream is None:
+                    if rar:
+                        return False
+                    try:
+                        # Not the shared reader, which another request can evict and close.
+                        if archive is None:
+                            archive = open_archive(self.path)
+                        stream = archive.open(page['name'])
+                    except Exception: #pylint: disable=broad-except
+                        continue
+                with stream:
+                    width, height = image_dimensions(stream)
+                if width is not None and height is not None:
+                    page['width'], page['height'] = width, height
+        finally:
+            if archive is not None:
+                archive.close()
+        fullpath, mtime, size = self.file_key()
+        store_manifest(fullpath, mtime, size, pages)
+        self.manifest = pages
+        return True
+
     def get_file_list(self):
         """Get the list of files in the archive."""
         if not self.file_list:
-            files = self.get_archive().namelist()
-            self.file_list = []
-            for file_name in files:
-                if is_supported_image(file_name):
-                    self.file_list.append(file_name)
-            self.file_list.sort()
+            self.file_list = [page['name'] for page in self.get_manifest()]
         return self.file_list
 
-    def get_page_list(self):
-        """Get a list of metadata dictionaries for the page."""
-        files = self.get_file_list()
-        pages = []
-        index = 1
-        for file_name in files:
-            pages.append({
-                "file": file_name,
-                "index": index,
-                "url": url_for('show_page', book=self.disp_relpath(), page=index),
-                "page_url": url_for('show_book', book=self.disp_relpath(), page=index),
-                "thumb_url": url_for('show_pagethumb', book=self.disp_relpath(), page=index),
-            })
-            index += 1
-        return pages
-
+    def get_page_manifest(self):
+        """Get a compact description of the pages for the reader.
+
+        Instead of URLs for every page there are URL templates, where clients
+        fill in {page} (counting from 1) or the {start} page of a sprite sheet.
+        sizes holds the [width, height] of each page, or nulls if unknown.
+        """
+        book = self.disp_relpath()
+        version = self.version()
+        width, height = thumbnail_size()
+        return {
+            'version': version,
+            'count': len(self.get_file_list()),
+            'files': self.get_file_list(),
+            'sizes': [[page.get('width'), page.get('height')] for page in self.get_manifest()],
+            'urls': {
+                'page': url_template('show_page', 'page', book=book, v=version),
+                'read': url_template('show_book', 'page', book=book),
+                'thumb': url_template('show_pagethumb', 'page', book=book, v=version),
+                'sprite': url_template('show_thumbsheet', 'start', book=book, v=version),
+            },
+            'sprite': {
+                'pages': get_config('SPRITE_PAGES'),
+                'columns': get_config('SPRITE_COLUMNS'),
+                'width': width,
+                'height': height,
+            },
+        }
+
+
+    @timed('page_open')
+    def open_file(self, index):
+        """Open a page for streaming.  Returns a file object and the page size in bytes.
+
+        Uncompressed zip members are read straight from the archive file.
+        """
+        try:
+            page = self.get_manifest()[index]
+        except IndexError:
+            raise InvalidPageError(index)
+        self.current_file_index = index
+        stream = None
+        if page['compress_type'] == zipfile.ZIP_STORED and page['header_offset'] is not None:
+            stream = open_stored_entry(self.path, page['header_offset'], page['file_size'])
+        if stream is None:
+            stream = self.unpacked_page(page['name'])
+        if stream is None:
+            try:
+                stream = self.get_archive().open(page['name'])
+            except ValueError:
+                self.archive = None
+                stream = self.get_archive().open(page['name'])
+        return stream, page['file_size']
 
     def next_file(self):
         """Get the next file."""
@@ -188,7 +407,7 @@ class Comic(object):
         ''"Get the current file."""
         self.current_file_index = index
         try:
-            return self.get_archive().read(self.get_file_list()[index])
+            return self.read_file(self.get_file_list()[index])
         except IndexError:
             raise InvalidPageError(index)
 
@@ -198,7 +417,7 @@ class Comic(object):
             index = self.current_file_index
         try:
             filename = self.get_file_list()[index]
-            ext = os.path.splitext(filename)[1]
+            ext = os.path.splitext(filename)[1].lower()
             for mimetype, extensions in COMIC_IMAGE_MIME_MAP.items():
                 if ext in extensions:
                     return mimetype
@@ -238,7 +457,7 @@ class ComicLister(object):
         return ret
 
     def group_by_path(self, books):
-        """Take a list of books and group them by direcotry."""
+        """Take a list of books or book entries and group them by direcotry."""
         ret = ComicDir()
         for book in books:
             paths = book.rel_path.split(os.path.sep)
@@ -250,8 +469,32 @@ class ComicLister(object):
         return ret
 
 
+class BookEntry(object):
+    """A book in a listing.
+
+    Listings can hold a great many of these, so they only keep the path,
+    size and modification time.
+    """
+    __slots__ = ('rel_path', 'size', 'mtime')
+
+    def __init__(self, rel_path, size=0, mtime=0):
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime = mtime
+
+    @property
+    def name(self):
+        return filename_to_bookname(self.rel_path)
+
+    def disp_relpath(self):
+        """Get the relative path for display."""
+        return remove_sep(self.rel_path)
+
+
 class ComicDir(object):
     """Represents a directory in the comic book collection."""
+    __slots__ = ('name', 'books', 'children')
+
     def __init__(self, name=''):
         self.name = name
         self.books = []
@@ -273,8 +516,26 @@ class ComicDir(object):
         return curr_item
 
 
+class PageManifest(db.Model):
+    __tablename__ = 'linga_page_manifests'
+
+    book_path = db.Column(db.String(512), nullable=False, primary_key=True)
+    mtime = db.Column(db.Float, nullable=False, default=0)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    pages = db.Column(db.Text, nullable=False, default='[]')
+
+    def __init__(self, book_path=None):
+        self.book_path = book_path
+        self.mtime = 0
+        self.size = 0
+        self.pages = '[]'
+
+
 class ComicMetadata(db.Model): #pylint: disable=too-many-instance-attributes
     __tablename__ = 'linga_book_metadata'
+    __table_args__ = (
+        db.Index('ix_linga_book_metadata_user_access', 'user_id', 'last_access'),
+    )
 
     user_id = db.Column(
         db.Integer,
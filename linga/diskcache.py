@@ -0,0 +1,133 @@
+"""Size-capped on-disk cache of generated files."""
+
+import os
+import os.path
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# After eviction the cache is trimmed to this fraction of its maximum size.
+EVICTION_TARGET = 0.9
+
+def make_key(*parts):
+    """Get a content address for the parts identifying a cached item."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+class DiskCache(object):
+    """Stores generated files under a directory, evicting the least recently used.
+
+    Files are named by a hash of their key, so anything that identifies the
+    source version (path, mtime, size...) belongs in the key.  Hits bump the
+    file's mtime, which is what eviction orders by.
+    """
+
+    def __init__(self, path, max_bytes, suffix=''):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self.total = None
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key):
+        """Get the file path an item with the given key is stored at."""
+        return os.path.join(self.path, key[:2], key + self.suffix)
+
+    def get(self, key):
+        """Get the path of a cached item, or None if it isn't cached."""
+        path = self.path_for(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key, data):
+        """Store an item and return its path."""
+        path = self.path_for(key)
+        dir_path = os.path.dirname(path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self._add(len(data))
+        return path
+
+    def put_file(self, key, src_path):
+        """Move an existing file into the cache and return its new path."""
+        path = self.path_for(key)
+        dir_path = os.path.dirname(path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+        os.close(handle)
+        try:
+            shutil.move(src_path, tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self._add(size)
+        return path
+
+    def size(self):
+        """Get the total bytes of the files in the cache."""
+        return sum(item[2] for item in self._entries())
+
+    def get_or_create(self, key, build):
+        """Get the path of a cached item, storing the result of build() on a miss."""
+        path = self.get(key)
+        if path is None:
+            path = self.put(key, build())
+        return path
+
+    def _add(self, size):
+        """Account for a new file and evict old ones if over the size cap."""
+        with self.lock:
+            if self.total is None:
+                self.total = sum(item[2] for item in self._entries())
+            else:
+                self.total += size
+            if self.total > self.max_bytes:
+                self._evict(int(self.max_bytes * EVICTION_TARGET))
+
+    def _entries(self):
+        """List (path, mtime, size) for every cached file."""
+        ret = []
+        for dir_path, dirs, files in os.walk(self.path): #pylint: disable=unused-variable
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dir_path, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                ret.append((path, info.st_mtime, info.st_size))
+        return ret
+
+    def _evict(self, target):
+        """Remove least recently used files until the cache is under target bytes."""
+        entries = self._entries()
+        self.total = sum(item[2] for item in entries)
+        entries.sort(key=lambda item: item[1])
+        for path, mtime, size in entries: #pylint: disable=unused-variable
+            if self.total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total -= size
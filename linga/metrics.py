@@ -0,0 +1,181 @@
+"""Time requests and the stages within them, and report them in Prometheus text format."""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import (g, request, has_request_context)
+
+from linga.app import (app, get_config)
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_metrics = None #pylint: disable=invalid-name
+
+def get_metrics():
+    """Get the process-wide metrics, creating them on first use."""
+    global _metrics #pylint: disable=global-statement,invalid-name
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+@contextmanager
+def timed(stage):
+    """Time a block, or a function when used as a decorator, as a stage of the current request.
+
+    Stages also run outside requests, for example in read-ahead threads;
+    those only go into the stage histograms.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if get_config('METRICS_ENABLED'):
+            get_metrics().observe_stage(stage, elapsed)
+        if has_request_context():
+            g.setdefault('stage_times', []).append((stage, elapsed))
+
+def stage_summary(stage_times):
+    """Describe the time spent in each stage, with repeated stages added up."""
+    totals = {}
+    counts = {}
+    for stage, elapsed in stage_times:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+        counts[stage] = counts.get(stage, 0) + 1
+    parts = []
+    for stage in sorted(totals, key=totals.get, reverse=True):
+        part = '%s=%.3fs' % (stage, totals[stage])
+        if counts[stage] > 1:
+            part += ' x%d' % counts[stage]
+        parts.append(part)
+    return ', '.join(parts) if parts else 'no stages'
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, escape_label(value)) for name, value in labels)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def note_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request(exc=None):
+    """Count the request, and log it with its stages if it was slow.
+
+    Teardown runs even when a view raises, and those requests count as 500s.
+    """
+    start = g.get('request_start')
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unmatched'
+    status = 500 if exc is not None else g.get('response_status', 500)
+    if get_config('METRICS_ENABLED'):
+        get_metrics().observe_request(endpoint, request.method, status, elapsed)
+    slow = get_config('SLOW_REQUEST_TIME')
+    if 0 < slow <= elapsed:
+        app.logger.warning('Slow request: %s %s returned %d in %.3fs (%s)',
+                           request.method, request.full_path, status, elapsed,
+                           stage_summary(g.get('stage_times', [])))
+
+
+class Histogram(object):
+    """Counts observations into latency buckets."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+
+    def render(self, name, labels):
+        """Get the exposition lines for this histogram, with cumulative buckets."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels + [('le', repr(bound))]),
+                                             cumulative))
+        lines.append('%s_bucket%s %d' % (name, format_labels(labels + [('le', '+Inf')]),
+                                         self.count))
+        lines.append('%s_sum%s %r' % (name, format_labels(labels), self.total))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), self.count))
+        return lines
+
+
+class Metrics(object):
+    """Request and stage latencies, kept in memory for this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.responses = {}
+        self.stages = {}
+
+    def observe_request(self, endpoint, method, status, seconds):
+        with self.lock:
+            key = (endpoint, method)
+            if key not in self.requests:
+                self.requests[key] = Histogram()
+            self.requests[key].observe(seconds)
+            key = (endpoint, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def observe_stage(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+    def render(self, caches=()):
+        """Get the metrics in Prometheus text format.
+
+        caches is a list of (name, hits, misses) for the cache counters.
+        """
+        lines = [
+            '# HELP linga_request_duration_seconds Time spent handling requests, by route.',
+            '# TYPE linga_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            for (endpoint, method), histogram in sorted(self.requests.items()):
+                lines.extend(histogram.render('linga_request_duration_seconds',
+                                              [('endpoint', endpoint), ('method', method)]))
+            lines.append('# HELP linga_requests_total Requests handled, by route and status.')
+            lines.append('# TYPE linga_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append('linga_requests_total%s %d' % (format_labels(
+                    [('endpoint', endpoint), ('method', method), ('status', status)]), count))
+            lines.append('# HELP linga_stage_duration_seconds Time spent in each stage of '
+                         'serving books.')
+            lines.append('# TYPE linga_stage_duration_seconds histogram')
+            for stage, histogram in sorted(self.stages.items()):
+                lines.extend(histogram.render('linga_stage_duration_seconds',
+                                              [('stage', stage)]))
+        lines.append('# HELP linga_cache_hits_total Cache lookups that found the item.')
+        lines.append('# TYPE linga_cache_hits_total counter')
+        for name, hits, misses in caches: #pylint: disable=unused-variable
+            lines.append('linga_cache_hits_total%s %d' % (format_labels([('cache', name)]), hits))
+        lines.append('# HELP linga_cache_misses_total Cache lookups that didn\'t find the item.')
+        lines.append('# TYPE linga_cache_misses_total counter')
+        for name, hits, misses in caches:
+            lines.append('linga_cache_misses_total%s %d' % (format_labels([('cache', name)]),
+                                                             misses))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,43 @@
+"""In-place upgrades for databases created by older versions."""
+
+import argparse
+
+from sqlalchemy import inspect
+
+from linga.app import db
+
+def add_missing_indexes(connection, metadata):
+    """Create declared indexes that tables made by older versions don't have."""
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+# Schema upgrades in order.  SQLite databases record how many have been
+# applied in PRAGMA user_version; other databases rerun them all, so each
+# step has to be safe to repeat.
+MIGRATIONS = [
+    # Query indexes on the tables of the first version
+    add_missing_indexes,
+]
+
+def upgrade_database(database):
+    """Create missing tables and apply any schema upgrades to an existing database."""
+    database.create_all()
+    engine = database.engine
+    with engine.begin() as connection:
+        is_sqlite = engine.dialect.name == 'sqlite'
+        version = connection.execute('PRAGMA user_version').scalar() if is_sqlite else 0
+        for step in MIGRATIONS[version:]:
+            step(connection, database.metadata)
+        if is_sqlite and version < len(MIGRATIONS):
+            connection.execute('PRAGMA user_version=%d' % len(MIGRATIONS))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Create missing tables and upgrade the schema of the configured database.')
+    parser.parse_args(argv)
+    upgrade_database(db)
+    return 0
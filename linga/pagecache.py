@@ -0,0 +1,180 @@
+"""Read pages ahead of the reader into a byte-budgeted memory cache."""
+
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from linga.app import (app, get_config, db)
+from linga.comics import Comic
+from linga.progress import load_metadata
+
+# Number of readers whose last page is remembered to tell their direction.
+MAX_TRACKED_READERS = 1000
+
+_page_cache = None #pylint: disable=invalid-name
+_prefetcher = None #pylint: disable=invalid-name
+_manifest_cache = None #pylint: disable=invalid-name
+
+def get_page_cache():
+    """Get the process-wide page cache, creating it on first use."""
+    global _page_cache #pylint: disable=global-statement,invalid-name
+    if _page_cache is None:
+        _page_cache = PageCache(get_config('PAGE_CACHE_SIZE'))
+    return _page_cache
+
+def get_manifest_cache():
+    """Get the cache of encoded page manifests, creating it on first use."""
+    global _manifest_cache #pylint: disable=global-statement,invalid-name
+    if _manifest_cache is None:
+        _manifest_cache = PageCache(get_config('MANIFEST_CACHE_SIZE'))
+    return _manifest_cache
+
+def get_prefetcher():
+    """Get the process-wide prefetcher, creating it on first use."""
+    global _prefetcher #pylint: disable=global-statement,invalid-name
+    if _prefetcher is None:
+        _prefetcher = Prefetcher(get_page_cache(), get_config('PREFETCH_PAGES'),
+                                 get_config('PREFETCH_WORKERS'))
+    return _prefetcher
+
+def open_page(book, index):
+    """Open a page from the page cache if it's there, or else from the archive.
+
+    Returns a file object and the page size, like Comic.open_file().
+    """
+    data = get_page_cache().get((book.file_key(), index))
+    if data is not None:
+        return io.BytesIO(data), len(data)
+    return book.open_file(index)
+
+def read_page(book, index):
+    """Get the bytes of a page from the page cache if it's there, or else from the archive."""
+    data = get_page_cache().get((book.file_key(), index))
+    if data is None:
+        data = book.get_file(index)
+    return data
+
+def pages_to_prefetch(index, page_count, count, step=1, backward=False):
+    """Get the page indexes to read ahead after index, nearest first.
+
+    count is the number of page turns to read ahead and step the pages per
+    turn, so dual-page readers get two pages for each turn.  Right-to-left
+    books still turn to higher page numbers, only the layout is mirrored.
+    """
+    direction = -1 if backward else 1
+    ret = []
+    for offset in range(1, count * step + 1):
+        page = index + direction * offset
+        if 0 <= page < page_count:
+            ret.append(page)
+    return ret
+
+
+class PageCache(object):
+    """LRU cache of page bytes with a total size budget."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.pages = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Get the cached bytes for a page, or None."""
+        with self.lock:
+            data = self.pages.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.pages.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.pages
+
+    def put(self, key, data):
+        """Store page bytes, evicting the least recently used pages to stay in budget."""
+        # One page shouldn't be able to flush the whole cache.
+        if len(data) > self.max_bytes // 4:
+            return
+        with self.lock:
+            old = self.pages.pop(key, None)
+            if old is not None:
+                self.total -= len(old)
+            self.pages[key] = data
+            self.total += len(data)
+            while self.total > self.max_bytes:
+                evicted = self.pages.popitem(last=False)[1]
+                self.total -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        """Get the cache counters as a dictionary."""
+        with self.lock:
+            return {
+                'pages': len(self.pages),
+                'bytes': self.total,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class Prefetcher(object):
+    """Reads the next pages of a book into the page cache in background threads."""
+
+    def __init__(self, cache, count, workers):
+        self.cache = cache
+        self.count = count
+        self.executor = ThreadPoolExecutor(max_workers=workers) if count > 0 else None
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.last_pages = OrderedDict()
+
+    def schedule(self, book, index, user_id):
+        """Start reading ahead from a page that was just served.
+
+        Readers going back through a book get the pages before this one.
+        """
+        if self.executor is None:
+            return
+        reader = (user_id, book.path)
+        with self.lock:
+            backward = index < self.last_pages.get(reader, index)
+            self.last_pages.pop(reader, None)
+            self.last_pages[reader] = index
+            while len(self.last_pages) > MAX_TRACKED_READERS:
+                self.last_pages.popitem(last=False)
+        self.executor.submit(self.prefetch, book.path, book.rel_path, index, user_id, backward)
+
+    def prefetch(self, path, rel_path, index, user_id, backward=False):
+        """Read the pages after index into the cache.  Runs in a worker thread."""
+        with app.app_context():
+            try:
+                book = Comic(path)
+                book.rel_path = rel_path
+                meta = load_metadata(user_id, rel_path)
+                step = 2 if meta.dual_page else 1
+                pages = pages_to_prefetch(index, len(book.get_file_list()), self.count, step,
+                                          backward)
+                for page in pages:
+                    key = (book.file_key(), page)
+                    with self.lock:
+                        if key in self.pending or key in self.cache:
+                            continue
+                        self.pending.add(key)
+                    try:
+                        self.cache.put(key, book.get_file(page))
+                    finally:
+                        with self.lock:
+                            self.pending.discard(key)
+            except Exception as ex: #pylint: disable=broad-except
+                app.logger.warning('Error reading ahead in %s: %s', rel_path, ex)
+            finally:
+                db.session.remove()
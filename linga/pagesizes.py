@@ -0,0 +1,53 @@
+"""Measure pages in the background for manifests that don't record page sizes yet."""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from linga.app import (app, get_config)
+from linga.comics import Comic
+
+_size_reader = None #pylint: disable=invalid-name
+
+def get_size_reader():
+    """Get the process-wide page size reader, creating it on first use."""
+    global _size_reader #pylint: disable=global-statement,invalid-name
+    if _size_reader is None:
+        _size_reader = SizeReader(get_config('PAGE_SIZE_WORKERS'))
+    return _size_reader
+
+
+class SizeReader(object):
+    """Reads the image headers of a book's pages on a background thread.
+
+    Manifests are stored without page sizes, so requests never wait for
+    every page to be opened.  RAR books are measured from the pages
+    unpacked by the RAR cache, and are tried again on a later request if
+    they haven't been unpacked yet.
+    """
+
+    def __init__(self, workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = set()
+
+    def schedule(self, book):
+        """Start measuring a book's pages unless that's already under way."""
+        file_key = book.file_key()
+        with self.lock:
+            if file_key in self.pending:
+                return False
+            self.pending.add(file_key)
+        self.executor.submit(self.measure, book.path, file_key)
+        return True
+
+    def measure(self, path, file_key):
+        """Store the page sizes of a book.  Returns False if they couldn't all be read yet."""
+        try:
+            with app.app_context():
+                return Comic(path).measure_pages(unpacked_only=True)
+        except Exception as ex: #pylint: disable=broad-except
+            app.logger.warning('Error measuring pages of %s: %s', path, ex)
+            return False
+        finally:
+            with self.lock:
+                self.pending.discard(file_key)
@@ -0,0 +1,168 @@
+"""Warm the thumbnail cache for the whole library."""
+
+import argparse
+import os
+import os.path
+import sys
+
+from linga.app import (get_config, db)
+from linga.archives import archive_key
+from linga.comics import path_to_book
+from linga.diskcache import EVICTION_TARGET
+from linga.migrations import upgrade_database
+from linga.scanner import scan_book_list
+from linga.thumbnails import (get_thumbnail, get_cover, get_thumbnail_cache)
+from linga.tools import (Progress, worker_pool)
+
+STATE_FILE_NAME = 'pregenerate.state'
+
+def book_version(path):
+    """Get a string identifying the current version of a book file."""
+    path, mtime, size = archive_key(path)
+    return '%s\t%r\t%d' % (path, mtime, size)
+
+def load_state(state_path):
+    """Get the set of book versions already completed by earlier runs."""
+    try:
+        with open(state_path, encoding='utf-8') as fh:
+            return set(line.rstrip('\n') for line in fh)
+    except (IOError, OSError):
+        return set()
+
+def _generate(cache, func, *args):
+    """Get an image from func(*args) and return the bytes it added to the cache."""
+    misses = cache.misses
+    path = func(*args)
+    return os.path.getsize(path) if cache.misses > misses else 0
+
+def pregenerate_book(path, covers=True):
+    """Generate the thumbnails for one book, and record its page sizes.
+
+    Returns a tuple of the path, the number of pages, the number of images
+    generated and their total bytes, plus an error message if the book
+    couldn't be processed.
+    """
+    cache = get_thumbnail_cache()
+    start_misses = cache.misses
+    generated_bytes = 0
+    try:
+        book = path_to_book(path)
+        pages = len(book.get_file_list())
+        for index in range(pages):
+            generated_bytes += _generate(cache, get_thumbnail, book, index)
+        if covers and pages:
+            generated_bytes += _generate(cache, get_cover, book)
+        if not book.has_page_sizes():
+            book.measure_pages()
+    except Exception as ex: #pylint: disable=broad-except
+        return (path, 0, cache.misses - start_misses, generated_bytes, str(ex))
+    return (path, pages, cache.misses - start_misses, generated_bytes, None)
+
+def _pregenerate_worker(args):
+    return pregenerate_book(*args)
+
+
+class PregenerateProgress(Progress):
+    """Reports pregeneration progress and throughput."""
+
+    def __init__(self, total, out=sys.stdout, every=10):
+        super(PregenerateProgress, self).__init__(total, out, every)
+        self.generated = 0
+        self.generated_bytes = 0
+        self.stopped = False
+
+    def update(self, pages, generated, generated_bytes, error): #pylint: disable=arguments-differ
+        """Record a finished book, printing a status line every few books."""
+        self.generated += generated
+        self.generated_bytes += generated_bytes
+        super(PregenerateProgress, self).update(pages, error)
+
+    def details(self, elapsed):
+        return '%d images generated (%.1f/s)' % (self.generated, self.generated / elapsed)
+
+
+def pregenerate(base_path='', workers=None, limit=0, covers=True, state_path='',
+                restart=False, out=sys.stdout):
+    """Generate thumbnails for every book in the library that isn't done yet.
+
+    Stops once the thumbnail cache is nearly full, because from then on it
+    would evict thumbnails made earlier in the run while the state file
+    still lists their books as done.
+    """
+    base_path = base_path if base_path else get_config('BOOK_PATH')
+    if not state_path:
+        state_path = os.path.join(get_config('CACHE_PATH'), STATE_FILE_NAME)
+    done = set() if restart else load_state(state_path)
+
+    todo = []
+    for path in scan_book_list(base_path):
+        if book_version(path) not in done:
+            todo.append(path)
+    if limit:
+        todo = todo[:limit]
+
+    progress = PregenerateProgress(len(todo), out)
+    if not todo:
+        progress.report()
+        return progress
+
+    state_dir = os.path.dirname(state_path)
+    if state_dir and not os.path.isdir(state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+
+    max_bytes = get_config('THUMBNAIL_CACHE_SIZE')
+    cached_bytes = get_thumbnail_cache().size()
+    warned = False
+    pool = worker_pool(workers)
+    try:
+        with open(state_path, 'w' if restart else 'a', encoding='utf-8') as state:
+            jobs = [(path, covers) for path in todo]
+            for path, pages, generated, generated_bytes, error in pool.imap_unordered(
+                    _pregenerate_worker, jobs):
+                if error:
+                    out.write('Error in %s: %s\n' % (path, error))
+                else:
+                    state.write(book_version(path) + '\n')
+                    state.flush()
+                progress.update(pages, generated, generated_bytes, error)
+
+                used = cached_bytes + progress.generated_bytes
+                if used >= max_bytes * EVICTION_TARGET:
+                    out.write('Stopping: the thumbnail cache holds %.1f MB of its %.1f MB limit, '
+                              'and more thumbnails would evict ones made in this run.  Raise '
+                              'THUMBNAIL_CACHE_SIZE or use --limit.\n' % (
+                                  used / 1048576.0, max_bytes / 1048576.0))
+                    progress.stopped = True
+                    pool.terminate()
+                    break
+                estimate = used + progress.generated_bytes / progress.books * (
+                    progress.total - progress.books)
+                if estimate > max_bytes and not warned:
+                    out.write('Warning: about %.1f MB of thumbnails are needed, more than the '
+                              '%.1f MB THUMBNAIL_CACHE_SIZE.  Stopping when the cache is '
+                              'full.\n' % (estimate / 1048576.0, max_bytes / 1048576.0))
+                    warned = True
+    finally:
+        pool.close()
+        pool.join()
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Pregenerate page thumbnails and covers for the comic library.')
+    parser.add_argument('--path', default='', help='Library path (default: BOOK_PATH)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of worker processes (default: one per core)')
+    parser.add_argument('--limit', type=int, default=0,
+                        help='Process at most this many books in this run')
+    parser.add_argument('--no-covers', action='store_true', help="Don't generate covers")
+    parser.add_argument('--state', default='', help='File that records finished books')
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignore books finished by earlier runs')
+    args = parser.parse_args(argv)
+
+    upgrade_database(db)
+    progress = pregenerate(args.path, args.workers, args.limit, not args.no_covers,
+                           args.state, args.restart)
+    return 1 if progress.errors or progress.stopped else 0
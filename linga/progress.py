@@ -0,0 +1,137 @@
+"""Write-behind queue for reading progress."""
+
+import atexit
+import threading
+
+from linga.app import (app, get_config, db)
+from linga.comics import (ComicMetadata, get_metadata)
+from linga.metrics import timed
+
+_progress_queue = None #pylint: disable=invalid-name
+_queue_lock = threading.Lock() #pylint: disable=invalid-name
+
+def get_progress_queue():
+    """Get the process-wide progress queue, starting its writer on first use."""
+    global _progress_queue #pylint: disable=global-statement,invalid-name
+    with _queue_lock:
+        if _progress_queue is None:
+            _progress_queue = ProgressQueue()
+            interval = get_config('PROGRESS_FLUSH_INTERVAL')
+            if interval > 0:
+                writer = ProgressWriter(_progress_queue, interval)
+                writer.start()
+                atexit.register(writer.stop)
+        return _progress_queue
+
+def load_metadata(user_id, bookpath):
+    """Get a user's metadata for a book, including any progress not yet written."""
+    meta = get_metadata(user_id, bookpath)
+    if meta is None:
+        meta = ComicMetadata(user_id, bookpath)
+    return get_progress_queue().apply(meta)
+
+
+class ProgressQueue(object):
+    """Coalesces progress updates so only the latest state per (user, book) is written.
+
+    Updates are kept in memory until flush() writes them all in one
+    transaction.  Reads should go through apply() so they see queued state.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.flushing = {}
+
+    def update(self, user_id, bookpath, **fields):
+        """Queue new values for a book's metadata columns."""
+        with self.lock:
+            self.pending.setdefault((user_id, bookpath), {}).update(fields)
+        if get_config('PROGRESS_FLUSH_INTERVAL') <= 0:
+            self.flush()
+
+    def get(self, user_id, bookpath):
+        """Get the queued column values for a book, or an empty dictionary."""
+        key = (user_id, bookpath)
+        with self.lock:
+            ret = dict(self.flushing.get(key, {}))
+            ret.update(self.pending.get(key, {}))
+        return ret
+
+    def has_pending(self, user_id=None):
+        """Check if any updates, or any for one user, are waiting to be written."""
+        with self.lock:
+            keys = list(self.pending) + list(self.flushing)
+        return any(user_id is None or key[0] == user_id for key in keys)
+
+    def apply(self, meta):
+        """Copy queued values onto a metadata object and return it."""
+        for name, value in self.get(meta.user_id, meta.book_relpath).items():
+            setattr(meta, name, value)
+        return meta
+
+    def flush(self):
+        """Write every queued update in one transaction.  Returns the number of rows written.
+
+        If the write fails the updates are queued again, under any newer ones.
+        """
+        with self.flush_lock:
+            with self.lock:
+                self.flushing, self.pending = self.pending, {}
+                batch = self.flushing
+            if not batch:
+                return 0
+            try:
+                for (user_id, bookpath), fields in batch.items():
+                    meta = get_metadata(user_id, bookpath)
+                    if meta is None:
+                        meta = ComicMetadata(user_id, bookpath)
+                    for name, value in fields.items():
+                        setattr(meta, name, value)
+                    db.session.add(meta)
+                with timed('metadata_commit'):
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self.lock:
+                    for key, fields in batch.items():
+                        fields.update(self.pending.get(key, {}))
+                        self.pending[key] = fields
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = {}
+            return len(batch)
+
+
+class ProgressWriter(threading.Thread):
+    """Background thread that flushes a progress queue every few seconds."""
+
+    def __init__(self, queue, interval):
+        super(ProgressWriter, self).__init__(name='linga-progress-writer')
+        self.daemon = True
+        self.queue = queue
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Write the queued updates, logging rather than raising errors."""
+        with app.app_context():
+            try:
+                self.queue.flush()
+            except Exception as ex: #pylint: disable=broad-except
+                app.logger.error('Error saving reading progress: %s', ex)
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        """Stop the thread and write anything still queued."""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
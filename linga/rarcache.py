@@ -0,0 +1,105 @@
+"""Unpack RAR books once so their pages can be read as plain files."""
+
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rarfile
+
+from linga.app import (app, get_config)
+from linga.diskcache import (DiskCache, make_key)
+
+_rar_cache = None #pylint: disable=invalid-name
+
+def get_rar_cache():
+    """Get the process-wide RAR extraction cache, creating it on first use."""
+    global _rar_cache #pylint: disable=global-statement,invalid-name
+    if _rar_cache is None:
+        cache_path = os.path.join(get_config('CACHE_PATH'), 'rar')
+        _rar_cache = RarCache(DiskCache(cache_path, get_config('RAR_CACHE_SIZE')),
+                              os.path.join(get_config('CACHE_PATH'), 'rar-extract'),
+                              get_config('RAR_EXTRACT_WORKERS'))
+    return _rar_cache
+
+def extract_pages(path, names, dest):
+    """Unpack the named members of a RAR archive into dest.
+
+    extractall() runs the unpacker once for the whole list, so solid
+    archives are decompressed in a single pass.  Returns False if the file
+    isn't really a RAR archive.
+    """
+    try:
+        archive = rarfile.RarFile(path, 'r')
+    except rarfile.NotRarFile:
+        return False
+    with archive:
+        archive.extractall(dest, names)
+    return True
+
+
+class RarCache(object):
+    """Disk cache of pages unpacked from RAR books.
+
+    The first miss for a book unpacks all of its pages in the background;
+    until that finishes pages are read from the archive as before.  Pages
+    are keyed by the archive version, so changed books are unpacked again.
+    """
+
+    def __init__(self, cache, work_path, workers=1):
+        self.cache = cache
+        self.work_path = work_path
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.extracting = set()
+        self.unsupported = set()
+
+    def page_key(self, file_key, name):
+        """Get the cache key of a page of a particular version of a book."""
+        return make_key('rar', file_key, name)
+
+    def get(self, path, file_key, name, names):
+        """Get the path of an unpacked page, or None after starting to unpack the book."""
+        page_path = self.cache.get(self.page_key(file_key, name))
+        if page_path is None:
+            self.schedule(path, file_key, names)
+        return page_path
+
+    def schedule(self, path, file_key, names):
+        """Start unpacking a book in the background unless it's already being unpacked."""
+        with self.lock:
+            if file_key in self.extracting or file_key in self.unsupported:
+                return False
+            self.extracting.add(file_key)
+        self.executor.submit(self.extract, path, file_key, list(names))
+        return True
+
+    def extract(self, path, file_key, names):
+        """Unpack a book's pages into the cache.  Returns the number of pages stored."""
+        stored = 0
+        try:
+            if not os.path.isdir(self.work_path):
+                os.makedirs(self.work_path, exist_ok=True)
+            dest = tempfile.mkdtemp(dir=self.work_path)
+            try:
+                if not extract_pages(path, names, dest):
+                    with self.lock:
+                        self.unsupported.add(file_key)
+                    return 0
+                for name in names:
+                    page_path = os.path.normpath(os.path.join(dest, name))
+                    # Don't trust member names to stay inside the work directory.
+                    if not page_path.startswith(dest + os.sep) or not os.path.isfile(page_path):
+                        continue
+                    self.cache.put_file(self.page_key(file_key, name), page_path)
+                    stored += 1
+            finally:
+                shutil.rmtree(dest, ignore_errors=True)
+        except Exception as ex: #pylint: disable=broad-except
+            app.logger.warning('Error unpacking %s: %s', path, ex)
+        finally:
+            with self.lock:
+                self.extracting.discard(file_key)
+        return stored
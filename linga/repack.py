@@ -0,0 +1,233 @@
+"""Repack the library as uncompressed CBZ files for fast page access."""
+
+import argparse
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import zipfile
+import zlib
+
+from linga.app import (app, get_config, db)
+from linga.archives import get_archive_cache
+from linga.comics import (Comic, ComicMetadata, PageManifest, get_mime_type)
+from linga.migrations import upgrade_database
+from linga.scanner import scan_book_list
+from linga.tools import (Progress, worker_pool)
+
+# Member holding the page list of a repacked book.  It isn't an image, so
+# it's never listed as a page.
+MANIFEST_MEMBER = 'linga-manifest.json'
+
+class RepackError(Exception):
+    """Raised when a book can't be repacked safely."""
+
+
+def repacked_path(path):
+    """Get the path a book is repacked to."""
+    return os.path.splitext(path)[0] + '.cbz'
+
+def needs_repack(path):
+    """Determine if a book is a RAR archive or a zip with compressed members."""
+    if get_mime_type(path) == 'application/rar':
+        return True
+    with zipfile.ZipFile(path, 'r') as zf:
+        return any(info.compress_type != zipfile.ZIP_STORED for info in zf.infolist())
+
+def page_crc(data):
+    return zlib.crc32(data) & 0xffffffff
+
+def write_stored(path, book):
+    """Write a book's pages, in reading order, to a new uncompressed zip file.
+
+    Each page is checked against the CRC recorded in the source archive.
+    Other members, such as ComicInfo.xml, follow the pages.  Returns the
+    names of the pages.
+    """
+    # The manifest is built straight from the archive rather than through
+    # get_file_list(), so worker processes don't write to the database.
+    pages = book.build_manifest()
+    archive = book.get_archive()
+    page_names = set(page['name'] for page in pages)
+    others = [info.filename for info in archive.infolist()
+              if info.filename not in page_names and info.filename != MANIFEST_MEMBER
+              and not info.is_dir()]
+    embedded = []
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for page in pages:
+            data = archive.read(page['name'])
+            if page['crc'] is not None and page_crc(data) != page['crc']:
+                raise RepackError('CRC mismatch in %s' % page['name'])
+            zf.writestr(page['name'], data)
+            info = zf.getinfo(page['name'])
+            embedded.append({'name': page['name'], 'offset': info.header_offset,
+                             'size': info.file_size, 'crc': info.CRC})
+        for name in others:
+            zf.writestr(name, archive.read(name))
+        zf.writestr(MANIFEST_MEMBER, json.dumps({'version': 1, 'pages': embedded},
+                                                separators=(',', ':')))
+    return [page['name'] for page in pages]
+
+def verify_stored(path, names):
+    """Check that a repacked file holds the given pages, in order, with good CRCs."""
+    with zipfile.ZipFile(path, 'r') as zf:
+        bad = zf.testzip()
+        if bad is not None:
+            raise RepackError('CRC mismatch in %s after writing' % bad)
+        written = [info.filename for info in zf.infolist()][:len(names)]
+    if written != names:
+        raise RepackError('Pages out of order after writing')
+
+def repack_book(path):
+    """Repack one book as an uncompressed CBZ next to the original.
+
+    The new file is written under a temporary name and renamed into place, so
+    readers only ever see a complete archive.  A RAR book's original file is
+    removed once the CBZ is in place.  Returns a tuple of the old path, the
+    new path, the number of pages and the old and new sizes, plus an error
+    message if the book couldn't be repacked.
+    """
+    new_path = repacked_path(path)
+    old_size = 0
+    tmp_path = None
+    try:
+        old_size = os.path.getsize(path)
+        if new_path != path and os.path.exists(new_path):
+            raise RepackError('%s already exists' % new_path)
+        book = Comic(path)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        os.close(handle)
+        names = write_stored(tmp_path, book)
+        verify_stored(tmp_path, names)
+        shutil.copymode(path, tmp_path)
+        get_archive_cache().discard(path)
+        os.replace(tmp_path, new_path)
+        tmp_path = None
+        if new_path != path:
+            os.remove(path)
+        return (path, new_path, len(names), old_size, os.path.getsize(new_path), None)
+    except Exception as ex: #pylint: disable=broad-except
+        return (path, None, 0, old_size, 0, str(ex))
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def library_relpath(path, base_path=''):
+    """Get the path reading state is stored under for a book.
+
+    That's the path relative to BOOK_PATH.  A book outside BOOK_PATH, such
+    as one in a copy of the library mounted elsewhere, is taken relative to
+    base_path, the directory being repacked, and a warning is logged.
+    """
+    path = os.path.abspath(path)
+    book_path = os.path.join(os.path.abspath(get_config('BOOK_PATH')), '')
+    if path.startswith(book_path):
+        return path[len(book_path):]
+    base_path = os.path.abspath(base_path if base_path else get_config('BOOK_PATH'))
+    app.logger.warning('%s is outside BOOK_PATH, moving reading state relative to %s',
+                       path, base_path)
+    return os.path.relpath(path, base_path)
+
+def move_metadata(old_path, new_path, base_path=''):
+    """Point users' reading state at a book's new path and drop its old page manifest.
+
+    If a user already has state for the new path, the most recently used copy wins.
+    """
+    if old_path != new_path:
+        old_relpath = library_relpath(old_path, base_path)
+        new_relpath = library_relpath(new_path, base_path)
+        rows = db.session.query(ComicMetadata).filter_by(book_relpath=old_relpath).all()
+        for row in rows:
+            existing = db.session.query(ComicMetadata) \
+                .filter_by(user_id=row.user_id, book_relpath=new_relpath).first()
+            if existing is not None:
+                if existing.last_access >= row.last_access:
+                    db.session.delete(row)
+                    continue
+                db.session.delete(existing)
+                db.session.flush()
+            row.book_relpath = new_relpath
+    db.session.query(PageManifest).filter_by(book_path=os.path.abspath(old_path)).delete()
+    db.session.commit()
+
+def _repack_worker(path):
+    return repack_book(path)
+
+
+class RepackProgress(Progress):
+    """Reports repacking progress and throughput."""
+
+    def __init__(self, total, out=sys.stdout, every=10):
+        super(RepackProgress, self).__init__(total, out, every)
+        self.old_bytes = 0
+        self.new_bytes = 0
+
+    def update(self, pages, old_size, new_size, error): #pylint: disable=arguments-differ
+        """Record a finished book, printing a status line every few books."""
+        if not error:
+            self.old_bytes += old_size
+            self.new_bytes += new_size
+        super(RepackProgress, self).update(0 if error else pages, error)
+
+    def details(self, elapsed):
+        return '%.1f MB -> %.1f MB' % (self.old_bytes / 1048576.0, self.new_bytes / 1048576.0)
+
+
+def repack(base_path='', workers=None, limit=0, dry_run=False, out=sys.stdout):
+    """Repack every RAR or compressed zip book in the library."""
+    base_path = base_path if base_path else get_config('BOOK_PATH')
+    todo = []
+    for path in scan_book_list(base_path):
+        try:
+            if needs_repack(path):
+                todo.append(path)
+        except (IOError, OSError, zipfile.BadZipFile) as ex:
+            out.write('Error in %s: %s\n' % (path, ex))
+    if limit:
+        todo = todo[:limit]
+
+    progress = RepackProgress(len(todo), out)
+    if dry_run:
+        for path in todo:
+            out.write('%s\n' % path)
+    if dry_run or not todo:
+        progress.report()
+        return progress
+
+    pool = worker_pool(workers)
+    try:
+        for path, new_path, pages, old_size, new_size, error in pool.imap_unordered(
+                _repack_worker, todo):
+            if error:
+                out.write('Error in %s: %s\n' % (path, error))
+            else:
+                try:
+                    move_metadata(path, new_path, base_path)
+                except Exception as ex: #pylint: disable=broad-except
+                    db.session.rollback()
+                    out.write('Error moving reading state for %s: %s\n' % (path, ex))
+            progress.update(pages, old_size, new_size, error)
+    finally:
+        pool.close()
+        pool.join()
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Repack RAR and compressed zip books as uncompressed CBZ files.')
+    parser.add_argument('--path', default='', help='Library path (default: BOOK_PATH)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of worker processes (default: one per core)')
+    parser.add_argument('--limit', type=int, default=0,
+                        help='Process at most this many books in this run')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='List the books that would be repacked')
+    args = parser.parse_args(argv)
+
+    if not args.dry_run:
+        upgrade_database(db)
+    progress = repack(args.path, args.workers, args.limit, args.dry_run)
+    return 1 if progress.errors else 0
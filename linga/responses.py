@@ -0,0 +1,225 @@
+"""Helpers for sending images and archives with caching and byte range support."""
+
+import os
+from calendar import timegm
+
+from werkzeug.urls import url_quote
+from werkzeug.wsgi import wrap_file
+from flask import request
+
+from linga.app import app
+from linga.archives import EntryFile
+
+# Chunk size for streamed responses
+STREAM_BUFFER_SIZE = 64 * 1024
+# Cache lifetime for responses at URLs that include the archive version
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Requests for more (non-overlapping) ranges than this get the whole file
+MAX_RANGES = 16
+
+def http_date_timestamp(date):
+    """Convert a parsed HTTP date header to a Unix timestamp."""
+    return timegm(date.utctimetuple())
+
+def is_not_modified(etag, last_modified):
+    """Check if the client's cached copy matches the given validators."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return int(last_modified) <= http_date_timestamp(request.if_modified_since)
+    return False
+
+def set_cache_headers(response, etag, last_modified, version):
+    """Add validators, and cache forever if the URL is tied to the current archive version."""
+    response.set_etag(etag)
+    response.last_modified = int(last_modified)
+    response.headers.pop('Expires', None)
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = 'private, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def send_cached(book, etag, make_response):
+    """Send a 304 if the client's copy is current, or else the result of make_response()."""
+    if is_not_modified(etag, book.mtime()):
+        response = app.response_class(status=304)
+    else:
+        response = make_response()
+    return set_cache_headers(response, etag, book.mtime(), book.version())
+
+def if_range_matches(etag, last_modified):
+    """Check that an If-Range header, if any, matches the current representation."""
+    if 'If-Range' not in request.headers:
+        return True
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return etag is not None and if_range.etag == etag
+    if if_range.date is not None and last_modified is not None:
+        return int(last_modified) == http_date_timestamp(if_range.date)
+    return False
+
+def parse_range_header(value):
+    """Parse a bytes Range header into (start, end) pairs, end exclusive or None.
+
+    Suffix ranges are (None, length).  Unlike werkzeug's parser this
+    accepts ranges in any order, as RFC 7233 allows.  Returns None if the
+    header is invalid.
+    """
+    units, equals, spec = value.partition('=')
+    if units.strip().lower() != 'bytes' or not equals:
+        return None
+    ranges = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, dash, last = item.partition('-')
+        first = first.strip()
+        last = last.strip()
+        if not dash or not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+            return None
+        if not first:
+            if not last:
+                return None
+            ranges.append((None, int(last)))
+        else:
+            start = int(first)
+            end = int(last) + 1 if last else None
+            if end is not None and end <= start:
+                return None
+            ranges.append((start, end))
+    return ranges if ranges else None
+
+def requested_ranges(size, etag=None, last_modified=None):
+    """Get the byte ranges to send as sorted (start, end) pairs, end exclusive.
+
+    Returns None if the whole file should be sent, or an empty list if none
+    of the requested ranges can be satisfied.  Overlapping and adjacent
+    ranges are merged.
+    """
+    header = request.headers.get('Range')
+    parsed = parse_range_header(header) if header else None
+    if parsed is None or not if_range_matches(etag, last_modified):
+        return None
+    ranges = []
+    for start, end in parsed:
+        if start is None:
+            # A zero length suffix selects nothing, so it's never satisfiable.
+            start = max(size - end, 0)
+            end = size
+        elif end is None or end > size:
+            end = size
+        if start < end:
+            ranges.append((start, end))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+def skip_to(stream, pos, start):
+    """Move a stream that's at pos forward to start."""
+    if start <= pos:
+        return
+    seekable = getattr(stream, 'seekable', None)
+    if seekable is not None and seekable():
+        stream.seek(start)
+        return
+    while pos < start:
+        data = stream.read(min(STREAM_BUFFER_SIZE, start - pos))
+        if not data:
+            break
+        pos += len(data)
+
+def iter_range(stream, length):
+    """Yield the next length bytes of a stream in chunks."""
+    while length > 0:
+        data = stream.read(min(STREAM_BUFFER_SIZE, length))
+        if not data:
+            break
+        length -= len(data)
+        yield data
+
+def iter_single_range(stream, start, end):
+    """Yield one byte range of a stream, closing it when done."""
+    try:
+        skip_to(stream, 0, start)
+        for data in iter_range(stream, end - start):
+            yield data
+    finally:
+        stream.close()
+
+def multipart_headers(ranges, size, mimetype, boundary):
+    """Get the part headers of a multipart/byteranges body."""
+    return [('--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+        boundary, mimetype, start, end - 1, size)).encode('latin-1') for start, end in ranges]
+
+def iter_multipart(stream, ranges, headers, boundary):
+    """Yield a multipart/byteranges body, closing the stream when done."""
+    try:
+        pos = 0
+        for (start, end), header in zip(ranges, headers):
+            yield header
+            skip_to(stream, pos, start)
+            for data in iter_range(stream, end - start):
+                yield data
+            pos = end
+            yield b'\r\n'
+        yield ('--%s--\r\n' % boundary).encode('latin-1')
+    finally:
+        stream.close()
+
+def send_stream(stream, size, mimetype, etag=None, last_modified=None):
+    """Send a file object in chunks without reading it into memory first.
+
+    Range requests get a 206 with the requested bytes, or a multipart body if
+    several ranges are asked for.  Ranges of uncompressed archive members are
+    still sent as file objects, so the server can use sendfile.
+    """
+    ranges = requested_ranges(size, etag, last_modified)
+    if ranges is None:
+        data = wrap_file(request.environ, stream, STREAM_BUFFER_SIZE)
+        ret = app.response_class(data, mimetype=mimetype, direct_passthrough=True)
+        ret.content_length = size
+    elif not ranges:
+        stream.close()
+        ret = app.response_class(status=416)
+        ret.headers['Content-Range'] = 'bytes */%d' % size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        if isinstance(stream, EntryFile):
+            data = wrap_file(request.environ,
+                             EntryFile(stream.fh, stream.start + start, end - start),
+                             STREAM_BUFFER_SIZE)
+        else:
+            data = iter_single_range(stream, start, end)
+        ret = app.response_class(data, status=206, mimetype=mimetype, direct_passthrough=True)
+        ret.content_length = end - start
+        ret.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end - 1, size)
+    else:
+        boundary = os.urandom(12).hex()
+        headers = multipart_headers(ranges, size, mimetype, boundary)
+        data = iter_multipart(stream, ranges, headers, boundary)
+        ret = app.response_class(data, status=206, direct_passthrough=True,
+                                 content_type='multipart/byteranges; boundary=' + boundary)
+        ret.content_length = (sum(len(header) + end - start + 2
+                                  for (start, end), header in zip(ranges, headers))
+                              + len(boundary) + 6)
+    ret.accept_ranges = 'bytes'
+    return ret
+
+def set_attachment(response, filename):
+    """Mark a response as a download with the given file name."""
+    try:
+        filename.encode('latin-1')
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    except UnicodeEncodeError:
+        response.headers.set('Content-Disposition', 'attachment',
+                             **{'filename*': "UTF-8''%s" % url_quote(filename, safe=b'')})
+    return response
@@ -0,0 +1,141 @@
+"""Walk the whole library with directories listed in parallel."""
+
+import argparse
+import os
+import os.path
+import sys
+import threading
+import time
+from concurrent.futures import (ThreadPoolExecutor, wait, FIRST_COMPLETED)
+
+from linga.app import get_config
+from linga.comics import (ComicLister, COMIC_ARCHIVE_EXTENSIONS)
+
+def is_book_name(name):
+    """Determine if a directory entry name looks like a comic archive."""
+    return os.path.splitext(name)[1].lower() in COMIC_ARCHIVE_EXTENSIONS
+
+def scan_dir(path):
+    """List one directory, returning the paths of its books and of its subdirectories.
+
+    os.scandir() gets the entry types with the listing, so on most
+    filesystems only symlinks and possible books need another stat().
+    """
+    books = []
+    dirs = []
+    count = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            count += 1
+            if entry.is_dir():
+                dirs.append(entry.path)
+            elif is_book_name(entry.name) and entry.is_file():
+                books.append(entry.path)
+    return books, dirs, count
+
+def stat_dir(path, known_mtime=None):
+    """Get a directory's mtime and, unless it equals known_mtime, its entries.
+
+    The entries are a dictionary of the names of possible books to their
+    os.stat_result, and a list of subdirectory names, or None if the
+    directory wasn't listed.  DirEntry.stat() reuses what scandir() read
+    where the platform allows, and is only called for possible books.
+    """
+    mtime = os.stat(path).st_mtime
+    if mtime == known_mtime:
+        return mtime, None
+    books = {}
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif is_book_name(entry.name) and entry.is_file():
+                    books[entry.name] = entry.stat()
+            except OSError:
+                continue
+    return mtime, (books, dirs)
+
+def scan_book_list(base_path='', workers=None, stats=None):
+    """Get the sorted paths of every book under base_path, like ComicLister.get_book_list().
+
+    Up to workers directories are listed at once, which hides the round
+    trips of network filesystems.  Pass a ScanStats to collect throughput.
+    """
+    base_path = base_path if base_path else get_config('BOOK_PATH')
+    workers = workers if workers else get_config('SCAN_WORKERS')
+    stats = stats if stats is not None else ScanStats()
+    ret = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = set([executor.submit(scan_dir, base_path)])
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                books, dirs, count = future.result()
+                ret.extend(books)
+                stats.update(len(books), count)
+                for path in dirs:
+                    running.add(executor.submit(scan_dir, path))
+    stats.finish()
+    ret.sort()
+    return ret
+
+
+class ScanStats(object):
+    """Counts the directories and entries listed by a scan and how fast it went."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.end = None
+        self.dirs = 0
+        self.entries = 0
+        self.books = 0
+
+    def update(self, books, entries):
+        """Record a listed directory."""
+        with self.lock:
+            self.dirs += 1
+            self.entries += entries
+            self.books += books
+
+    def finish(self):
+        self.end = time.time()
+
+    def elapsed(self):
+        """Get the seconds the scan took, or has taken so far."""
+        end = self.end if self.end is not None else time.time()
+        return max(end - self.start, 0.001)
+
+    def report(self):
+        elapsed = self.elapsed()
+        return ('%d books in %d directories, %d entries in %.2fs '
+                '(%.1f dirs/s, %.1f entries/s)' % (
+                    self.books, self.dirs, self.entries, elapsed,
+                    self.dirs / elapsed, self.entries / elapsed))
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(
+        description='Scan the comic library and report how long it takes.')
+    parser.add_argument('--path', default='', help='Library path (default: BOOK_PATH)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of directories listed at once (default: SCAN_WORKERS)')
+    parser.add_argument('--verify', action='store_true',
+                        help='Also do a sequential scan and check that the results match')
+    args = parser.parse_args(argv)
+
+    path = args.path if args.path else get_config('BOOK_PATH')
+    stats = ScanStats()
+    books = scan_book_list(path, args.workers, stats)
+    out.write('Parallel scan: %s\n' % stats.report())
+    if args.verify:
+        start = time.time()
+        expected = ComicLister(path).get_book_list()
+        out.write('Sequential scan: %d books in %.2fs\n' % (len(expected), time.time() - start))
+        if books != expected:
+            out.write('Results differ\n')
+            return 1
+        out.write('Results match\n')
+    return 0
@@ -0,0 +1,120 @@
+"""Full-text search over the titles and paths of catalogued books.
+
+The index is an SQLite FTS5 table whose rowids are the book_id values of
+the linga_catalog_books rows, kept in step by the catalog as it adds and
+removes books.  Databases without FTS5 fall back to substring matching.
+"""
+
+import re
+
+from sqlalchemy import (event, func, select, and_, table, column)
+
+from linga.app import db
+from linga.comics import filename_to_bookname
+
+SEARCH_TABLE = 'linga_catalog_search'
+BOOKS_TABLE = 'linga_catalog_books'
+# Relative weights of title and path matches when ranking results
+TITLE_WEIGHT = 10.0
+PATH_WEIGHT = 1.0
+
+def fts_supported(connection):
+    """Check if the database can hold an FTS5 index."""
+    if connection.engine.dialect.name != 'sqlite':
+        return False
+    return bool(connection.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+def has_search_index(connection):
+    """Check if the search index table exists."""
+    if connection.engine.dialect.name != 'sqlite':
+        return False
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)) \
+        .scalar() is not None
+
+def create_search_index(connection):
+    """Create the search index table if the database supports it.  Returns True if it exists."""
+    if not fts_supported(connection):
+        return False
+    connection.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(title, path)' % SEARCH_TABLE)
+    return True
+
+def index_books(connection, relpaths):
+    """Add books to the search index.  Their catalog rows must already be flushed."""
+    if relpaths and has_search_index(connection):
+        connection.execute(
+            'INSERT INTO %s (rowid, title, path) SELECT book_id, ?, relpath FROM %s '
+            'WHERE relpath = ?' % (SEARCH_TABLE, BOOKS_TABLE),
+            [(filename_to_bookname(relpath), relpath) for relpath in relpaths])
+
+def unindex_books(connection, relpaths):
+    """Remove books from the search index.  Call before deleting their catalog rows."""
+    if relpaths and has_search_index(connection):
+        connection.execute(
+            'DELETE FROM %s WHERE rowid IN (SELECT book_id FROM %s WHERE relpath = ?)' % (
+                SEARCH_TABLE, BOOKS_TABLE),
+            [(relpath,) for relpath in relpaths])
+
+def unindex_dirs(connection, relpaths):
+    """Remove the books directly in the given directories from the search index."""
+    if relpaths and has_search_index(connection):
+        connection.execute(
+            'DELETE FROM %s WHERE rowid IN (SELECT book_id FROM %s WHERE parent = ?)' % (
+                SEARCH_TABLE, BOOKS_TABLE),
+            [(relpath,) for relpath in relpaths])
+
+def query_tokens(query):
+    """Split a search query into words."""
+    return re.findall(r'\w+', query, re.UNICODE)
+
+def match_expression(tokens):
+    """Build an FTS5 query matching books that have every token as a word or word prefix."""
+    return ' '.join('"%s"*' % token for token in tokens)
+
+def search_books(query, offset=0, limit=50):
+    """Find books by title or path.
+
+    Returns the total number of matches and the relative paths of one page
+    of them, best matches first.
+    """
+    tokens = query_tokens(query)
+    if not tokens:
+        return 0, []
+    connection = db.session.connection()
+    if not has_search_index(connection):
+        return like_search(tokens, offset, limit)
+    match = match_expression(tokens)
+    total = connection.execute(
+        'SELECT count(*) FROM %s WHERE %s MATCH ?' % (SEARCH_TABLE, SEARCH_TABLE),
+        (match,)).scalar()
+    rows = connection.execute(
+        'SELECT path FROM %s WHERE %s MATCH ? ORDER BY bm25(%s, %r, %r), path '
+        'LIMIT ? OFFSET ?' % (SEARCH_TABLE, SEARCH_TABLE, SEARCH_TABLE, TITLE_WEIGHT,
+                              PATH_WEIGHT),
+        (match, limit, offset))
+    return total, [row[0] for row in rows]
+
+def like_search(tokens, offset, limit):
+    """Find books whose paths contain every token, for databases without FTS5."""
+    relpath = column('relpath')
+    # Words can contain underscores, but never the other LIKE wildcard.
+    condition = and_(*[relpath.like('%%%s%%' % token.replace('_', '\\_'), escape='\\')
+                       for token in tokens])
+    books = table(BOOKS_TABLE, relpath)
+    total = db.session.execute(
+        select([func.count()]).select_from(books).where(condition)).scalar()
+    rows = db.session.execute(
+        select([relpath]).select_from(books).where(condition)
+        .order_by(relpath).offset(offset).limit(limit))
+    return total, [row[0] for row in rows]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_index(target, connection, **kw): #pylint: disable=unused-argument
+    create_search_index(connection)
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_index(target, connection, **kw): #pylint: disable=unused-argument
+    if connection.engine.dialect.name == 'sqlite':
+        connection.execute('DROP TABLE IF EXISTS %s' % SEARCH_TABLE)
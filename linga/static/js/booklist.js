@@ -0,0 +1,122 @@
+/*globals $ */
+
+// Directory tree for the book list that fetches each directory's entries
+// from the server the first time it's opened.
+function BookListing(base_node) {
+    this.$base = $(base_node);
+
+    this.selectors = {
+        dir: '.item-dir',
+        dir_name: '.item-dir > .dir-name',
+        more: '.load-more > a'
+    };
+
+    this.makeItem = function (item) {
+        var $item, $link = $('<a></a>').attr('href', item.url).text(item.name);
+        if (item.type === 'dir') {
+            $item = $('<li class="item-dir closed"></li>').data('url', item.url);
+            $link.attr('href', '#').addClass('dir-name').appendTo($item);
+            $('<span class="dir-count"></span>')
+                .text(' (' + item.book_count + ')')
+                .appendTo($item);
+        } else {
+            $item = $('<li class="item-book"></li>').append($link);
+            if (item.dir) {
+                $('<span class="book-dir"></span>').text(' - ' + item.dir).appendTo($item);
+            }
+        }
+        return $item;
+    };
+
+    // Append the page of entries at url to a list, with a link to the next page.
+    this.loadPage = function ($list, url) {
+        var self = this;
+        $list.addClass('loading');
+        return $.getJSON(url).done(function (data) {
+            for (var i = 0; i < data.items.length; i++) {
+                $list.append(self.makeItem(data.items[i]));
+            }
+            if (data.next) {
+                $('<li class="load-more"><a href="#">More&hellip;</a></li>')
+                    .data('url', data.next)
+                    .appendTo($list);
+            }
+        }).fail(function () {
+            $('<li class="load-error">Error loading books</li>').appendTo($list);
+        }).always(function () {
+            $list.removeClass('loading');
+        });
+    };
+
+    this.toggleDir = function ($dir) {
+        $dir.toggleClass('closed');
+        if (! $dir.data('loaded')) {
+            $dir.data('loaded', true);
+            this.loadPage($('<ul></ul>').appendTo($dir), $dir.data('url'));
+        }
+    };
+
+    this.bindEvents = function () {
+        var self = this;
+        this.$base.on('click', this.selectors.dir_name, function (e) {
+            e.preventDefault();
+            self.toggleDir($(this).closest(self.selectors.dir));
+        });
+        this.$base.on('click', this.selectors.more, function (e) {
+            e.preventDefault();
+            var $more = $(this).parent();
+            self.loadPage($more.parent(), $more.data('url'));
+            $more.remove();
+        });
+    };
+
+    this.init = function () {
+        this.bindEvents();
+        this.loadPage($('<ul></ul>').appendTo(this.$base), this.$base.data('url'));
+    };
+}
+
+// Search box that shows matching books in place of the directory tree.
+function BookSearch(form_node, results_node, listing_node) {
+    this.$form = $(form_node);
+    this.$input = this.$form.find('input[name=q]');
+    this.$results = $(results_node);
+    this.$listing = $(listing_node);
+    this.results = new BookListing(results_node);
+    this.lastQuery = '';
+
+    this.search = function () {
+        var query = $.trim(this.$input.val());
+        if (query === this.lastQuery) {
+            return;
+        }
+        this.lastQuery = query;
+        this.$results.empty();
+        if (query) {
+            this.$listing.hide();
+            this.$results.show();
+            this.results.loadPage($('<ul></ul>').appendTo(this.$results),
+                                  this.$form.attr('action') + '?' + $.param({q: query}));
+        } else {
+            this.$results.hide();
+            this.$listing.show();
+        }
+    };
+
+    this.init = function () {
+        var self = this,
+            timer = null;
+        this.results.bindEvents();
+        this.$form.on('submit', function (e) {
+            e.preventDefault();
+            self.search();
+        });
+        // Search as the user types, once they pause.
+        this.$input.on('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                self.search();
+            }, 300);
+        });
+    };
+}
@@ -4,8 +4,15 @@ function ComicPage(page, parent) {
     this.url = page.url;
     this.page_url = page.page_url;
     this.thumb_url = page.thumb_url;
+    this.sprite_url = page.sprite_url;
+    this.sprite_x = page.sprite_x;
+    this.sprite_y = page.sprite_y;
     this.name = page.name;
     this.index = page.index;
+    this.width = page.width;
+    this.height = page.height;
+    // Wide pages are two-page spreads, which are shown on their own.
+    this.isSpread = Boolean(page.width && page.height && page.width > page.height);
 
     this.isCurrentPage = ko.computed(function() {
         return this == parent.currentPage();
@@ -16,6 +23,34 @@ function ComicPage(page, parent) {
     };
 }
 
+// Build the page list from a book's manifest by filling in its URL templates.
+function expandManifest(manifest) {
+    var pages = [],
+        sprite = manifest.sprite,
+        fill = function (template, key, value) {
+            return template.replace('{' + key + '}', value);
+        };
+    for (var i = 0; i < manifest.count; i++) {
+        var index = i + 1,
+            start = Math.floor(i / sprite.pages) * sprite.pages + 1,
+            offset = index - start,
+            size = manifest.sizes ? manifest.sizes[i] : [null, null];
+        pages.push({
+            file: manifest.files[i],
+            index: index,
+            url: fill(manifest.urls.page, 'page', index),
+            page_url: fill(manifest.urls.read, 'page', index),
+            thumb_url: fill(manifest.urls.thumb, 'page', index),
+            sprite_url: fill(manifest.urls.sprite, 'start', start),
+            sprite_x: offset % sprite.columns * sprite.width,
+            sprite_y: Math.floor(offset / sprite.columns) * sprite.height,
+            width: size[0],
+            height: size[1]
+        });
+    }
+    return pages;
+}
+
 function ComicViewModel() {
     this.pages = ko.observableArray([]);
     // Current page number, starting from 1
@@ -28,6 +63,11 @@ function ComicViewModel() {
     this.lastPageRead = ko.observable(1);
     this.relpath = ko.observable('');
     this.showAllUi = ko.observable(false);
+    // Scaled page sizes are multiples of the step, up to the maximum.  Both
+    // come from the server's config in populateData.
+    this.variantStep = 1;
+    this.variantMaxSize = Infinity;
+    this.screenCookie = '';
     
     this.selectors = {
         main_image: '.page-image.main',
@@ -74,6 +114,30 @@ function ComicViewModel() {
         return this.pages()[this.pageNumber() - 1];
     }, this);
     
+    // Number of pages shown starting at a page number: two in dual-page mode,
+    // unless either page is a spread or there's no next page.
+    this.pagesShownAt = function (number) {
+        var page = this.pages()[number - 1],
+            next = this.pages()[number];
+        if (! this.dualPage() || ! page || ! next || page.isSpread || next.isSpread) {
+            return 1;
+        }
+        return 2;
+    };
+
+    this.showSecondary = ko.computed(function () {
+        return this.pagesShownAt(this.pageNumber()) === 2;
+    }, this);
+
+    this.forwardStep = function () {
+        return this.dualPage() ? this.pagesShownAt(this.pageNumber()) : 1;
+    };
+
+    this.backwardStep = function () {
+        var number = this.pageNumber();
+        return number > 2 && this.pagesShownAt(number - 2) === 2 ? 2 : 1;
+    };
+
     this.goToPage = function (index, skip_update) {
         if (0 < index && index <= this.pageCount()) {
             this.pageNumber(index);
@@ -87,9 +151,10 @@ function ComicViewModel() {
 
     this.nextPageLeft = ko.computed(function() {
         var curr_index = this.pageNumber() - 1;
-        var offset = this.dualPage() ? 2 : 1;
+        var offset = this.backwardStep();
         var next_index = Math.max(0, curr_index - offset);
         if (this.rightToLeft()) {
+            offset = this.forwardStep();
             next_index = Math.min(this.pageCount() - 1, curr_index + offset);
             if (this.dualPage() && this.pageCount() - 1 < curr_index + offset) {
                 next_index = curr_index;
@@ -100,25 +165,25 @@ function ComicViewModel() {
     
     this.nextPageRight = ko.computed(function() {
         var curr_index = this.pageNumber() - 1;
-        var offset = this.dualPage() ? 2 : 1;
+        var offset = this.forwardStep();
         var next_index = Math.min(this.pageCount() - 1, curr_index + offset);
         if (this.dualPage() && this.pageCount() - 1 < curr_index + offset) {
             next_index = curr_index;
         }
         if (this.rightToLeft()) {
-            next_index = Math.max(0, curr_index - offset);
+            next_index = Math.max(0, curr_index - this.backwardStep());
         }
         return this.pages()[next_index];
     }, this);
 
     this.goToNext = function () {
         var curr_page = this.pageNumber();
-        this.goToPage(curr_page + (this.dualPage() ? 2 : 1));
+        this.goToPage(curr_page + this.forwardStep());
     };
     
     this.goToPrev = function () {
         var curr_page = this.pageNumber();
-        this.goToPage(curr_page - (this.dualPage() ? 2 : 1));
+        this.goToPage(curr_page - this.backwardStep());
     };
 
     this.pageRight = function () {
@@ -186,22 +251,83 @@ function ComicViewModel() {
         this.dualPage(pageData.dualPage);
         this.fitMode(pageData.fitMode);
         this.lastPageRead(pageData.lastPage);
+        this.variantStep = pageData.variantStep || 1;
+        this.variantMaxSize = pageData.variantMaxSize || Infinity;
+        this.screenCookie = pageData.screenCookie || '';
         
         this.addPages(pageData.pages);
     };
+
+    // Fetch the page manifest and show the book, or an error if it can't be loaded.
+    this.load = function (pageData) {
+        var self = this;
+        return $.getJSON(pageData.manifestUrl).done(function (manifest) {
+            pageData.pages = expandManifest(manifest);
+            self.populateData(pageData);
+            ko.applyBindings(self);
+            self.initEvents();
+            self.goToPage(self.lastPageRead(), true);
+        }).fail(function () {
+            self.showAlert('Error loading the pages of this book', 'danger');
+        });
+    };
+    
+    this.supportsWebp = (function () {
+        var canvas = document.createElement('canvas');
+        return canvas.toDataURL && canvas.toDataURL('image/webp').indexOf('data:image/webp') === 0;
+    })();
+    
+    // Round a size in pixels up to the server's variant step, within its maximum.
+    this.variantSize = function (pixels) {
+        var step = this.variantStep;
+        return Math.min(Math.max(Math.ceil(pixels / step), 1) * step, this.variantMaxSize);
+    };
+    
+    // Get the image URL for a page, scaled on the server to the window when
+    // the page is fitted to it.  Sizes are rounded up so resizes reuse images.
+    this.pageSrc = function (page) {
+        var ratio = window.devicePixelRatio || 1,
+            width = this.variantSize($(window).width() * ratio),
+            height = this.variantSize($(window).height() * ratio),
+            params = '';
+        if (this.screenCookie) {
+            // Lets the server put the same sizes in the next book page it renders.
+            document.cookie = this.screenCookie + '=' +
+                [width, height, this.supportsWebp ? 'webp' : 'jpeg'].join(',') +
+                '; path=/; SameSite=Lax';
+        }
+        if (this.fitMode() === 'width') {
+            params = '&w=' + width;
+        } else if (this.fitMode() === 'height') {
+            params = '&h=' + height;
+        }
+        if (params && this.supportsWebp) {
+            params += '&fmt=webp';
+        }
+        return page.url + params;
+    };
+    
+    // Reserve a page's space before it loads, using the size from the manifest.
+    this.reserveSpace = function ($img, page) {
+        var known = page && page.width && page.height;
+        $img.css('aspect-ratio', known ? page.width + ' / ' + page.height : '');
+    };
     
     this.setPageInDom = function () {
-        if (this.$image.attr('src') !== this.currentPage().url) {
+        var src = this.pageSrc(this.currentPage());
+        if (this.$image.attr('src') !== src) {
             this.$image.closest(this.selectors.image_container).addClass('loading');
-            this.$image.attr('src', this.currentPage().url);
+            this.reserveSpace(this.$image, this.currentPage());
+            this.$image.attr('src', src);
             
             var next_page = this.pages()[this.pageNumber()];
+            this.reserveSpace(this.$sec_image, next_page);
             if (next_page) {
-                this.$sec_image.attr('src', next_page.url);
+                this.$sec_image.attr('src', this.pageSrc(next_page));
             } else {
                 this.$sec_image.attr('src', '');
             }
-            if (this.dualPage()) {
+            if (this.showSecondary()) {
                 this.$sec_image.closest(this.selectors.image_container).addClass('sec-loading');
             }
         }
@@ -223,6 +349,13 @@ function ComicViewModel() {
         var self = this,
             $base = this.getBaseNode();
         
+        if (this.fitModeChange) {
+            this.fitModeChange.dispose();
+        }
+        this.fitModeChange = this.fitMode.subscribe(function () {
+            self.setPageInDom();
+        });
+        
         $(window).resize(function () {
             if (self.fitMode() === 'height') {
                 self.$image.css('max-height', self.getFitHeight());
@@ -0,0 +1,51 @@
+"""SQLite connection tuning."""
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+def is_sqlite_file(sa_url):
+    """Check if a database URL points at an SQLite file rather than memory."""
+    return sa_url.drivername == 'sqlite' and sa_url.database not in (None, '', ':memory:')
+
+def sqlite_pragmas(config):
+    """Get the PRAGMA statements to run on each new SQLite connection."""
+    return [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=%s' % config['SQLITE_SYNCHRONOUS'],
+        'PRAGMA busy_timeout=%d' % config['SQLITE_BUSY_TIMEOUT'],
+    ]
+
+
+class TunedSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with pooled, WAL-journaled connections for SQLite files.
+
+    Flask-SQLAlchemy opens a new SQLite connection for every session by
+    default.  With SQLITE_TUNING set, connections are kept in a pool and
+    set up once with the pragmas from sqlite_pragmas().
+    """
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super(TunedSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if app.config['SQLITE_TUNING'] and is_sqlite_file(sa_url):
+            options['poolclass'] = QueuePool
+            options.setdefault('pool_size', app.config['SQLITE_POOL_SIZE'])
+            connect_args = options.setdefault('connect_args', {})
+            # Pooled connections are handed to whichever thread needs one next.
+            connect_args['check_same_thread'] = False
+            connect_args['timeout'] = app.config['SQLITE_BUSY_TIMEOUT'] / 1000.0
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(TunedSQLAlchemy, self).create_engine(sa_url, engine_opts)
+        config = self.get_app().config
+        if config['SQLITE_TUNING'] and is_sqlite_file(sa_url):
+            pragmas = sqlite_pragmas(config)
+
+            def on_connect(dbapi_connection, connection_record): #pylint: disable=unused-argument
+                cursor = dbapi_connection.cursor()
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+                cursor.close()
+            event.listen(engine, 'connect', on_connect)
+        return engine
@@ -0,0 +1,119 @@
+"""Generate and cache page thumbnails."""
+
+import io
+import os.path
+
+from PIL import Image
+
+from linga.app import get_config
+from linga.archives import archive_key
+from linga.diskcache import (DiskCache, make_key)
+from linga.metrics import timed
+
+_thumbnail_cache = None #pylint: disable=invalid-name
+
+def get_thumbnail_cache():
+    """Get the thumbnail cache, creating it on first use."""
+    global _thumbnail_cache #pylint: disable=global-statement,invalid-name
+    if _thumbnail_cache is None:
+        _thumbnail_cache = DiskCache(
+            os.path.join(get_config('CACHE_PATH'), 'thumbnails'),
+            get_config('THUMBNAIL_CACHE_SIZE'),
+            '.jpg')
+    return _thumbnail_cache
+
+def thumbnail_size(size=None):
+    """Get the bounding box for a thumbnail, defaulting to the configured size."""
+    if size is None:
+        size = get_config('THUMBNAIL_SIZE')
+    if isinstance(size, int):
+        size = (size, size)
+    return tuple(size)
+
+def image_dimensions(stream):
+    """Get the (width, height) of an encoded image, or (None, None) if it can't be read.
+
+    Image.open() only parses the header, so the pixels are never decoded and
+    usually only the first few kilobytes of the stream are read.
+    """
+    try:
+        return Image.open(stream).size
+    except Exception: #pylint: disable=broad-except
+        return (None, None)
+
+@timed('thumbnail')
+def make_thumbnail(data, size):
+    """Scale encoded image data down to fit size and return it as a JPEG.
+
+    For JPEG sources, draft mode has the decoder scale by up to 1/8 while
+    decoding, so the full-size image is never held in memory.
+    """
+    img = Image.open(io.BytesIO(data))
+    img.draft('RGB', size)
+    img.thumbnail(size)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    out = io.BytesIO()
+    img.save(out, 'JPEG')
+    return out.getvalue()
+
+def thumbnail_key(book, index, size):
+    """Get the cache key for a page thumbnail of the current version of a book."""
+    return make_key('thumb', archive_key(os.path.abspath(book.path)), index, size)
+
+def get_cover(book):
+    """Get the path to a cached cover image for a book."""
+    return get_thumbnail(book, 0, get_config('COVER_SIZE'))
+
+def get_thumbnail(book, index, size=None):
+    """Get the path to a cached thumbnail of a page, generating it if needed."""
+    size = thumbnail_size(size)
+    return get_thumbnail_cache().get_or_create(
+        thumbnail_key(book, index, size),
+        lambda: make_thumbnail(book.get_file(index), size))
+
+def sprite_start(page):
+    """Get the first page of the sprite sheet that holds a page.  Pages count from 1."""
+    per_sheet = get_config('SPRITE_PAGES')
+    return (page - 1) // per_sheet * per_sheet + 1
+
+def sprite_position(page, start):
+    """Get the (x, y) pixel offset of a page's thumbnail in the sheet starting at start."""
+    size = thumbnail_size()
+    columns = get_config('SPRITE_COLUMNS')
+    offset = page - start
+    return (offset % columns * size[0], offset // columns * size[1])
+
+def sprite_page_count(book, start, count=None):
+    """Get the number of pages in a sprite sheet, limited to the pages in the book."""
+    if count is None:
+        count = get_config('SPRITE_PAGES')
+    count = min(count, len(book.get_file_list()) - start + 1)
+    if start < 1 or count < 1:
+        raise IndexError('No pages in sprite sheet starting at %d' % start)
+    return count
+
+@timed('sprite')
+def make_sprite(book, start, count):
+    """Combine the thumbnails of count pages from start into one JPEG.
+
+    Each thumbnail is centered in a cell the size of the thumbnail bounding box.
+    """
+    size = thumbnail_size()
+    columns = min(get_config('SPRITE_COLUMNS'), count)
+    rows = (count + columns - 1) // columns
+    sheet = Image.new('RGB', (columns * size[0], rows * size[1]))
+    for page in range(start, start + count):
+        thumb = Image.open(get_thumbnail(book, page - 1, size))
+        x, y = sprite_position(page, start)
+        sheet.paste(thumb, (x + (size[0] - thumb.width) // 2, y + (size[1] - thumb.height) // 2))
+    out = io.BytesIO()
+    sheet.save(out, 'JPEG')
+    return out.getvalue()
+
+def get_sprite(book, start, count=None):
+    """Get the path to a cached sprite sheet of page thumbnails."""
+    count = sprite_page_count(book, start, count)
+    key = make_key('sprite', archive_key(os.path.abspath(book.path)), start, count,
+                   thumbnail_size(), get_config('SPRITE_COLUMNS'))
+    return get_thumbnail_cache().get_or_create(key, lambda: make_sprite(book, start, count))
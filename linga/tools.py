@@ -0,0 +1,53 @@
+"""Shared parts of the command line tools that work through every book in the library."""
+
+import multiprocessing
+import os
+import sys
+import time
+
+from linga.app import db
+
+def _init_worker():
+    # Don't share the parent's database connections across the fork.
+    db.engine.dispose()
+
+def worker_pool(workers=None):
+    """Get a pool of processes for working on books, one per core by default."""
+    return multiprocessing.Pool(workers or os.cpu_count(), _init_worker)
+
+
+class Progress(object):
+    """Reports how many books a tool has finished, and how fast.
+
+    Subclasses keep their own totals and describe them in details().
+    """
+
+    def __init__(self, total, out=sys.stdout, every=10):
+        self.total = total
+        self.out = out
+        self.every = every
+        self.start = time.time()
+        self.books = 0
+        self.pages = 0
+        self.errors = 0
+
+    def update(self, pages, error):
+        """Record a finished book, printing a status line every few books."""
+        self.books += 1
+        self.pages += pages
+        if error:
+            self.errors += 1
+        if self.books % self.every == 0 or self.books == self.total:
+            self.report()
+
+    def details(self, elapsed): #pylint: disable=unused-argument
+        """Get the tool's own part of the status line."""
+        return ''
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 0.001)
+        details = self.details(elapsed)
+        self.out.write('%d/%d books, %d pages, %s%d errors (%.1f books/s)\n' % (
+            self.books, self.total, self.pages, details + ', ' if details else '', self.errors,
+            self.books / elapsed))
+        self.out.flush()
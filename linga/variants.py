@@ -0,0 +1,112 @@
+"""Scale and re-encode pages to fit the reader's screen."""
+
+import io
+import os.path
+
+from PIL import Image
+
+from linga.app import get_config
+from linga.archives import archive_key
+from linga.diskcache import (DiskCache, make_key)
+from linga.metrics import timed
+
+# Output formats by query parameter, with the PIL format name and mime type
+VARIANT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+# Cookie in which the reader keeps its window size, snapped to variant sizes
+SCREEN_COOKIE = 'linga_screen'
+
+_variant_cache = None #pylint: disable=invalid-name
+
+def get_variant_cache():
+    """Get the page variant cache, creating it on first use."""
+    global _variant_cache #pylint: disable=global-statement,invalid-name
+    if _variant_cache is None:
+        _variant_cache = DiskCache(
+            os.path.join(get_config('CACHE_PATH'), 'pages'),
+            get_config('PAGE_VARIANT_CACHE_SIZE'))
+    return _variant_cache
+
+def snap_dimension(value):
+    """Round a requested width or height up to the variant step, within the maximum.
+
+    Returns 0 (no limit) for a missing value.  Raises ValueError for
+    values below 1.
+    """
+    if value is None:
+        return 0
+    if value < 1:
+        raise ValueError('Invalid page size %d' % value)
+    step = get_config('PAGE_VARIANT_STEP')
+    value = (value + step - 1) // step * step
+    return min(value, get_config('PAGE_VARIANT_MAX_SIZE'))
+
+def variant_params(width=None, height=None, fmt=None):
+    """Normalize the requested variant, or return None if the original was asked for.
+
+    Returns a (width, height, format) tuple where a 0 dimension is
+    unconstrained.  Raises ValueError for an unknown format.
+    """
+    if width is None and height is None and not fmt:
+        return None
+    fmt = (fmt or 'jpeg').lower()
+    if fmt not in VARIANT_FORMATS:
+        raise ValueError('Unsupported page format %s' % fmt)
+    return (snap_dimension(width), snap_dimension(height), fmt)
+
+def screen_variant_args(fit_mode, value):
+    """Get the query arguments the reader adds to page URLs in a fit mode.
+
+    value is the reader's SCREEN_COOKIE, "width,height,format".  Returns
+    no arguments for full size pages or a missing or malformed cookie.
+    """
+    if fit_mode not in ('width', 'height') or not value:
+        return {}
+    try:
+        width, height, fmt = value.split(',')
+        width, height, fmt = variant_params(int(width), int(height), fmt)
+    except ValueError:
+        return {}
+    args = {'w': width} if fit_mode == 'width' else {'h': height}
+    if fmt != 'jpeg':
+        args['fmt'] = fmt
+    return args
+
+def variant_tag(params):
+    """Get a short string identifying a variant, for ETags."""
+    return 'w%d-h%d-%s' % params
+
+def variant_mime(params):
+    """Get the mime type of a variant."""
+    return VARIANT_FORMATS[params[2]][1]
+
+@timed('variant')
+def make_variant(data, params):
+    """Scale encoded image data to fit the variant's box and encode it in its format.
+
+    Images are only ever scaled down, and an unconstrained dimension is
+    left to follow the aspect ratio.
+    """
+    width, height, fmt = params
+    img = Image.open(io.BytesIO(data))
+    size = (width or img.width, height or img.height)
+    img.draft('RGB', size)
+    img.thumbnail(size, Image.LANCZOS)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    out = io.BytesIO()
+    img.save(out, VARIANT_FORMATS[fmt][0], quality=get_config('PAGE_VARIANT_QUALITY'))
+    return out.getvalue()
+
+def get_variant(book, index, params, read_page):
+    """Get the path to a cached variant of a page, generating it if needed.
+
+    read_page(book, index) supplies the original page bytes.
+    """
+    key = make_key('page', archive_key(os.path.abspath(book.path)), index, params,
+                   get_config('PAGE_VARIANT_QUALITY'))
+    return get_variant_cache().get_or_create(
+        key, lambda: make_variant(read_page(book, index), params))
@@ -1,8 +1,7 @@
 """Pages and AJAX endpoints."""
-import io
-import os.path
+import os
+import json
 from datetime import datetime
-from PIL import Image
 from flask import (
     render_template,
     redirect,
@@ -15,38 +14,134 @@ from flask import (
 )
 from flask_login import login_required, login_user, logout_user, current_user
 from linga import app, db
-from linga.auth import User, get_user
+from linga.app import get_config
+from linga.auth import User, get_user, get_user_cache
 from linga.comics import (
-    ComicLister,
-    ComicMetadata,
     get_recent_books,
-    get_metadata,
+    filename_to_bookname,
     relpath_to_book,
-    add_sep
+    add_sep,
+    remove_sep
 )
+from linga.catalog import LibraryCatalog
+from linga.search import search_books
+from linga.watcher import start_watcher
+from linga.thumbnails import (get_thumbnail, get_cover, get_sprite, sprite_page_count,
+                              get_thumbnail_cache)
+from linga.archives import (EntryFile, get_archive_cache)
+from linga.responses import (send_cached, send_stream, set_attachment)
+from linga.pagecache import (open_page, read_page, get_prefetcher, get_manifest_cache,
+                             get_page_cache)
+from linga.variants import (variant_params, variant_tag, variant_mime, get_variant,
+                            get_variant_cache, screen_variant_args, SCREEN_COOKIE)
+from linga.progress import get_progress_queue
+from linga.pagesizes import get_size_reader
+from linga.rarcache import get_rar_cache
+from linga.metrics import (get_metrics, timed, CONTENT_TYPE)
 
-# Create any missing tables.
-db.create_all()
+if app.config.get('CATALOG_WATCH'):
+    start_watcher(app.config['BOOK_PATH'])
 
 def save_object(obj):
     db.session.add(obj)
     db.session.commit()
 
+@timed('book_lookup')
 def get_book(path):
     ret = relpath_to_book(add_sep(path))
     ret.set_rel_path(app.config['BOOK_PATH'])
     return ret
 
+def cache_counters():
+    """Get (name, hits, misses) for each of the caches."""
+    ret = []
+    for name, cache in [('page', get_page_cache()), ('manifest', get_manifest_cache()),
+                        ('archive', get_archive_cache()), ('thumbnail', get_thumbnail_cache()),
+                        ('variant', get_variant_cache()), ('rar', get_rar_cache().cache),
+                        ('user', get_user_cache())]:
+        ret.append((name, cache.hits, cache.misses))
+    return ret
+
 @app.route('/')
 @app.route('/books/')
 @login_required
 def show_book_list():
-    lister = ComicLister(app.config['BOOK_PATH'])
-    book_list = lister.get_books()
-    books = lister.group_by_path(book_list)
+    LibraryCatalog(app.config['BOOK_PATH']).refresh()
+    progress = get_progress_queue()
+    if progress.has_pending(current_user.user_id):
+        # Recent books are ordered by last access, so write out queued progress first.
+        try:
+            progress.flush()
+        except Exception as err:
+            app.logger.error(str(err))
     recent_metadata = get_recent_books(current_user.user_id)
-    return render_template('show-book-list.html',
-                           books=books, recent=recent_metadata)
+    return render_template('show-book-list.html', recent=recent_metadata)
+
+@app.route('/books/dir/', defaults={'path': ''})
+@app.route('/books/dir/<string:path>')
+@login_required
+def list_dir(path):
+    catalog = LibraryCatalog(app.config['BOOK_PATH'])
+    relpath = add_sep(path)
+    if not catalog.has_dir(relpath):
+        abort(404)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', get_config('DIR_PAGE_SIZE'), type=int)
+    limit = min(max(limit, 1), get_config('DIR_PAGE_MAX_SIZE'))
+
+    dirs, books = catalog.list_dir(relpath, offset, limit)
+    dir_count, book_count = catalog.count_dir(relpath)
+    subdir_counts = catalog.count_subdirs([item.relpath for item in dirs])
+    book_counts = catalog.count_subtree_books([item.relpath for item in dirs])
+    items = [{
+        'type': 'dir',
+        'name': item.dir_name(),
+        'url': url_for('list_dir', path=remove_sep(item.relpath)),
+        'dir_count': subdir_counts[item.relpath],
+        'book_count': book_counts[item.relpath],
+    } for item in dirs]
+    items.extend({
+        'type': 'book',
+        'name': item.name,
+        'url': url_for('show_book', book=item.disp_relpath()),
+    } for item in books)
+
+    next_offset = offset + len(items)
+    return jsonify({
+        'path': path,
+        'dir_count': dir_count,
+        'book_count': book_count,
+        'offset': offset,
+        'items': items,
+        'next': (url_for('list_dir', path=path, offset=next_offset, limit=limit)
+                 if next_offset < dir_count + book_count else None),
+    })
+
+@app.route('/books/search')
+@login_required
+def search():
+    query = request.args.get('q', '')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', get_config('DIR_PAGE_SIZE'), type=int)
+    limit = min(max(limit, 1), get_config('DIR_PAGE_MAX_SIZE'))
+
+    total, relpaths = search_books(query, offset, limit)
+    items = [{
+        'type': 'book',
+        'name': filename_to_bookname(relpath),
+        'dir': os.path.dirname(relpath),
+        'url': url_for('show_book', book=remove_sep(relpath)),
+    } for relpath in relpaths]
+
+    next_offset = offset + len(items)
+    return jsonify({
+        'query': query,
+        'book_count': total,
+        'offset': offset,
+        'items': items,
+        'next': (url_for('search', q=query, offset=next_offset, limit=limit)
+                 if next_offset < total else None),
+    })
 
 @app.route('/books/read/<string:book>/page/<int:page>')
 @app.route('/books/read/<string:book>/', defaults={'page': 0})
@@ -54,32 +149,82 @@ def show_book_list():
 def show_book(book, page):
     try:
         full_book = get_book(book)
-        meta = full_book.metadata(current_user.user_id)
+        progress = get_progress_queue()
+        meta = progress.apply(full_book.metadata(current_user.user_id))
         if page == 0:
             page = meta.last_page if meta.last_page else 1
         else:
             meta.last_page = page
-            save_object(meta)
+            progress.update(current_user.user_id, full_book.rel_path, last_page=page)
         return render_template(
             'show-book.html',
             book=full_book,
             book_id=book,
             metadata=meta,
-            page=page)
+            page=page,
+            page_args=screen_variant_args(meta.fit_mode, request.cookies.get(SCREEN_COOKIE)),
+            screen_cookie=SCREEN_COOKIE)
+    except Exception as err:
+        app.logger.error(str(err))
+        abort(404)
+
+@app.route('/books/manifest/<string:book>')
+@login_required
+def show_manifest(book):
+    try:
+        book = get_book(book)
+        sized = book.has_page_sizes()
+        if not sized:
+            get_size_reader().schedule(book)
+
+        def make_response():
+            cache = get_manifest_cache()
+            key = (book.file_key(), request.script_root, sized)
+            data = cache.get(key)
+            if data is None:
+                data = json.dumps(book.get_page_manifest(), separators=(',', ':')).encode('utf-8')
+                cache.put(key, data)
+            return app.response_class(data, mimetype='application/json')
+        response = send_cached(book, '%s-m%s' % (book.version(), '' if sized else 'u'),
+                               make_response)
+        if not sized:
+            # Sizes are on their way, so don't let the client keep this copy.
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as err:
-        app.logger.error(err.message)
+        app.logger.error(str(err))
         abort(404)
 
 @app.route('/books/page/<string:book>/<int:page>')
 @login_required
 def show_page(book, page):
+    # Page 0 would index the last page, and be cached as immutable.
+    if page < 1:
+        abort(404)
+    try:
+        params = variant_params(request.args.get('w', type=int),
+                                request.args.get('h', type=int),
+                                request.args.get('fmt'))
+    except ValueError:
+        abort(400)
     try:
         book = get_book(book)
-        img_file = book.get_file(page - 1)
-        sio = io.BytesIO()
-        sio.write(img_file)
-        sio.seek(0)
-        return send_file(sio, 'image/jpg')
+        index = page - 1
+        etag = book.page_etag(index)
+        if params is not None:
+            etag = '%s-%s' % (etag, variant_tag(params))
+
+        def make_response():
+            get_prefetcher().schedule(book, index, current_user.user_id)
+            if params is None:
+                stream, size = open_page(book, index)
+                mime = book.get_file_mime(index)
+            else:
+                stream = open(get_variant(book, index, params, read_page), 'rb')
+                size = os.fstat(stream.fileno()).st_size
+                mime = variant_mime(params)
+            return send_stream(stream, size, mime, etag, book.mtime())
+        return send_cached(book, etag, make_response)
     except Exception as err:
         app.logger.error(str(err))
         abort(404)
@@ -87,22 +232,38 @@ def show_page(book, page):
 @app.route('/books/pagethumb/<string:book>/<int:page>')
 @login_required
 def show_pagethumb(book, page):
+    if page < 1:
+        abort(404)
+    try:
+        book = get_book(book)
+        index = page - 1
+        etag = '%s-t%d' % (book.page_etag(index), get_config('THUMBNAIL_SIZE'))
+        return send_cached(book, etag, lambda: send_file(get_thumbnail(book, index), 'image/jpg'))
+    except Exception as err:
+        app.logger.error(str(err))
+        abort(404)
+
+@app.route('/books/cover/<string:book>')
+@login_required
+def show_cover(book):
     try:
         book = get_book(book)
-        img_file = book.get_file(page - 1)
-        inio = io.BytesIO()
-        outio = io.BytesIO()
-        inio.write(img_file)
-        inio.seek(0)
-
-        img = Image.open(inio)
-        img.thumbnail((64, 64))
-        img.save(outio, "JPEG")
-        outio.seek(0)
-
-        return send_file(outio, 'image/jpg')
+        etag = '%s-c%d' % (book.page_etag(0), get_config('COVER_SIZE'))
+        return send_cached(book, etag, lambda: send_file(get_cover(book), 'image/jpg'))
     except Exception as err:
-        app.logger.error(err.message)
+        app.logger.error(str(err))
+        abort(404)
+
+@app.route('/books/thumbsheet/<string:book>/<int:start>')
+@login_required
+def show_thumbsheet(book, start):
+    try:
+        book = get_book(book)
+        count = sprite_page_count(book, start, request.args.get('count', type=int))
+        etag = '%s-s%d-%d-%d' % (book.version(), start, count, get_config('THUMBNAIL_SIZE'))
+        return send_cached(book, etag, lambda: send_file(get_sprite(book, start, count), 'image/jpg'))
+    except Exception as err:
+        app.logger.error(str(err))
         abort(404)
 
 @app.route('/books/download/<string:book>')
@@ -110,12 +271,25 @@ def show_pagethumb(book, page):
 def download_book(book):
     try:
         book = get_book(book)
-        return send_file(os.path.abspath(book.path), mimetype=book.mimetype(), as_attachment=True,
-                         attachment_filename=book.rel_path)
-    except Exception as ex:
+        etag = book.version()
+
+        def make_response():
+            size = book.file_key()[2]
+            stream = EntryFile(open(book.path, 'rb'), 0, size)
+            response = send_stream(stream, size, book.mimetype(), etag, book.mtime())
+            return set_attachment(response, book.rel_path)
+        return send_cached(book, etag, make_response)
+    except Exception as err:
         app.logger.error(str(err))
         abort(404)
 
+@app.route('/metrics')
+def show_metrics():
+    allowed = get_config('METRICS_ALLOWED_ADDRESSES')
+    if not get_config('METRICS_ENABLED') or (allowed and request.remote_addr not in allowed):
+        abort(404)
+    return app.response_class(get_metrics().render(cache_counters()), content_type=CONTENT_TYPE)
+
 @app.route('/user/login', methods=['GET', 'POST'])
 def user_login():
     username = ''
@@ -188,25 +362,26 @@ def user_create_post(username, passwd, confirm_passwd):
 def update_page():
     uid = current_user.user_id
     path = request.form.get('relpath')
-    page = request.form.get('page')
+    page = request.form.get('page', type=int)
+    if request.form.get('page') and (page is None or page < 1):
+        abort(400)
     finished = request.form.get('finished') == 'true'
     fit_mode = request.form.get('fitmode') or "full"
     rtol = request.form.get('rtl') == 'true'
     dual = request.form.get('dual') == 'true'
 
     if path and uid and page:
-        data = get_metadata(uid, path)
-        if data is None:
-            data = ComicMetadata(uid, path)
-        data.last_access = datetime.now()
-        data.last_page = page
-        data.fit_mode = fit_mode
-        data.right_to_left = rtol
-        data.dual_page = dual
+        fields = {
+            'last_access': datetime.now(),
+            'last_page': page,
+            'fit_mode': fit_mode,
+            'right_to_left': rtol,
+            'dual_page': dual,
+        }
         if finished:
-            data.finished_book = True
+            fields['finished_book'] = True
         try:
-            save_object(data)
+            get_progress_queue().update(uid, path, **fields)
             return jsonify({'success': True})
         except Exception as err:
             return jsonify({'success': False, 'error': str(err)})
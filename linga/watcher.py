@@ -0,0 +1,213 @@
+"""Keep the library catalog current as files are added, removed or renamed."""
+
+import errno
+import os
+import os.path
+import select
+import struct
+import threading
+import time
+import ctypes
+import ctypes.util
+
+from linga.app import (app, get_config, db)
+from linga.catalog import (LibraryCatalog, CatalogDir, set_watched)
+
+# Flags from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = os.O_CLOEXEC if hasattr(os, 'O_CLOEXEC') else 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Seconds to wait for a burst of events to settle before touching the database.
+SETTLE_TIME = 0.5
+# Longest time the watcher thread blocks before checking if it should stop.
+STOP_CHECK_TIME = 1.0
+
+
+class WatcherUnavailable(Exception):
+    """Raised when the kernel file change API can't be used."""
+
+
+class InotifyMonitor(object):
+    """Report changed directories using the Linux inotify API."""
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.libc = self._load_libc()
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatcherUnavailable(os.strerror(ctypes.get_errno()))
+        self.watches = {}
+        self.paths = {}
+
+    @staticmethod
+    def _load_libc():
+        """Load the C library and make sure it has inotify."""
+        name = ctypes.util.find_library('c')
+        if not name:
+            raise WatcherUnavailable('C library not found')
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise WatcherUnavailable('inotify is not supported')
+        return libc
+
+    def watch(self, relpaths):
+        """Make the set of watched directories match relpaths."""
+        relpaths = set(relpaths)
+        for relpath in list(self.paths):
+            if relpath not in relpaths:
+                self.libc.inotify_rm_watch(self.fd, self.paths.pop(relpath))
+        for relpath in relpaths:
+            if relpath in self.paths:
+                continue
+            path = os.path.join(self.base_path, relpath) if relpath else self.base_path
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC: # Out of inotify watches
+                    raise WatcherUnavailable('Too many directories to watch')
+                continue
+            self.watches[wd] = relpath
+            self.paths[relpath] = wd
+
+    def wait(self, timeout):
+        """Wait for changes and return the directories affected, or None if unknown."""
+        changed = set()
+        ready = select.select([self.fd], [], [], timeout)[0]
+        while ready:
+            data = os.read(self.fd, 65536)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_len = EVENT_HEADER.unpack_from(data, offset) #pylint: disable=unused-variable
+                offset += EVENT_HEADER.size + name_len
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                relpath = self.watches.get(wd)
+                if relpath is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.watches[wd]
+                    self.paths.pop(relpath, None)
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changed.add(os.path.dirname(relpath) if relpath else relpath)
+                else:
+                    changed.add(relpath)
+            ready = select.select([self.fd], [], [], SETTLE_TIME)[0]
+        return changed
+
+    def close(self):
+        """Release the inotify descriptor."""
+        os.close(self.fd)
+
+
+class PollingMonitor(object):
+    """Fallback monitor that asks for an mtime-based rescan at an interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_poll = time.time()
+
+    def watch(self, relpaths):
+        """Polling doesn't need to track directories."""
+
+    def wait(self, timeout):
+        """Ask for a full rescan once the polling interval has passed."""
+        remaining = self.last_poll + self.interval - time.time()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(remaining, 0))
+        self.last_poll = time.time()
+        return None
+
+    def close(self):
+        """Nothing to release."""
+
+
+class CatalogWatcher(threading.Thread):
+    """Background thread that applies library changes to the catalog."""
+
+    def __init__(self, base_path='', interval=None):
+        super(CatalogWatcher, self).__init__(name='linga-catalog-watcher')
+        self.daemon = True
+        self.catalog = LibraryCatalog(base_path)
+        self.interval = interval if interval else get_config('CATALOG_WATCH_INTERVAL')
+        self.stopped = threading.Event()
+        self.monitor = None
+
+    def make_monitor(self):
+        """Use inotify where the kernel has it, falling back to polling."""
+        try:
+            monitor = InotifyMonitor(self.catalog.base_path)
+            monitor.watch(self.known_dirs())
+            return monitor
+        except (WatcherUnavailable, OSError) as ex:
+            app.logger.warning('Using polling to watch library: %s', ex)
+            return PollingMonitor(self.interval)
+
+    @staticmethod
+    def known_dirs():
+        """Get the relative paths of every catalogued directory."""
+        return [row.relpath for row in db.session.query(CatalogDir.relpath)]
+
+    def run(self):
+        with app.app_context():
+            # Requests keep serving the stored catalog while the first scan runs.
+            set_watched(self.catalog.base_path)
+            try:
+                self.monitor = self.make_monitor()
+                self.apply(None)
+                while not self.stopped.is_set():
+                    changed = self.monitor.wait(STOP_CHECK_TIME)
+                    if not self.stopped.is_set():
+                        self.apply(changed)
+            finally:
+                set_watched(self.catalog.base_path, False)
+                if self.monitor is not None:
+                    self.monitor.close()
+
+    def apply(self, changed):
+        """Update the catalog for the changed directories, or all of them if None."""
+        try:
+            if changed is None:
+                self.catalog.rescan()
+            elif changed:
+                self.catalog.update_dirs(changed)
+            else:
+                return
+            if self.monitor is None:
+                return
+            try:
+                self.monitor.watch(self.known_dirs())
+            except WatcherUnavailable as ex:
+                app.logger.warning('Switching to polling to watch library: %s', ex)
+                self.monitor.close()
+                self.monitor = PollingMonitor(self.interval)
+        except Exception as ex: #pylint: disable=broad-except
+            db.session.rollback()
+            app.logger.error('Error updating library catalog: %s', ex)
+        finally:
+            db.session.remove()
+
+    def stop(self):
+        """Ask the watcher to exit after its current wait."""
+        self.stopped.set()
+
+
+def start_watcher(base_path=''):
+    """Start a catalog watcher for the library and return it."""
+    watcher = CatalogWatcher(base_path)
+    watcher.start()
+    return watcher
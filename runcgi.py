@@ -4,7 +4,8 @@
 #execfile(activate_this, dict(__file__=activate_this))
 
 from wsgiref.handlers import CGIHandler
-from linga import app, views
+from linga import app, db, views
+from linga.migrations import upgrade_database
 
 class PathStrip(object):
     def __init__(self, app):
@@ -19,6 +20,7 @@ class PathStrip(object):
             environ['PATH_INFO'] = pi_val[(script_name_pos + len(script_name)):]
         return self.app(environ, start_response)
             
+upgrade_database(db)
 app.wsgi_app = PathStrip(app.wsgi_app)
 
 CGIHandler().run(app)
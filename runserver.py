@@ -1,2 +1,4 @@
-from linga import app
+from linga import app, db
+from linga.migrations import upgrade_database
+upgrade_database(db)
 app.run(debug=True)
@@ -0,0 +1,124 @@
+describe("A book listing", function() {
+    beforeEach(function() {
+        this.$base = $('<div class="book-listing"></div>').data('url', '/books/dir/');
+        this.listing = new BookListing(this.$base);
+        this.page = {
+            items: [
+                {type: 'dir', name: 'comics', url: '/books/dir/comics', book_count: 12},
+                {type: 'book', name: 'book.cbz', url: '/books/book.cbz/1', dir: 'comics'}
+            ],
+            next: '/books/dir/?start=2'
+        };
+    });
+
+    it("should make a closed directory item with its book count", function() {
+        var $item = this.listing.makeItem(this.page.items[0]);
+
+        expect($item.hasClass('item-dir')).toBe(true);
+        expect($item.hasClass('closed')).toBe(true);
+        expect($item.data('url')).toEqual('/books/dir/comics');
+        expect($item.find('.dir-name').text()).toEqual('comics');
+        expect($item.find('.dir-name').attr('href')).toEqual('#');
+        expect($item.find('.dir-count').text()).toEqual(' (12)');
+    });
+
+    it("should make a book item linking to the reader", function() {
+        var $item = this.listing.makeItem(this.page.items[1]);
+
+        expect($item.hasClass('item-book')).toBe(true);
+        expect($item.find('a').attr('href')).toEqual('/books/book.cbz/1');
+        expect($item.find('.book-dir').text()).toEqual(' - comics');
+    });
+
+    it("should append a page of items and a link to the next page", function() {
+        var $list = $('<ul></ul>');
+        spyOn($, 'getJSON').and.returnValue($.Deferred().resolve(this.page).promise());
+
+        this.listing.loadPage($list, '/books/dir/');
+
+        expect($.getJSON).toHaveBeenCalledWith('/books/dir/');
+        expect($list.children('.item-dir').length).toEqual(1);
+        expect($list.children('.item-book').length).toEqual(1);
+        expect($list.children('.load-more').data('url')).toEqual('/books/dir/?start=2');
+        expect($list.hasClass('loading')).toBe(false);
+    });
+
+    it("should show an error when a page fails to load", function() {
+        var $list = $('<ul></ul>');
+        spyOn($, 'getJSON').and.returnValue($.Deferred().reject().promise());
+
+        this.listing.loadPage($list, '/books/dir/');
+
+        expect($list.children('.load-error').length).toEqual(1);
+    });
+
+    it("should load a directory only the first time it is opened", function() {
+        var $dir = this.listing.makeItem(this.page.items[0]);
+        spyOn(this.listing, 'loadPage');
+
+        this.listing.toggleDir($dir);
+        expect($dir.hasClass('closed')).toBe(false);
+        expect(this.listing.loadPage.calls.count()).toEqual(1);
+        expect(this.listing.loadPage.calls.mostRecent().args[1]).toEqual('/books/dir/comics');
+
+        this.listing.toggleDir($dir);
+        this.listing.toggleDir($dir);
+        expect($dir.hasClass('closed')).toBe(false);
+        expect(this.listing.loadPage.calls.count()).toEqual(1);
+    });
+
+    it("should load the root directory on init", function() {
+        spyOn(this.listing, 'loadPage');
+
+        this.listing.init();
+
+        expect(this.listing.loadPage.calls.mostRecent().args[1]).toEqual('/books/dir/');
+    });
+});
+
+describe("A book search", function() {
+    beforeEach(function() {
+        this.$fixture = $('<div></div>').appendTo(document.body);
+        this.$form = $('<form action="/books/search"><input name="q"></form>').appendTo(this.$fixture);
+        this.$results = $('<div></div>').hide().appendTo(this.$fixture);
+        this.$listing = $('<div></div>').appendTo(this.$fixture);
+        this.search = new BookSearch(this.$form, this.$results, this.$listing);
+        spyOn(this.search.results, 'loadPage');
+    });
+
+    afterEach(function() {
+        this.$fixture.remove();
+    });
+
+    it("should load matching books in place of the listing", function() {
+        this.search.$input.val(' batman ');
+
+        this.search.search();
+
+        expect(this.search.results.loadPage.calls.mostRecent().args[1])
+            .toEqual('/books/search?q=batman');
+        expect(this.$results.is(':visible')).toBe(true);
+        expect(this.$listing.is(':visible')).toBe(false);
+    });
+
+    it("should not search again for the same query", function() {
+        this.search.$input.val('batman');
+
+        this.search.search();
+        this.search.search();
+
+        expect(this.search.results.loadPage.calls.count()).toEqual(1);
+    });
+
+    it("should show the listing again when the query is cleared", function() {
+        this.search.$input.val('batman');
+        this.search.search();
+        this.search.$input.val('');
+
+        this.search.search();
+
+        expect(this.$results.children().length).toEqual(0);
+        expect(this.$results.is(':visible')).toBe(false);
+        expect(this.$listing.is(':visible')).toBe(true);
+    });
+});
@@ -319,6 +319,101 @@ describe("A comic book", function() {
     });
 
 
+    describe("when showing two pages", function() {
+        beforeEach(function() {
+            this.test_pages = [
+                {url: 'link1', name: 'page1', width: 300, height: 400},
+                {url: 'link2', name: 'page2', width: 300, height: 400},
+                {url: 'link3', name: 'page3', width: 600, height: 400},
+                {url: 'link4', name: 'page4', width: 300, height: 400},
+                {url: 'link5', name: 'page5', width: 300, height: 400},
+            ];
+            this.book.addPages(this.test_pages);
+            this.book.dualPage(true);
+        });
+
+        it("should show one page when dual page is disabled", function() {
+            this.book.dualPage(false);
+
+            expect(this.book.pagesShownAt(1)).toEqual(1);
+        });
+
+        it("should show two pages when neither is a spread", function() {
+            expect(this.book.pagesShownAt(1)).toEqual(2);
+            expect(this.book.pagesShownAt(4)).toEqual(2);
+        });
+
+        it("should show a spread on its own", function() {
+            expect(this.book.pages()[2].isSpread).toBe(true);
+            expect(this.book.pagesShownAt(3)).toEqual(1);
+        });
+
+        it("should not pair a page with a following spread", function() {
+            expect(this.book.pagesShownAt(2)).toEqual(1);
+        });
+
+        it("should show one page at the end of the book", function() {
+            expect(this.book.pagesShownAt(5)).toEqual(1);
+        });
+
+        it("should step over a pair but not past a spread", function() {
+            this.book.pageNumber(1);
+            expect(this.book.nextPageRight().name).toEqual('page3');
+
+            this.book.pageNumber(2);
+            expect(this.book.nextPageRight().name).toEqual('page3');
+
+            this.book.pageNumber(3);
+            expect(this.book.nextPageRight().name).toEqual('page4');
+        });
+
+        it("should step back one page when the previous pages are not a pair", function() {
+            this.book.pageNumber(4);
+            expect(this.book.nextPageLeft().name).toEqual('page3');
+
+            this.book.pageNumber(3);
+            expect(this.book.nextPageLeft().name).toEqual('page1');
+        });
+    });
+
+    describe("when loading the manifest", function() {
+        beforeEach(function() {
+            this.pageData.manifestUrl = '/books/manifest/book.cbz';
+            spyOn(this.book, 'showAlert');
+            spyOn(this.book, 'initEvents');
+            spyOn(this.book, 'goToPage');
+            spyOn(ko, 'applyBindings');
+        });
+
+        it("should show the book's pages", function() {
+            var manifest = {
+                count: 1,
+                files: ['a.jpg'],
+                urls: {page: 'p/{page}', read: 'r/{page}', thumb: 't/{page}', sprite: 's/{start}'},
+                sprite: {pages: 100, columns: 10, width: 64, height: 64}
+            };
+            spyOn($, 'getJSON').and.returnValue($.Deferred().resolve(manifest).promise());
+
+            this.book.load(this.pageData);
+
+            expect($.getJSON).toHaveBeenCalledWith('/books/manifest/book.cbz');
+            expect(this.book.pageCount()).toEqual(1);
+            expect(this.book.initEvents).toHaveBeenCalled();
+            expect(this.book.goToPage).toHaveBeenCalledWith(1, true);
+            expect(this.book.showAlert).not.toHaveBeenCalled();
+        });
+
+        it("should show an error when the manifest can't be loaded", function() {
+            spyOn($, 'getJSON').and.returnValue($.Deferred().reject().promise());
+
+            this.book.load(this.pageData);
+
+            expect(this.book.showAlert).toHaveBeenCalled();
+            expect(this.book.pageCount()).toEqual(0);
+            expect(ko.applyBindings).not.toHaveBeenCalled();
+        });
+    });
+
 	xit("should ignore DOM change if image is already the one requested", function() {
 		spyOn(this.book, 'updatePage');
 		this.book.addPages(this.test_pages);
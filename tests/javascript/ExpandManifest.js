@@ -0,0 +1,62 @@
+describe("Expanding a page manifest", function() {
+    beforeEach(function() {
+        this.manifest = {
+            version: 'v1',
+            count: 5,
+            files: ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg'],
+            sizes: [[300, 400], [300, 400], [600, 400], [300, 400], [null, null]],
+            urls: {
+                page: '/books/page/book.cbz/{page}?v=v1',
+                read: '/books/book.cbz/{page}',
+                thumb: '/books/thumb/book.cbz/{page}?v=v1',
+                sprite: '/books/thumbsheet/book.cbz/{start}?v=v1'
+            },
+            sprite: {pages: 4, columns: 2, width: 10, height: 20}
+        };
+    });
+
+    it("should make a page for each file", function() {
+        var pages = expandManifest(this.manifest);
+
+        expect(pages.length).toEqual(5);
+        expect(pages[0].file).toEqual('a.jpg');
+        expect(pages[0].index).toEqual(1);
+        expect(pages[4].file).toEqual('e.jpg');
+        expect(pages[4].index).toEqual(5);
+    });
+
+    it("should fill in the page URL templates", function() {
+        var page = expandManifest(this.manifest)[2];
+
+        expect(page.url).toEqual('/books/page/book.cbz/3?v=v1');
+        expect(page.page_url).toEqual('/books/book.cbz/3');
+        expect(page.thumb_url).toEqual('/books/thumb/book.cbz/3?v=v1');
+    });
+
+    it("should place thumbnails in their sprite sheets", function() {
+        var pages = expandManifest(this.manifest);
+
+        expect(pages[0].sprite_url).toEqual('/books/thumbsheet/book.cbz/1?v=v1');
+        expect([pages[0].sprite_x, pages[0].sprite_y]).toEqual([0, 0]);
+        expect([pages[1].sprite_x, pages[1].sprite_y]).toEqual([10, 0]);
+        expect([pages[3].sprite_x, pages[3].sprite_y]).toEqual([10, 20]);
+        expect(pages[3].sprite_url).toEqual('/books/thumbsheet/book.cbz/1?v=v1');
+        expect(pages[4].sprite_url).toEqual('/books/thumbsheet/book.cbz/5?v=v1');
+        expect([pages[4].sprite_x, pages[4].sprite_y]).toEqual([0, 0]);
+    });
+
+    it("should copy page sizes", function() {
+        var pages = expandManifest(this.manifest);
+
+        expect([pages[2].width, pages[2].height]).toEqual([600, 400]);
+        expect([pages[4].width, pages[4].height]).toEqual([null, null]);
+    });
+
+    it("should leave sizes unknown when the manifest has none", function() {
+        delete this.manifest.sizes;
+
+        var page = expandManifest(this.manifest)[0];
+
+        expect([page.width, page.height]).toEqual([null, null]);
+    });
+});
@@ -0,0 +1,69 @@
+#pylint: disable=missing-docstring
+"""Fixtures shared by the test modules."""
+import atexit
+import io
+import os
+import tempfile
+import zipfile
+
+from PIL import Image
+
+# Tests use a database of their own, so they never open the configured one.
+TEST_DATABASE = os.path.join(tempfile.gettempdir(), 'linga-test-%d.db' % os.getpid())
+TEST_DATABASE_URI = 'sqlite:///' + TEST_DATABASE
+
+
+def remove_test_database():
+    """Delete the test database and its WAL files."""
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(TEST_DATABASE + suffix)
+        except OSError:
+            pass
+
+atexit.register(remove_test_database)
+
+
+def touch(path, mtime=None):
+    """Write a one byte file, creating its directory, optionally with the given mtime."""
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    with open(path, 'wb') as fh:
+        fh.write(b'x')
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def make_image(fmt='JPEG', size=(800, 1200), mode='RGB'):
+    """Return the bytes of a blank image."""
+    out = io.BytesIO()
+    Image.new(mode, size).save(out, fmt)
+    return out.getvalue()
+
+
+def make_book(path, pages, size=(300, 400)):
+    """Write a zip book of blank JPEG pages named 000.jpg, 001.jpg and so on."""
+    image = make_image('JPEG', size)
+    with zipfile.ZipFile(path, 'w') as zf:
+        for i in range(pages):
+            zf.writestr('%03d.jpg' % i, image)
+
+
+def make_zip(path, names):
+    """Write a zip file whose members each hold their own name."""
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name in names:
+            zf.writestr(name, name)
+
+
+def fake_extract(path, names, dest):
+    """Stand in for the unrar tool by copying members out of a zip file."""
+    with zipfile.ZipFile(path) as zf:
+        for name in names:
+            target = os.path.join(dest, name)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            with open(target, 'wb') as fh:
+                fh.write(zf.read(name))
+    return True
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db
+from linga.archives import ArchiveCache, open_stored_entry
+from linga.comics import Comic, open_archive
+from helpers import make_zip, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestArchiveCache(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        db.session.remove()
+        self.base = tempfile.mkdtemp()
+        self.paths = []
+        for name in ['a.cbz', 'b.cbz', 'c.cbz']:
+            path = os.path.join(self.base, name)
+            make_zip(path, ['1.jpg', '2.jpg'])
+            self.paths.append(path)
+        self.cache = ArchiveCache(2)
+
+    def tearDown(self):
+        self.cache.clear()
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def test_should_share_reader_for_same_file(self):
+        first = self.cache.get(self.paths[0], open_archive)
+        second = self.cache.get(self.paths[0], open_archive)
+        self.assertIs(first, second)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_should_close_least_recently_used_reader(self):
+        first = self.cache.get(self.paths[0], open_archive)
+        self.cache.get(self.paths[1], open_archive)
+        self.cache.get(self.paths[0], open_archive)
+        second = self.cache.get(self.paths[1], open_archive)
+        self.cache.get(self.paths[2], open_archive)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(first.fp)
+        self.assertIsNotNone(second.fp)
+
+    def test_should_reopen_changed_file(self):
+        first = self.cache.get(self.paths[0], open_archive)
+        make_zip(self.paths[0], ['1.jpg', '2.jpg', '3.jpg'])
+        os.utime(self.paths[0], (1, 1))
+        second = self.cache.get(self.paths[0], open_archive)
+
+        self.assertIsNot(first, second)
+        self.assertIsNone(first.fp)
+        self.assertEqual(len(second.namelist()), 3)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_should_not_cache_when_disabled(self):
+        cache = ArchiveCache(0)
+        opener = mock.MagicMock()
+        cache.get(self.paths[0], opener)
+        cache.get(self.paths[0], opener)
+        self.assertEqual(opener.call_count, 2)
+        self.assertEqual(len(cache), 0)
+
+    @mock.patch('linga.comics.get_archive_cache')
+    def test_comic_should_reopen_reader_closed_by_eviction(self, get_cache):
+        get_cache.return_value = self.cache
+        comic = Comic(self.paths[0])
+        comic.get_archive()
+        self.cache.clear()
+        self.assertEqual(comic.get_file(0), b'1.jpg')
+
+
+class TestOpenStoredEntry(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        db.session.remove()
+        self.base = tempfile.mkdtemp()
+        self.path = os.path.join(self.base, 'test.cbz')
+        with zipfile.ZipFile(self.path, 'w') as zf:
+            zf.writestr('a.jpg', b'first page data', zipfile.ZIP_STORED)
+            zf.writestr('b.jpg', b'second page data' * 100, zipfile.ZIP_DEFLATED)
+        self.info = zipfile.ZipFile(self.path).infolist()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def test_should_read_stored_member_from_file(self):
+        with open_stored_entry(self.path, self.info[0].header_offset, self.info[0].file_size) as fh:
+            self.assertEqual(fh.read(5), b'first')
+            self.assertEqual(fh.read(), b' page data')
+            self.assertEqual(fh.read(), b'')
+
+    def test_should_seek_within_member(self):
+        with open_stored_entry(self.path, self.info[0].header_offset, self.info[0].file_size) as fh:
+            fh.seek(6)
+            self.assertEqual(fh.read(4), b'page')
+            fh.seek(-4, os.SEEK_END)
+            self.assertEqual(fh.tell(), 11)
+            self.assertEqual(fh.read(), b'data')
+
+    def test_should_not_open_compressed_member(self):
+        self.assertIsNone(open_stored_entry(self.path, self.info[1].header_offset, 1600))
+
+    def test_should_not_open_non_zip_offset(self):
+        self.assertIsNone(open_stored_entry(self.path, 5, 10))
+
+    def test_comic_should_stream_stored_and_compressed_pages(self):
+        comic = Comic(self.path, zipfile.ZipFile(self.path))
+        comic.manifest = comic.build_manifest()
+        stream, size = comic.open_file(0)
+        self.assertEqual((stream.read(), size), (b'first page data', 15))
+        stream.close()
+        stream, size = comic.open_file(1)
+        self.assertEqual((stream.read(), size), (b'second page data' * 100, 1600))
+        stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
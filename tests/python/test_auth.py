@@ -4,21 +4,31 @@
 import sys
 from os.path import dirname, abspath
 from datetime import datetime
+import time
 import unittest
 
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
+import linga.auth
 from linga import app, db, User
-from linga.auth import user_query
+from linga.auth import user_query, load_user, UserCache
+from helpers import TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
 
 
 class TestUser(unittest.TestCase):
     def setUp(self):
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///tmp.db'
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
         db.init_app(app)
         db.create_all()
+        db.session.remove()
 
     def tearDown(self):
+        db.session.remove()
         db.drop_all()
 
     def test_should_accept_email_on_create(self):
@@ -59,3 +69,64 @@ class TestUser(unittest.TestCase):
         users = user_query().all()
         self.assertEquals(len(users), 1)
         self.assertEquals(users[0].email, 'bob@foo.com')
+
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        db.session.remove()
+        self.cache = UserCache()
+        patcher = mock.patch('linga.auth._user_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User('foo@bar.com', 'Password1')
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.user_id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_should_query_user_once(self):
+        with mock.patch('linga.auth.get_user_by_id', wraps=linga.auth.get_user_by_id) as query:
+            first = load_user(str(self.user_id))
+            second = load_user(str(self.user_id))
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual(second.email, 'foo@bar.com')
+        self.assertTrue(second.check_password('Password1'))
+        self.assertIsNot(first, second)
+
+    def test_should_expire_cached_users(self):
+        load_user(str(self.user_id))
+        with mock.patch('linga.auth.time.time', return_value=time.time() + 3600):
+            self.assertIsNone(self.cache.get(self.user_id))
+
+    def test_should_not_cache_without_ttl(self):
+        with mock.patch.dict(app.config, {'USER_CACHE_TTL': 0}):
+            load_user(str(self.user_id))
+        self.assertIsNone(self.cache.get(self.user_id))
+
+    def test_should_forget_user_when_saved(self):
+        load_user(str(self.user_id))
+        self.user.email = 'bob@foo.com'
+        db.session.add(self.user)
+        db.session.commit()
+        self.assertIsNone(self.cache.get(self.user_id))
+        self.assertEqual(load_user(str(self.user_id)).email, 'bob@foo.com')
+
+    def test_should_update_cached_copy_when_saved(self):
+        load_user(str(self.user_id))
+        db.session.remove()
+        user = load_user(str(self.user_id))
+        user.last_login = datetime(2020, 1, 2)
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(user_query().count(), 1)
+        self.assertEqual(user_query().first().last_login, datetime(2020, 1, 2))
+
+    def test_should_ignore_invalid_ids(self):
+        self.assertIsNone(load_user('foo'))
+        self.assertIsNone(load_user('12345'))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga.comics import ComicLister
+from linga.benchmark import (make_library, book_relpath, summarize, compare)
+
+
+class TestMakeLibrary(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_should_nest_books_depth_directories_deep(self):
+        self.assertEqual(book_relpath(0, 0), 'book-00000')
+        self.assertEqual(book_relpath(21, 2), os.path.join('d1', 'd1', 'book-00021'))
+
+    def test_should_generate_listable_books(self):
+        relpaths = make_library(self.base, 10, depth=2, pages=3, page_size=(40, 60))
+        self.assertEqual(len(relpaths), 10)
+        self.assertEqual(ComicLister(self.base).get_book_list(),
+                         sorted(os.path.join(self.base, relpath) for relpath in relpaths))
+        with zipfile.ZipFile(os.path.join(self.base, relpaths[0])) as zf:
+            self.assertEqual(zf.namelist(), ['0000.jpg', '0001.jpg', '0002.jpg'])
+            self.assertEqual(zf.infolist()[0].compress_type, zipfile.ZIP_STORED)
+
+    def test_should_deflate_pages_on_request(self):
+        relpath = make_library(self.base, 1, pages=1, stored=False, page_size=(40, 60))[0]
+        with zipfile.ZipFile(os.path.join(self.base, relpath)) as zf:
+            self.assertEqual(zf.infolist()[0].compress_type, zipfile.ZIP_DEFLATED)
+
+
+class TestResults(unittest.TestCase):
+    def test_should_summarize_timings(self):
+        stats = summarize([0.3, 0.1, 0.2, 0.4])
+        self.assertEqual((stats['count'], stats['min'], stats['median'], stats['max']),
+                         (4, 0.1, 0.3, 0.4))
+        self.assertAlmostEqual(stats['mean'], 0.25)
+        self.assertAlmostEqual(stats['ops_per_sec'], 4.0)
+
+    def test_should_compare_medians(self):
+        out = io.StringIO()
+        compare({'results': {'a': {'median': 0.002}, 'gone': {'median': 1}}},
+                {'results': {'a': {'median': 0.001}, 'new': {'median': 1}}}, out)
+        self.assertEqual(out.getvalue().split(), ['a', '2.000ms', '1.000ms', '-50.0%'])
+
+
+if __name__ == '__main__':
+    unittest.main()
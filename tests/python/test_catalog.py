@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+from sqlalchemy import event
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db, User
+from linga.comics import (ComicLister, BookEntry)
+from linga.catalog import (LibraryCatalog, CatalogBook, CatalogDir, catalog_query,
+                           set_watched)
+from helpers import touch, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestLibraryCatalog(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        touch(os.path.join(self.base, 'foo.cbz'))
+        touch(os.path.join(self.base, 'notes.txt'))
+        touch(os.path.join(self.base, 'bar', 'baz.cbr'))
+        touch(os.path.join(self.base, 'bar', 'fizz', 'buzz.CBZ'))
+        self.catalog = LibraryCatalog(self.base)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def set_dir_mtime(self, relpath, mtime):
+        path = os.path.join(self.base, relpath)
+        os.utime(path, (mtime, mtime))
+
+    def test_should_index_supported_books(self):
+        self.catalog.rescan()
+        self.assertEqual(self.catalog.get_book_list(), [
+            os.path.join('bar', 'baz.cbr'),
+            os.path.join('bar', 'fizz', 'buzz.CBZ'),
+            'foo.cbz',
+        ])
+
+    def test_should_store_size_mtime_and_parent(self):
+        touch(os.path.join(self.base, 'bar', 'baz.cbr'), 1000000)
+        self.catalog.rescan()
+        book = catalog_query().filter_by(relpath=os.path.join('bar', 'baz.cbr')).one()
+        self.assertEqual(book.size, 1)
+        self.assertEqual(book.mtime, 1000000)
+        self.assertEqual(book.parent, 'bar')
+
+    def test_should_return_entries_with_size_and_mtime(self):
+        touch(os.path.join(self.base, 'bar', 'baz.cbr'), 1000000)
+        self.catalog.rescan()
+        entries = self.catalog.get_entries()
+        self.assertEqual([entry.rel_path for entry in entries], self.catalog.get_book_list())
+        self.assertIsInstance(entries[0], BookEntry)
+        self.assertEqual((entries[0].size, entries[0].mtime), (1, 1000000))
+
+    def test_should_match_sequential_scan_with_parallel_workers(self):
+        touch(os.path.join(self.base, 'bar', 'fizz', 'deep', 'a.cbz'))
+        touch(os.path.join(self.base, 'qux', 'b.cbr'))
+        with mock.patch.dict(app.config, {'SCAN_WORKERS': 4}):
+            self.assertEqual(self.catalog.rescan(), 5)
+        self.assertEqual([os.path.join(self.base, path) for path in self.catalog.get_book_list()],
+                         ComicLister(self.base).get_book_list())
+
+    def test_should_not_list_unchanged_directories_on_rescan(self):
+        self.assertEqual(self.catalog.rescan(), 3)
+        self.assertEqual(self.catalog.rescan(), 0)
+
+    def test_should_retry_when_another_scan_adds_the_same_rows(self):
+        sync_dir = LibraryCatalog._sync_dir
+        def concurrent_scan(catalog, relpath, *args):
+            if not self.raced:
+                self.raced = True
+                with db.engine.begin() as connection:
+                    connection.execute(CatalogDir.__table__.insert(), relpath='',
+                                       parent=None, mtime=0)
+                    connection.execute(CatalogBook.__table__.insert(), relpath='foo.cbz',
+                                       parent='', size=1, mtime=0)
+            return sync_dir(catalog, relpath, *args)
+        self.raced = False
+        with mock.patch.object(LibraryCatalog, '_sync_dir', concurrent_scan):
+            self.catalog.rescan()
+        self.assertTrue(self.raced)
+        self.assertEqual(len(self.catalog.get_book_list()), 3)
+        self.assertEqual(self.catalog.rescan(), 0)
+
+    def test_should_pick_up_added_and_removed_books(self):
+        self.catalog.rescan()
+        touch(os.path.join(self.base, 'bar', 'new.cbz'))
+        os.remove(os.path.join(self.base, 'foo.cbz'))
+        self.set_dir_mtime('', 1)
+        self.set_dir_mtime('bar', 2)
+
+        self.assertEqual(self.catalog.rescan(), 2)
+        self.assertEqual(self.catalog.get_book_list(), [
+            os.path.join('bar', 'baz.cbr'),
+            os.path.join('bar', 'fizz', 'buzz.CBZ'),
+            os.path.join('bar', 'new.cbz'),
+        ])
+
+    def test_should_drop_removed_directories(self):
+        self.catalog.rescan()
+        shutil.rmtree(os.path.join(self.base, 'bar'))
+        self.set_dir_mtime('', 1)
+        self.catalog.rescan()
+        self.assertEqual(self.catalog.get_book_list(), ['foo.cbz'])
+        self.assertEqual(db.session.query(CatalogDir).count(), 1)
+
+    def test_should_only_rescan_on_refresh_when_stale(self):
+        self.catalog.refresh(0)
+        touch(os.path.join(self.base, 'new.cbz'))
+        self.set_dir_mtime('', 1)
+        self.catalog.refresh(3600)
+        self.assertEqual(catalog_query().count(), 3)
+        self.catalog.refresh(0)
+        self.assertEqual(catalog_query().count(), 4)
+
+    def test_should_relist_updated_dirs_regardless_of_mtime(self):
+        self.catalog.rescan()
+        self.set_dir_mtime('bar', 2)
+        self.catalog.rescan()
+        touch(os.path.join(self.base, 'bar', 'new.cbz'))
+        self.set_dir_mtime('bar', 2)
+
+        self.assertEqual(self.catalog.update_dirs(['bar']), 1)
+        self.assertIn(os.path.join('bar', 'new.cbz'), self.catalog.get_book_list())
+
+    def test_should_skip_rescan_on_refresh_when_watched(self):
+        set_watched(self.base)
+        try:
+            self.catalog.refresh(0)
+        finally:
+            set_watched(self.base, False)
+        self.assertEqual(catalog_query().count(), 0)
+
+    def test_should_name_catalog_book_from_file(self):
+        self.assertEqual(CatalogBook(os.path.join('foo', 'bar_baz.cbz')).book_name(), 'bar baz')
+
+
+class TestDirectoryListing(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        for path in ['zed.cbz', 'foo.cbz', 'qux/a.cbz', 'bar/baz.cbr', 'bar/fizz/buzz.cbz',
+                     'bar-x/other.cbz']:
+            touch(os.path.join(self.base, *path.split('/')))
+        self.catalog = LibraryCatalog(self.base)
+        self.catalog.rescan()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def get_json(self, url):
+        user = User('foo@bar.com', 'Password1')
+        user.user_id = 1
+        with mock.patch.dict(app.config, {'TESTING': True, 'BOOK_PATH': self.base}), \
+                mock.patch('flask_login.utils._get_user', return_value=user):
+            return app.test_client().get(url)
+
+    def test_should_list_dirs_before_books(self):
+        dirs, books = self.catalog.list_dir('')
+        self.assertEqual([item.relpath for item in dirs], ['bar', 'bar-x', 'qux'])
+        self.assertEqual([item.rel_path for item in books], ['foo.cbz', 'zed.cbz'])
+        self.assertIsInstance(books[0], BookEntry)
+
+    def test_should_page_across_dirs_and_books(self):
+        dirs, books = self.catalog.list_dir('', 2, 2)
+        self.assertEqual([item.relpath for item in dirs], ['qux'])
+        self.assertEqual([item.rel_path for item in books], ['foo.cbz'])
+        dirs, books = self.catalog.list_dir('', 4, 2)
+        self.assertEqual((dirs, [item.rel_path for item in books]), ([], ['zed.cbz']))
+
+    def test_should_count_entries(self):
+        self.assertEqual(self.catalog.count_dir(''), (3, 2))
+        self.assertEqual(self.catalog.count_subdirs(['bar', 'qux']), {'bar': 1, 'qux': 0})
+        self.assertEqual(self.catalog.count_subtree_books(['bar', 'bar-x', 'qux']),
+                         {'bar': 2, 'bar-x': 1, 'qux': 1})
+        self.assertEqual(self.catalog.count_subtree_books(['']), {'': 6})
+        self.assertEqual(self.catalog.count_subtree_books([]), {})
+
+    def test_should_return_directory_page_as_json(self):
+        res = self.get_json('/books/dir/?limit=3')
+        self.assertEqual(res.status_code, 200)
+        data = res.get_json()
+        self.assertEqual((data['dir_count'], data['book_count']), (3, 2))
+        self.assertEqual([item['name'] for item in data['items']], ['bar', 'bar-x', 'qux'])
+        self.assertEqual(data['items'][0]['book_count'], 2)
+        self.assertEqual(data['items'][0]['dir_count'], 1)
+        self.assertEqual(data['items'][0]['url'], '/books/dir/bar')
+
+        data = self.get_json(data['next']).get_json()
+        self.assertEqual([item['type'] for item in data['items']], ['book', 'book'])
+        self.assertEqual(data['items'][0]['url'], '/books/read/foo.cbz/')
+        self.assertIsNone(data['next'])
+
+    def test_should_count_subtree_books_in_one_query(self):
+        statements = []
+        def count(*args): #pylint: disable=unused-argument
+            statements.append(args[2])
+        for name in ['d1', 'd2', 'd3', 'd4']:
+            touch(os.path.join(self.base, name, 'x', 'book.cbz'))
+        self.catalog.rescan()
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            data = self.get_json('/books/dir/').get_json()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual([item['book_count'] for item in data['items'][:7]],
+                         [2, 1, 1, 1, 1, 1, 1])
+        self.assertEqual(len([sql for sql in statements if 'linga_catalog_books' in sql]), 3)
+
+    def test_should_list_nested_directory(self):
+        data = self.get_json('/books/dir/bar--fizz').get_json()
+        self.assertEqual([item['name'] for item in data['items']], ['buzz'])
+
+    def test_should_not_find_unknown_directory(self):
+        self.assertEqual(self.get_json('/books/dir/nope').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,8 @@ import sys
 import datetime
 import unittest
 import zipfile
+import shutil
+import tempfile
 
 from os.path import dirname
 
@@ -15,9 +17,10 @@ except:
 sys.path.insert(0, dirname(dirname(dirname(os.path.abspath(__file__)))))
 
 from linga import app, db, User
-from linga.comics import (ComicLister, Comic, ComicDir, ComicMetadata, InvalidPageError,
+from linga.comics import (ComicLister, Comic, ComicDir, BookEntry, ComicMetadata, InvalidPageError,
 						  is_supported_format, is_supported_image, path_to_book,
-						  relpath_to_book, remove_sep, add_sep, comic_query)
+						  relpath_to_book, remove_sep, add_sep, comic_query, PageManifest)
+from helpers import TEST_DATABASE_URI
 
 class TestComicLister(unittest.TestCase):
 	def setUp(self):
@@ -132,6 +135,24 @@ class TestComicLister(unittest.TestCase):
 		self.assertIn(books[2], ret.traverse_children(['foo', 'bar']).books)
 
 		
+class TestBookEntry(unittest.TestCase):
+	def test_should_not_have_instance_dict(self):
+		entry = BookEntry(os.path.join('foo', 'bar-baz.cbz'), 10, 1000)
+		self.assertFalse(hasattr(entry, '__dict__'))
+		self.assertFalse(hasattr(ComicDir(), '__dict__'))
+
+	def test_should_get_name_and_display_path(self):
+		entry = BookEntry(os.path.join('foo', 'bar-baz.cbz'))
+		self.assertEqual(entry.name, 'bar baz')
+		self.assertEqual(entry.disp_relpath(), remove_sep(os.path.join('foo', 'bar-baz.cbz')))
+
+	def test_should_group_entries_by_folder(self):
+		entries = [BookEntry('a.cbz'), BookEntry(os.path.join('foo', 'bar', 'b.cbz'))]
+		ret = ComicLister('x').group_by_path(entries)
+		self.assertIn(entries[0], ret.books)
+		self.assertIn(entries[1], ret.traverse_children(['foo', 'bar']).books)
+
+
 class TestComicIsSupportedFile(unittest.TestCase):
 	@mock.patch('linga.comics.os.path.isfile')
 	def test_should_accept_case_insensitive_cbz(self, mock_isfile):
@@ -337,14 +358,16 @@ class TestComicDir(unittest.TestCase):
 	
 class TestComicMetadata(unittest.TestCase):
 	def setUp(self):
-		app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///tmp.db'
+		app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
 		db.init_app(app)
 		db.create_all()
+		db.session.remove()
 		self.usr = User('foo', 'bar')
 		db.session.add(self.usr)
 		db.session.commit()
 	
 	def tearDown(self):
+		db.session.remove()
 		db.drop_all()
 	
 	def test_should_set_userid_on_create(self):
@@ -410,5 +433,67 @@ class TestComicMetadata(unittest.TestCase):
 		self.assertEquals('foo--bar--baz.cbz', c.disp_relpath() )
 	
 	
+class TestPageManifest(unittest.TestCase):
+	def setUp(self):
+		app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+		db.init_app(app)
+		db.create_all()
+		db.session.remove()
+		self.base = tempfile.mkdtemp()
+		self.path = os.path.join(self.base, 'test.cbz')
+		self.make_zip(['b.jpg', 'a.png', 'notes.txt'])
+	
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		shutil.rmtree(self.base)
+	
+	def make_zip(self, names):
+		with zipfile.ZipFile(self.path, 'w') as zf:
+			for name in names:
+				zf.writestr(name, 'data-' + name, zipfile.ZIP_DEFLATED)
+	
+	def test_should_list_page_details_in_order(self):
+		pages = Comic(self.path, zipfile.ZipFile(self.path)).get_manifest()
+		self.assertEqual([p['name'] for p in pages], ['a.png', 'b.jpg'])
+		info = zipfile.ZipFile(self.path).getinfo('b.jpg')
+		self.assertEqual(pages[1]['file_size'], info.file_size)
+		self.assertEqual(pages[1]['compress_size'], info.compress_size)
+		self.assertEqual(pages[1]['compress_type'], zipfile.ZIP_DEFLATED)
+		self.assertEqual(pages[1]['header_offset'], info.header_offset)
+		self.assertEqual(pages[1]['crc'], info.CRC)
+	
+	def test_should_not_open_pages_to_build_manifest(self):
+		archive = zipfile.ZipFile(self.path)
+		with mock.patch.object(archive, 'open') as open_member:
+			pages = Comic(self.path, archive).get_manifest()
+		self.assertFalse(open_member.called)
+		self.assertNotIn('width', pages[0])
+	
+	def test_should_persist_manifest(self):
+		Comic(self.path, zipfile.ZipFile(self.path)).get_manifest()
+		self.assertEqual(db.session.query(PageManifest).count(), 1)
+		
+		archive = mock.MagicMock()
+		files = Comic(self.path, archive).get_file_list()
+		self.assertEqual(files, ['a.png', 'b.jpg'])
+		self.assertFalse(archive.namelist.called)
+	
+	def test_should_rebuild_manifest_when_archive_changes(self):
+		Comic(self.path, zipfile.ZipFile(self.path)).get_manifest()
+		self.make_zip(['c.jpg'])
+		os.utime(self.path, (1, 1))
+		files = Comic(self.path, zipfile.ZipFile(self.path)).get_file_list()
+		self.assertEqual(files, ['c.jpg'])
+		self.assertEqual(db.session.query(PageManifest).count(), 1)
+	
+	def test_should_store_manifest_outside_request_session(self):
+		db.session.add(User('foo@bar.com', 'Password1'))
+		Comic(self.path, zipfile.ZipFile(self.path)).get_manifest()
+		db.session.rollback()
+		self.assertEqual(db.session.query(User).count(), 0)
+		self.assertEqual(db.session.query(PageManifest).count(), 1)
+	
+	
 if __name__ == '__main__':
     unittest.main()
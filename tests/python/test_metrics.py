@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from flask import g
+
+from linga import app
+from linga.metrics import (Histogram, Metrics, timed, stage_summary)
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestHistogram(unittest.TestCase):
+    def test_should_render_cumulative_buckets(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.render('t', [('stage', 'x')]), [
+            't_bucket{stage="x",le="0.1"} 1',
+            't_bucket{stage="x",le="1.0"} 3',
+            't_bucket{stage="x",le="+Inf"} 4',
+            't_sum{stage="x"} 4.25',
+            't_count{stage="x"} 4',
+        ])
+
+    def test_should_escape_label_values(self):
+        metrics = Metrics()
+        metrics.observe_stage('a"b\\c', 0.1)
+        self.assertIn('stage="a\\"b\\\\c"', metrics.render())
+
+    def test_should_render_cache_counters(self):
+        text = Metrics().render([('page', 3, 4)])
+        self.assertIn('linga_cache_hits_total{cache="page"} 3\n', text)
+        self.assertIn('linga_cache_misses_total{cache="page"} 4\n', text)
+
+
+class TestStageTiming(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('linga.metrics._metrics', Metrics())
+        self.metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_should_record_stages_in_request(self):
+        @timed('work')
+        def work():
+            return 42
+        with app.test_request_context():
+            self.assertEqual(work(), 42)
+            with timed('other'):
+                pass
+            self.assertEqual([stage for stage, elapsed in g.stage_times], ['work', 'other'])
+        self.assertEqual(self.metrics.stages['work'].count, 1)
+
+    def test_should_record_stages_outside_requests(self):
+        with timed('background'):
+            pass
+        self.assertEqual(self.metrics.stages['background'].count, 1)
+
+    def test_should_not_record_when_disabled(self):
+        with mock.patch.dict(app.config, {'METRICS_ENABLED': False}):
+            with timed('work'):
+                pass
+        self.assertNotIn('work', self.metrics.stages)
+
+    def test_should_summarize_repeated_stages(self):
+        self.assertEqual(stage_summary([('read', 0.25), ('open', 0.125), ('read', 0.25)]),
+                         'read=0.500s x2, open=0.125s')
+        self.assertEqual(stage_summary([]), 'no stages')
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.config = mock.patch.dict(app.config, {
+            'TESTING': True,
+            'CACHE_PATH': self.base,
+            'METRICS_ALLOWED_ADDRESSES': [],
+        })
+        self.config.start()
+        patcher = mock.patch('linga.metrics._metrics', Metrics())
+        self.metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Caches created to report their counters mustn't outlive the test.
+        for name in ['linga.thumbnails._thumbnail_cache', 'linga.variants._variant_cache',
+                     'linga.rarcache._rar_cache']:
+            patcher = mock.patch(name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.config.stop()
+        shutil.rmtree(self.base)
+
+    def test_should_count_requests_by_route(self):
+        self.client.get('/user/login')
+        self.client.get('/no/such/page')
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('linga_requests_total{endpoint="user_login",method="GET",status="200"} 1',
+                      text)
+        self.assertIn('linga_requests_total{endpoint="unmatched",method="GET",status="404"} 1',
+                      text)
+        self.assertIn('linga_request_duration_seconds_count{endpoint="user_login",method="GET"} 1',
+                      text)
+        self.assertIn('linga_cache_hits_total{cache="page"}', text)
+
+    def test_should_count_unhandled_errors(self):
+        with mock.patch('linga.views.search_books', side_effect=RuntimeError('boom')), \
+                mock.patch('flask_login.utils._get_user'):
+            with mock.patch.dict(app.config, {'TESTING': False}):
+                self.assertEqual(self.client.get('/books/search?q=x').status_code, 500)
+            self.assertRaises(RuntimeError, self.client.get, '/books/search?q=x')
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('linga_requests_total{endpoint="search",method="GET",status="500"} 2', text)
+
+    def test_should_only_serve_allowed_addresses(self):
+        with mock.patch.dict(app.config, {'METRICS_ALLOWED_ADDRESSES': ['10.0.0.1']}):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+            res = self.client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(res.content_type.startswith('text/plain; version=0.0.4'))
+
+    def test_should_not_serve_when_disabled(self):
+        with mock.patch.dict(app.config, {'METRICS_ENABLED': False}):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_should_log_slow_requests_with_stages(self):
+        with mock.patch.dict(app.config, {'SLOW_REQUEST_TIME': 1e-9}):
+            with mock.patch.object(app.logger, 'warning') as warning:
+                self.client.get('/user/login')
+        self.assertTrue(warning.called)
+        self.assertIn('Slow request', warning.call_args[0][0])
+        self.assertEqual(warning.call_args[0][1:3], ('GET', '/user/login?'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import dirname, abspath
+
+from PIL import Image
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+import linga
+from linga import app, db, User
+from linga.pagecache import (PageCache, Prefetcher)
+from linga.pagesizes import get_size_reader
+from helpers import make_image, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class PageViewTestCase(unittest.TestCase):
+    """Runs the image endpoints against a real book in a temporary library."""
+
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        self.book_path = os.path.join(self.base, 'test.cbz')
+        with zipfile.ZipFile(self.book_path, 'w') as zf:
+            zf.writestr('001.jpg', make_image('JPEG', (300, 400)), zipfile.ZIP_STORED)
+            zf.writestr('002.png', make_image('PNG', (300, 400)), zipfile.ZIP_DEFLATED)
+        self.config = mock.patch.dict(app.config, {
+            'TESTING': True,
+            'BOOK_PATH': self.base,
+            'CACHE_PATH': os.path.join(self.base, 'cache'),
+        })
+        self.config.start()
+        # Keep cached pages and images from one test out of the next.
+        cache = PageCache(1024 * 1024)
+        for name, value in [('linga.pagecache._page_cache', cache),
+                            ('linga.pagecache._prefetcher', Prefetcher(cache, 0, 1)),
+                            ('linga.pagecache._manifest_cache', PageCache(1024 * 1024)),
+                            ('linga.thumbnails._thumbnail_cache', None),
+                            ('linga.variants._variant_cache', None),
+                            ('linga.pagesizes._size_reader', mock.MagicMock())]:
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        user = User('foo@bar.com', 'Password1')
+        user.user_id = 1
+        patcher = mock.patch('flask_login.utils._get_user', return_value=user)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.config.stop()
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def version(self):
+        return linga.views.get_book('test.cbz').version()
+
+
+class TestConditionalRequests(PageViewTestCase):
+    def test_should_send_validators_with_page(self):
+        res = self.client.get('/books/page/test.cbz/1')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers['ETag'].startswith('"%s-0-' % self.version()))
+        self.assertIn('Last-Modified', res.headers)
+        self.assertEqual(res.headers['Cache-Control'], 'private, no-cache')
+
+    def test_should_return_not_modified_for_matching_etag(self):
+        for url in ['/books/page/test.cbz/2', '/books/pagethumb/test.cbz/2',
+                    '/books/thumbsheet/test.cbz/1', '/books/cover/test.cbz']:
+            etag = self.client.get(url).headers['ETag']
+            res = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(res.status_code, 304, url)
+            self.assertEqual(res.data, b'')
+
+    def test_should_return_not_modified_since_archive_mtime(self):
+        last_modified = self.client.get('/books/page/test.cbz/1').headers['Last-Modified']
+        res = self.client.get('/books/page/test.cbz/1', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(res.status_code, 304)
+
+    def test_should_send_page_again_after_archive_changes(self):
+        etag = self.client.get('/books/page/test.cbz/1').headers['ETag']
+        os.utime(self.book_path, (1, 1))
+        res = self.client.get('/books/page/test.cbz/1', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+    def test_should_cache_versioned_urls_forever(self):
+        res = self.client.get('/books/page/test.cbz/1?v=' + self.version())
+        self.assertEqual(res.headers['Cache-Control'], 'private, max-age=31536000, immutable')
+        res = self.client.get('/books/pagethumb/test.cbz/1?v=old')
+        self.assertEqual(res.headers['Cache-Control'], 'private, no-cache')
+
+    def test_should_not_serve_page_zero(self):
+        for url in ['/books/page/test.cbz/0', '/books/pagethumb/test.cbz/0']:
+            res = self.client.get(url + '?v=' + self.version())
+            self.assertEqual(res.status_code, 404, url)
+            self.assertNotIn('immutable', res.headers.get('Cache-Control', ''))
+
+
+class TestRangeRequests(PageViewTestCase):
+    def page_data(self, name):
+        return zipfile.ZipFile(self.book_path).read(name)
+
+    def test_should_advertise_range_support(self):
+        res = self.client.get('/books/page/test.cbz/1')
+        self.assertEqual(res.headers['Accept-Ranges'], 'bytes')
+
+    def test_should_send_single_range_of_stored_page(self):
+        data = self.page_data('001.jpg')
+        res = self.client.get('/books/page/test.cbz/1', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.data, data[10:20])
+        self.assertEqual(res.headers['Content-Range'], 'bytes 10-19/%d' % len(data))
+
+    def test_should_send_suffix_range_of_compressed_page(self):
+        data = self.page_data('002.png')
+        res = self.client.get('/books/page/test.cbz/2', headers={'Range': 'bytes=-100'})
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.data, data[-100:])
+
+    def test_should_send_multiple_ranges_as_multipart(self):
+        data = self.page_data('002.png')
+        res = self.client.get('/books/page/test.cbz/2', headers={'Range': 'bytes=50-59,0-9'})
+        self.assertEqual(res.status_code, 206)
+        self.assertTrue(res.mimetype.startswith('multipart/byteranges'))
+        boundary = res.mimetype_params['boundary']
+        self.assertEqual(int(res.headers['Content-Length']), len(res.data))
+        parts = res.data.split(('--' + boundary).encode())
+        self.assertEqual(len(parts), 4)
+        self.assertIn(b'Content-Range: bytes 0-9/%d' % len(data), parts[1])
+        self.assertTrue(parts[1].endswith(b'\r\n\r\n' + data[0:10] + b'\r\n'))
+        self.assertTrue(parts[2].endswith(b'\r\n\r\n' + data[50:60] + b'\r\n'))
+        self.assertEqual(parts[3], b'--\r\n')
+
+    def test_should_reject_unsatisfiable_range(self):
+        res = self.client.get('/books/page/test.cbz/1', headers={'Range': 'bytes=999999-'})
+        self.assertEqual(res.status_code, 416)
+        self.assertTrue(res.headers['Content-Range'].startswith('bytes */'))
+
+    def test_should_reject_empty_suffix_range(self):
+        res = self.client.get('/books/page/test.cbz/1', headers={'Range': 'bytes=-0'})
+        self.assertEqual(res.status_code, 416)
+
+    def test_should_send_whole_page_when_if_range_is_stale(self):
+        res = self.client.get('/books/page/test.cbz/1',
+                              headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, self.page_data('001.jpg'))
+
+    def test_should_resume_book_download(self):
+        with open(self.book_path, 'rb') as fh:
+            data = fh.read()
+        res = self.client.get('/books/download/test.cbz')
+        self.assertEqual(res.data, data)
+        self.assertIn('attachment', res.headers['Content-Disposition'])
+
+        res = self.client.get('/books/download/test.cbz', headers={
+            'Range': 'bytes=100-', 'If-Range': res.headers['ETag']})
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.data, data[100:])
+
+
+class TestPageVariants(PageViewTestCase):
+    def test_should_scale_and_reencode_page(self):
+        res = self.client.get('/books/page/test.cbz/2?w=100&fmt=webp')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'image/webp')
+        img = Image.open(io.BytesIO(res.data))
+        self.assertEqual((img.format, img.size), ('WEBP', (128, 171)))
+
+    def test_should_cache_variant_on_disk(self):
+        self.client.get('/books/page/test.cbz/1?h=200')
+        with mock.patch('linga.variants.make_variant') as make_variant:
+            res = self.client.get('/books/page/test.cbz/1?h=200')
+            self.assertFalse(make_variant.called)
+        self.assertEqual(Image.open(io.BytesIO(res.data)).size, (192, 256))
+
+    def test_should_give_variants_their_own_etag(self):
+        original = self.client.get('/books/page/test.cbz/1').headers['ETag']
+        scaled = self.client.get('/books/page/test.cbz/1?w=100').headers['ETag']
+        self.assertNotEqual(original, scaled)
+        res = self.client.get('/books/page/test.cbz/1?w=100', headers={'If-None-Match': scaled})
+        self.assertEqual(res.status_code, 304)
+
+    def test_should_reject_unknown_format(self):
+        res = self.client.get('/books/page/test.cbz/1?fmt=gif')
+        self.assertEqual(res.status_code, 400)
+
+    def test_should_reject_sizes_below_one(self):
+        for query in ['w=0', 'h=-10', 'w=100&h=0']:
+            res = self.client.get('/books/page/test.cbz/1?' + query)
+            self.assertEqual(res.status_code, 400, query)
+
+
+class TestPageManifestEndpoint(PageViewTestCase):
+    def test_should_send_compact_manifest(self):
+        with app.test_request_context():
+            linga.views.get_book('test.cbz').measure_pages()
+        res = self.client.get('/books/manifest/test.cbz?v=' + self.version())
+        self.assertEqual(res.status_code, 200)
+        data = res.get_json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['files'], ['001.jpg', '002.png'])
+        self.assertEqual(data['urls']['page'], '/books/page/test.cbz/{page}?v=' + self.version())
+        self.assertEqual(data['urls']['read'], '/books/read/test.cbz/page/{page}')
+        self.assertIn('immutable', res.headers['Cache-Control'])
+
+    def test_should_fill_url_templates_with_working_urls(self):
+        data = self.client.get('/books/manifest/test.cbz').get_json()
+        for key in ['page', 'thumb']:
+            url = data['urls'][key].replace('{page}', '2')
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+        url = data['urls']['sprite'].replace('{start}', '1')
+        self.assertEqual(self.client.get(url).status_code, 200, url)
+        self.assertEqual(data['sprite'], {
+            'pages': app.config['SPRITE_PAGES'],
+            'columns': app.config['SPRITE_COLUMNS'],
+            'width': app.config['THUMBNAIL_SIZE'],
+            'height': app.config['THUMBNAIL_SIZE'],
+        })
+
+    def test_should_measure_pages_after_sending_manifest(self):
+        res = self.client.get('/books/manifest/test.cbz?v=' + self.version())
+        self.assertEqual(res.get_json()['sizes'], [[None, None], [None, None]])
+        self.assertEqual(res.headers['Cache-Control'], 'private, no-cache')
+        self.assertTrue(get_size_reader().schedule.called)
+
+    def test_should_include_page_sizes_once_measured(self):
+        with app.test_request_context():
+            linga.views.get_book('test.cbz').measure_pages()
+        res = self.client.get('/books/manifest/test.cbz?v=' + self.version())
+        self.assertEqual(res.get_json()['sizes'], [[300, 400], [300, 400]])
+        self.assertIn('immutable', res.headers['Cache-Control'])
+        self.assertFalse(get_size_reader().schedule.called)
+
+    def test_should_cache_encoded_manifest(self):
+        self.client.get('/books/manifest/test.cbz')
+        with mock.patch('linga.comics.Comic.get_page_manifest') as build:
+            res = self.client.get('/books/manifest/test.cbz')
+            self.assertFalse(build.called)
+        self.assertEqual(res.get_json()['count'], 2)
+
+    def test_should_return_not_modified_for_matching_etag(self):
+        etag = self.client.get('/books/manifest/test.cbz').headers['ETag']
+        res = self.client.get('/books/manifest/test.cbz', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+
+class TestCovers(PageViewTestCase):
+    def test_should_serve_cover_from_first_page(self):
+        res = self.client.get('/books/cover/test.cbz')
+        self.assertEqual(res.status_code, 200)
+        size = app.config['COVER_SIZE']
+        self.assertEqual(Image.open(io.BytesIO(res.data)).size, (size * 3 // 4, size))
+        self.assertEqual(self.client.get('/books/cover/missing.cbz').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
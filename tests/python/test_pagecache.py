@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db, User, ComicMetadata
+from linga.comics import Comic
+from linga.pagecache import (PageCache, Prefetcher, pages_to_prefetch, open_page)
+from helpers import TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = PageCache(40)
+
+    def test_should_count_hits_and_misses(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', b'1234')
+        self.assertEqual(self.cache.get('a'), b'1234')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['bytes'], 4)
+
+    def test_should_evict_least_recently_used_over_budget(self):
+        self.cache.put('a', b'x' * 10)
+        self.cache.put('b', b'x' * 10)
+        self.cache.put('c', b'x' * 10)
+        self.cache.get('a')
+        self.cache.put('d', b'x' * 10)
+        self.cache.put('e', b'x' * 10)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('a', self.cache)
+        self.assertEqual(self.cache.stats()['bytes'], 40)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_should_replace_existing_page(self):
+        self.cache.put('a', b'x' * 10)
+        self.cache.put('a', b'x' * 5)
+        self.assertEqual(self.cache.stats()['bytes'], 5)
+
+    def test_should_not_store_pages_over_a_quarter_of_budget(self):
+        self.cache.put('a', b'x' * 11)
+        self.assertNotIn('a', self.cache)
+
+
+class TestPagesToPrefetch(unittest.TestCase):
+    def test_should_read_following_pages(self):
+        self.assertEqual(pages_to_prefetch(3, 10, 2), [4, 5])
+
+    def test_should_read_two_pages_per_turn_in_dual_page_mode(self):
+        self.assertEqual(pages_to_prefetch(3, 10, 2, 2), [4, 5, 6, 7])
+
+    def test_should_read_earlier_pages_when_going_backward(self):
+        self.assertEqual(pages_to_prefetch(3, 10, 2, backward=True), [2, 1])
+
+    def test_should_stop_at_ends_of_book(self):
+        self.assertEqual(pages_to_prefetch(8, 10, 3), [9])
+        self.assertEqual(pages_to_prefetch(0, 10, 3, backward=True), [])
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        self.book_path = os.path.join(self.base, 'test.cbz')
+        with zipfile.ZipFile(self.book_path, 'w') as zf:
+            for i in range(8):
+                zf.writestr('%03d.jpg' % i, b'page%d' % i)
+        self.book = Comic(self.book_path)
+        self.book.set_rel_path(self.base)
+        self.cache = PageCache(1024)
+        self.prefetcher = Prefetcher(self.cache, 2, 1)
+        self.addCleanup(self.prefetcher.executor.shutdown)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def cached_pages(self):
+        return sorted(key[1] for key in self.cache.pages)
+
+    def test_should_cache_next_pages(self):
+        self.prefetcher.prefetch(self.book_path, 'test.cbz', 2, 1)
+        self.assertEqual(self.cached_pages(), [3, 4])
+        self.assertEqual(self.cache.get((self.book.file_key(), 3)), b'page3')
+
+    def test_should_read_ahead_two_pages_per_turn_for_dual_page_books(self):
+        meta = ComicMetadata(1, 'test.cbz')
+        meta.dual_page = True
+        db.session.add(meta)
+        db.session.commit()
+        self.prefetcher.prefetch(self.book_path, 'test.cbz', 2, 1)
+        self.assertEqual(self.cached_pages(), [3, 4, 5, 6])
+
+    def test_should_read_backward_after_turning_back(self):
+        self.prefetcher.executor = mock.MagicMock()
+        self.prefetcher.schedule(self.book, 5, 1)
+        self.prefetcher.schedule(self.book, 4, 1)
+        self.prefetcher.schedule(self.book, 6, 2)
+        calls = self.prefetcher.executor.submit.call_args_list
+        self.assertEqual([call[0][-1] for call in calls], [False, True, False])
+
+    def test_should_open_cached_page_without_archive(self):
+        self.cache.put((self.book.file_key(), 0), b'cached')
+        with mock.patch('linga.pagecache.get_page_cache', return_value=self.cache), \
+                mock.patch.object(self.book, 'open_file') as open_file:
+            stream, size = open_page(self.book, 0)
+            self.assertEqual((stream.read(), size), (b'cached', 6))
+            self.assertFalse(open_file.called)
+
+    def test_should_serve_page_from_cache_and_schedule_read_ahead(self):
+        self.cache.put((self.book.file_key(), 0), b'cached')
+        self.prefetcher.executor = mock.MagicMock()
+        user = User('foo@bar.com', 'Password1')
+        user.user_id = 1
+        with mock.patch.dict(app.config, {'TESTING': True, 'BOOK_PATH': self.base}), \
+                mock.patch('flask_login.utils._get_user', return_value=user), \
+                mock.patch('linga.pagecache._page_cache', self.cache), \
+                mock.patch('linga.pagecache._prefetcher', self.prefetcher):
+            res = app.test_client().get('/books/page/test.cbz/1')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, b'cached')
+        self.assertEqual(self.prefetcher.executor.submit.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
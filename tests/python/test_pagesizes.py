@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db
+from linga.comics import Comic
+from linga.diskcache import DiskCache
+from linga.pagesizes import SizeReader
+from linga.rarcache import RarCache
+from helpers import make_image, fake_extract, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestSizeReader(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        db.session.remove()
+        self.base = tempfile.mkdtemp()
+        self.reader = SizeReader()
+
+    def tearDown(self):
+        self.reader.executor.shutdown(wait=True)
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def make_book(self, name):
+        path = os.path.join(self.base, name)
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr('1.jpg', make_image('JPEG', (30, 40)))
+            zf.writestr('2.jpg', make_image('JPEG', (80, 40)))
+        return path
+
+    def sizes(self, path):
+        return [(page.get('width'), page.get('height')) for page in Comic(path).get_manifest()]
+
+    def test_should_store_page_sizes(self):
+        path = self.make_book('book.cbz')
+        self.assertEqual(self.sizes(path), [(None, None), (None, None)])
+        book = Comic(path)
+        self.assertTrue(self.reader.schedule(book))
+        self.reader.executor.shutdown(wait=True)
+        self.assertEqual(self.sizes(path), [(30, 40), (80, 40)])
+        self.assertTrue(Comic(path).has_page_sizes())
+        self.assertFalse(self.reader.pending)
+
+    def test_should_not_use_the_shared_archive(self):
+        path = self.make_book('book.cbz')
+        book = Comic(path)
+        # As left by another request evicting the shared reader.
+        book.archive = zipfile.ZipFile(path)
+        book.archive.close()
+        self.assertTrue(book.measure_pages())
+        self.assertEqual(self.sizes(path), [(30, 40), (80, 40)])
+
+    def test_should_not_store_unreadable_sizes(self):
+        path = os.path.join(self.base, 'book.cbz')
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr('1.jpg', make_image('JPEG', (30, 40)))
+            zf.writestr('2.jpg', b'not an image')
+        Comic(path).measure_pages()
+        pages = Comic(path).get_manifest()
+        self.assertEqual((pages[0]['width'], pages[0]['height']), (30, 40))
+        self.assertNotIn('width', pages[1])
+        self.assertFalse(Comic(path).has_page_sizes())
+
+    def test_should_not_schedule_book_twice(self):
+        book = Comic(self.make_book('book.cbz'))
+        with mock.patch.object(self.reader.executor, 'submit') as submit:
+            self.assertTrue(self.reader.schedule(book))
+            self.assertFalse(self.reader.schedule(book))
+        self.assertEqual(submit.call_count, 1)
+
+    def test_should_wait_for_rar_pages_to_be_unpacked(self):
+        path = self.make_book('book.cbr')
+        rar_cache = RarCache(DiskCache(os.path.join(self.base, 'cache'), 1024 * 1024),
+                             os.path.join(self.base, 'work'))
+        with mock.patch('linga.comics.get_rar_cache', return_value=rar_cache), \
+                mock.patch('linga.rarcache.extract_pages', side_effect=fake_extract):
+            self.assertFalse(self.reader.measure(path, Comic(path).file_key()))
+            rar_cache.executor.shutdown(wait=True)
+            self.assertEqual(self.sizes(path), [(None, None), (None, None)])
+            self.assertTrue(self.reader.measure(path, Comic(path).file_key()))
+        self.assertEqual(self.sizes(path), [(30, 40), (80, 40)])
+
+
+if __name__ == '__main__':
+    unittest.main()
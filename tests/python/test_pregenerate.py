@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db
+from linga.comics import Comic
+from linga.diskcache import DiskCache
+from linga.pregenerate import pregenerate, pregenerate_book, load_state
+from helpers import make_book, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestPregenerate(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        self.books = os.path.join(self.base, 'books')
+        os.makedirs(os.path.join(self.books, 'sub'))
+        make_book(os.path.join(self.books, 'a.cbz'), 3)
+        make_book(os.path.join(self.books, 'sub', 'b.cbz'), 2)
+        self.state = os.path.join(self.base, 'state')
+        self.cache = DiskCache(os.path.join(self.base, 'cache'), 1024 * 1024, '.jpg')
+        patcher = mock.patch('linga.thumbnails.get_thumbnail_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('linga.pregenerate.get_thumbnail_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def test_should_generate_thumbnails_and_cover(self):
+        path, pages, generated, generated_bytes, error = pregenerate_book(
+            os.path.join(self.books, 'a.cbz'))
+        self.assertIsNone(error)
+        self.assertEqual((pages, generated), (3, 4))
+        self.assertEqual(generated_bytes, self.cache.size())
+        manifest = Comic(path).get_manifest()
+        self.assertEqual([(page['width'], page['height']) for page in manifest], [(300, 400)] * 3)
+
+    def test_should_report_broken_books(self):
+        broken = os.path.join(self.books, 'broken.cbz')
+        with open(broken, 'wb') as fh:
+            fh.write(b'not a zip')
+        self.assertIsNotNone(pregenerate_book(broken)[4])
+
+    @mock.patch('linga.tools.multiprocessing.Pool')
+    def test_should_resume_and_honour_limit(self, pool):
+        pool.return_value.imap_unordered.side_effect = lambda func, jobs: map(func, jobs)
+        out = io.StringIO()
+
+        progress = pregenerate(self.books, limit=1, state_path=self.state, out=out)
+        self.assertEqual((progress.books, progress.pages), (1, 3))
+        self.assertEqual(len(load_state(self.state)), 1)
+
+        progress = pregenerate(self.books, state_path=self.state, out=out)
+        self.assertEqual((progress.books, progress.pages), (1, 2))
+        self.assertEqual(len(load_state(self.state)), 2)
+        self.assertIn('1/1 books, 2 pages', out.getvalue())
+
+        progress = pregenerate(self.books, state_path=self.state, out=out)
+        self.assertEqual(progress.books, 0)
+
+    @mock.patch('linga.tools.multiprocessing.Pool')
+    def test_should_stop_before_cache_evicts_new_thumbnails(self, pool):
+        pool.return_value.imap_unordered.side_effect = lambda func, jobs: map(func, jobs)
+        pregenerate_book(os.path.join(self.books, 'a.cbz'))
+        book_bytes = self.cache.size()
+        shutil.rmtree(self.cache.path)
+        out = io.StringIO()
+        with mock.patch.dict(app.config, {'THUMBNAIL_CACHE_SIZE': book_bytes}):
+            progress = pregenerate(self.books, state_path=self.state, out=out)
+        self.assertTrue(progress.stopped)
+        self.assertTrue(pool.return_value.terminate.called)
+        self.assertEqual(progress.books, 1)
+        self.assertEqual(len(load_state(self.state)), 1)
+        self.assertIn('Stopping', out.getvalue())
+
+    @mock.patch('linga.tools.multiprocessing.Pool')
+    def test_should_warn_when_library_outgrows_cache(self, pool):
+        pool.return_value.imap_unordered.side_effect = lambda func, jobs: map(func, jobs)
+        pregenerate_book(os.path.join(self.books, 'a.cbz'))
+        book_bytes = self.cache.size()
+        shutil.rmtree(self.cache.path)
+        out = io.StringIO()
+        with mock.patch.dict(app.config, {'THUMBNAIL_CACHE_SIZE': int(book_bytes * 1.5)}):
+            progress = pregenerate(self.books, state_path=self.state, out=out)
+        self.assertIn('Warning: about', out.getvalue())
+        self.assertEqual(progress.books, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db, User, ComicMetadata
+from linga.comics import (Comic, get_metadata)
+from linga.progress import ProgressQueue
+from helpers import TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class ProgressTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.config = mock.patch.dict(app.config, {'PROGRESS_FLUSH_INTERVAL': 60})
+        self.config.start()
+        self.queue = ProgressQueue()
+        patcher = mock.patch('linga.progress._progress_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.config.stop()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestProgressQueue(ProgressTestCase):
+    def test_should_keep_latest_state_per_book(self):
+        self.queue.update(1, 'a.cbz', last_page=2, fit_mode='width')
+        self.queue.update(1, 'a.cbz', last_page=3)
+        self.queue.update(2, 'a.cbz', last_page=5)
+        self.assertEqual(self.queue.get(1, 'a.cbz'), {'last_page': 3, 'fit_mode': 'width'})
+        self.assertEqual(len(self.queue.pending), 2)
+
+    def test_should_not_write_until_flushed(self):
+        self.queue.update(1, 'a.cbz', last_page=3)
+        self.assertIsNone(get_metadata(1, 'a.cbz'))
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(get_metadata(1, 'a.cbz').last_page, 3)
+        self.assertFalse(self.queue.has_pending())
+
+    def test_should_update_existing_rows(self):
+        meta = ComicMetadata(1, 'a.cbz')
+        meta.finished_book = True
+        db.session.add(meta)
+        db.session.commit()
+        self.queue.update(1, 'a.cbz', last_page=7)
+        self.queue.flush()
+        meta = get_metadata(1, 'a.cbz')
+        self.assertEqual(meta.last_page, 7)
+        self.assertTrue(meta.finished_book)
+
+    def test_should_apply_pending_state_to_reads(self):
+        self.queue.update(1, 'a.cbz', last_page=4, dual_page=True)
+        meta = self.queue.apply(ComicMetadata(1, 'a.cbz'))
+        self.assertEqual((meta.last_page, meta.dual_page), (4, True))
+
+    def test_should_report_pending_updates_by_user(self):
+        self.queue.update(1, 'a.cbz', last_page=4)
+        self.assertTrue(self.queue.has_pending(1))
+        self.assertFalse(self.queue.has_pending(2))
+
+    def test_should_requeue_under_newer_updates_when_write_fails(self):
+        self.queue.update(1, 'a.cbz', last_page=4, fit_mode='width')
+        with mock.patch.object(db.session, 'commit', side_effect=RuntimeError('locked')):
+            self.assertRaises(RuntimeError, self.queue.flush)
+        self.assertEqual(self.queue.get(1, 'a.cbz'), {'last_page': 4, 'fit_mode': 'width'})
+        self.queue.flush()
+        self.assertEqual(get_metadata(1, 'a.cbz').fit_mode, 'width')
+
+    def test_should_write_at_once_without_interval(self):
+        with mock.patch.dict(app.config, {'PROGRESS_FLUSH_INTERVAL': 0}):
+            self.queue.update(1, 'a.cbz', last_page=3)
+        self.assertEqual(get_metadata(1, 'a.cbz').last_page, 3)
+
+
+class TestProgressViews(ProgressTestCase):
+    def setUp(self):
+        super(TestProgressViews, self).setUp()
+        self.base = tempfile.mkdtemp()
+        with zipfile.ZipFile(os.path.join(self.base, 'test.cbz'), 'w') as zf:
+            zf.writestr('001.jpg', b'page')
+        self.views_config = mock.patch.dict(app.config, {
+            'TESTING': True,
+            'BOOK_PATH': self.base,
+        })
+        self.views_config.start()
+        self.addCleanup(self.views_config.stop)
+        user = User('foo@bar.com', 'Password1')
+        user.user_id = 1
+        patcher = mock.patch('flask_login.utils._get_user', return_value=user)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        super(TestProgressViews, self).tearDown()
+        shutil.rmtree(self.base)
+
+    def test_should_queue_page_updates(self):
+        res = self.client.post('/book/update/page', data={
+            'relpath': 'test.cbz', 'page': '3', 'finished': 'true', 'fitmode': 'height',
+            'rtl': 'true', 'dual': 'false'})
+        self.assertTrue(res.get_json()['success'])
+        self.assertIsNone(get_metadata(1, 'test.cbz'))
+        fields = self.queue.get(1, 'test.cbz')
+        self.assertEqual(fields['last_page'], 3)
+        self.assertTrue(fields['finished_book'])
+        self.assertTrue(fields['right_to_left'])
+
+    def test_should_reject_invalid_pages(self):
+        for page in ['three', '0', '-2']:
+            res = self.client.post('/book/update/page', data={'relpath': 'test.cbz', 'page': page})
+            self.assertEqual(res.status_code, 400)
+        self.assertFalse(self.queue.has_pending())
+
+    def test_should_show_book_at_queued_page(self):
+        self.client.post('/book/update/page', data={'relpath': 'test.cbz', 'page': '3'})
+        res = self.client.get('/books/read/test.cbz/')
+        self.assertEqual(res.status_code, 200)
+        html = res.get_data(as_text=True)
+        self.assertIn('lastPage: 3,', html)
+        self.assertIn('/books/read/test.cbz/page/4', html)
+
+    def test_should_show_scaled_pages_for_reader_screen(self):
+        self.client.post('/book/update/page', data={'relpath': 'test.cbz', 'page': '1',
+                                                    'fitmode': 'width'})
+        self.client.set_cookie('localhost', 'linga_screen', '1280,768,webp')
+        html = self.client.get('/books/read/test.cbz/').get_data(as_text=True)
+        version = Comic(os.path.join(self.base, 'test.cbz')).version()
+        self.assertIn('/books/page/test.cbz/1?v=%s&amp;w=1280&amp;fmt=webp' % version, html)
+        self.assertIn('variantStep: %d,' % app.config['PAGE_VARIANT_STEP'], html)
+
+    def test_should_queue_page_from_book_url(self):
+        res = self.client.get('/books/read/test.cbz/page/4')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.queue.get(1, 'test.cbz'), {'last_page': 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
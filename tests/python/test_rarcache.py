@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db
+from linga.comics import Comic
+from linga.diskcache import DiskCache
+from linga.rarcache import RarCache
+from helpers import fake_extract, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestRarCache(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        self.path = os.path.join(self.base, 'book.cbr')
+        with zipfile.ZipFile(self.path, 'w') as zf:
+            zf.writestr('01.jpg', b'page one')
+            zf.writestr('sub/02.jpg', b'page two')
+        self.rar_cache = RarCache(DiskCache(os.path.join(self.base, 'cache'), 1024 * 1024),
+                                  os.path.join(self.base, 'work'))
+        patcher = mock.patch('linga.rarcache.extract_pages', side_effect=fake_extract)
+        self.extract = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('linga.comics.get_rar_cache', return_value=self.rar_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.rar_cache.executor.shutdown(wait=True)
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def wait(self):
+        self.rar_cache.executor.shutdown(wait=True)
+
+    def test_should_store_every_page(self):
+        key = ('book', 1, 2)
+        stored = self.rar_cache.extract(self.path, key, ['01.jpg', 'sub/02.jpg'])
+        self.assertEqual(stored, 2)
+        with open(self.rar_cache.get(self.path, key, 'sub/02.jpg', []), 'rb') as fh:
+            self.assertEqual(fh.read(), b'page two')
+        self.assertEqual(os.listdir(os.path.join(self.base, 'work')), [])
+
+    def test_should_unpack_book_once_on_miss(self):
+        key = ('book', 1, 2)
+        names = ['01.jpg', 'sub/02.jpg']
+        self.assertIsNone(self.rar_cache.get(self.path, key, '01.jpg', names))
+        self.assertIsNone(self.rar_cache.get(self.path, key, 'sub/02.jpg', names))
+        self.wait()
+        self.assertEqual(self.extract.call_count, 1)
+        self.assertIsNotNone(self.rar_cache.get(self.path, key, '01.jpg', names))
+
+    def test_should_not_retry_files_that_are_not_rar(self):
+        self.extract.side_effect = lambda path, names, dest: False
+        key = ('book', 1, 2)
+        self.assertEqual(self.rar_cache.extract(self.path, key, ['01.jpg']), 0)
+        self.assertFalse(self.rar_cache.schedule(self.path, key, ['01.jpg']))
+
+    def test_should_skip_names_outside_work_directory(self):
+        self.extract.side_effect = lambda path, names, dest: True
+        evil = os.path.join(self.base, 'evil.jpg')
+        with open(evil, 'wb') as fh:
+            fh.write(b'x')
+        self.assertEqual(self.rar_cache.extract(self.path, ('book', 1, 2), ['../../evil.jpg']), 0)
+        self.assertTrue(os.path.exists(evil))
+
+    def test_should_log_and_allow_retry_after_error(self):
+        self.extract.side_effect = IOError('unrar failed')
+        key = ('book', 1, 2)
+        self.assertEqual(self.rar_cache.extract(self.path, key, ['01.jpg']), 0)
+        self.assertNotIn(key, self.rar_cache.extracting)
+        self.assertNotIn(key, self.rar_cache.unsupported)
+
+    def test_should_read_comic_pages_from_cache_once_unpacked(self):
+        book = Comic(self.path)
+        self.assertEqual(book.get_file(1), b'page two')
+        self.wait()
+        book = Comic(self.path)
+        book.get_manifest()
+        with mock.patch.object(Comic, 'get_archive', side_effect=AssertionError):
+            self.assertEqual(book.get_file(0), b'page one')
+            stream, size = book.open_file(1)
+            with stream:
+                self.assertEqual(stream.read(), b'page two')
+            self.assertEqual(size, 8)
+
+    def test_should_read_from_archive_when_disabled(self):
+        with mock.patch.dict(app.config, {'RAR_CACHE_SIZE': 0}):
+            self.assertEqual(Comic(self.path).get_file(0), b'page one')
+        self.wait()
+        self.extract.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import json
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+from datetime import datetime
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db, User
+from linga.comics import (Comic, ComicMetadata, get_metadata)
+from linga.repack import (repack, repack_book, needs_repack, move_metadata, main,
+                          MANIFEST_MEMBER)
+from helpers import TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+def make_book(path, compression=zipfile.ZIP_DEFLATED):
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        zf.writestr('b/02.jpg', b'page two' * 100)
+        zf.writestr('ComicInfo.xml', b'<ComicInfo/>')
+        zf.writestr('a/01.jpg', b'page one' * 100)
+        zf.writestr('a/', b'')
+
+
+class TestRepack(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        patcher = mock.patch.dict(app.config, {'BOOK_PATH': self.base})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User('foo@bar.com', 'Password1')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def path(self, name):
+        return os.path.join(self.base, name)
+
+    def add_progress(self, relpath, page, last_access):
+        meta = ComicMetadata(self.user.user_id, relpath)
+        meta.last_page = page
+        meta.last_access = last_access
+        db.session.add(meta)
+        db.session.commit()
+
+    def test_should_only_repack_rar_and_compressed_books(self):
+        make_book(self.path('deflated.cbz'))
+        make_book(self.path('stored.cbz'), zipfile.ZIP_STORED)
+        self.assertTrue(needs_repack(self.path('deflated.cbz')))
+        self.assertFalse(needs_repack(self.path('stored.cbz')))
+        self.assertTrue(needs_repack(self.path('book.cbr')))
+
+    def test_should_store_pages_in_reading_order(self):
+        make_book(self.path('book.cbz'))
+        path, new_path, pages, old_size, new_size, error = repack_book(self.path('book.cbz'))
+        self.assertIsNone(error)
+        self.assertEqual((new_path, pages), (self.path('book.cbz'), 2))
+        with zipfile.ZipFile(new_path) as zf:
+            self.assertEqual(zf.namelist(), ['a/01.jpg', 'b/02.jpg', 'ComicInfo.xml',
+                                             MANIFEST_MEMBER])
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED
+                                for info in zf.infolist()))
+            embedded = json.loads(zf.read(MANIFEST_MEMBER).decode('utf-8'))
+            self.assertEqual([page['name'] for page in embedded['pages']],
+                             ['a/01.jpg', 'b/02.jpg'])
+            self.assertEqual(embedded['pages'][1]['offset'], zf.getinfo('b/02.jpg').header_offset)
+        self.assertEqual(Comic(new_path).get_file(1), b'page two' * 100)
+        self.assertEqual([name for name in os.listdir(self.base)], ['book.cbz'])
+
+    def test_should_replace_rar_book_with_cbz(self):
+        # Not really a RAR file, but it's read the same way through open_archive().
+        make_book(self.path('book.cbr'))
+        path, new_path, pages, old_size, new_size, error = repack_book(self.path('book.cbr'))
+        self.assertIsNone(error)
+        self.assertEqual(new_path, self.path('book.cbz'))
+        self.assertFalse(os.path.exists(self.path('book.cbr')))
+        self.assertEqual(Comic(new_path).get_file_list(), ['a/01.jpg', 'b/02.jpg'])
+
+    def test_should_keep_original_on_crc_mismatch(self):
+        make_book(self.path('book.cbz'))
+        with open(self.path('book.cbz'), 'rb') as fh:
+            original = fh.read()
+        build = Comic.build_manifest
+        def bad_crc(book):
+            pages = build(book)
+            pages[1]['crc'] ^= 1
+            return pages
+        with mock.patch.object(Comic, 'build_manifest', bad_crc):
+            error = repack_book(self.path('book.cbz'))[5]
+        self.assertIn('CRC mismatch in b/02.jpg', error)
+        with open(self.path('book.cbz'), 'rb') as fh:
+            self.assertEqual(fh.read(), original)
+        self.assertEqual(os.listdir(self.base), ['book.cbz'])
+
+    def test_should_not_overwrite_existing_cbz(self):
+        make_book(self.path('book.cbr'))
+        make_book(self.path('book.cbz'))
+        self.assertIn('already exists', repack_book(self.path('book.cbr'))[5])
+        self.assertTrue(os.path.exists(self.path('book.cbr')))
+
+    def test_should_move_reading_progress(self):
+        self.add_progress(os.path.join('sub', 'book.cbr'), 7, datetime(2020, 1, 1))
+        move_metadata(self.path(os.path.join('sub', 'book.cbr')),
+                      self.path(os.path.join('sub', 'book.cbz')))
+        self.assertIsNone(get_metadata(self.user.user_id, os.path.join('sub', 'book.cbr')))
+        self.assertEqual(get_metadata(self.user.user_id,
+                                      os.path.join('sub', 'book.cbz')).last_page, 7)
+
+    def test_should_keep_most_recent_progress_on_conflict(self):
+        self.add_progress('book.cbr', 7, datetime(2020, 1, 2))
+        self.add_progress('book.cbz', 3, datetime(2020, 1, 1))
+        move_metadata(self.path('book.cbr'), self.path('book.cbz'))
+        self.assertIsNone(get_metadata(self.user.user_id, 'book.cbr'))
+        self.assertEqual(get_metadata(self.user.user_id, 'book.cbz').last_page, 7)
+
+    @mock.patch('linga.tools.multiprocessing.Pool')
+    def test_should_repack_library(self, pool):
+        pool.return_value.imap_unordered.side_effect = lambda func, jobs: map(func, jobs)
+        make_book(self.path('a.cbr'))
+        make_book(self.path('b.cbz'), zipfile.ZIP_STORED)
+        self.add_progress('a.cbr', 2, datetime(2020, 1, 1))
+        out = io.StringIO()
+
+        progress = repack(self.base, dry_run=True, out=out)
+        self.assertEqual(progress.books, 0)
+        self.assertIn(self.path('a.cbr'), out.getvalue())
+        self.assertTrue(os.path.exists(self.path('a.cbr')))
+
+        progress = repack(self.base, out=out)
+        self.assertEqual((progress.books, progress.pages, progress.errors), (1, 2, 0))
+        self.assertEqual(sorted(os.listdir(self.base)), ['a.cbz', 'b.cbz'])
+        self.assertEqual(get_metadata(self.user.user_id, 'a.cbz').last_page, 2)
+
+        progress = repack(self.base, out=out)
+        self.assertEqual(progress.total, 0)
+
+    @mock.patch('linga.tools.multiprocessing.Pool')
+    def test_should_move_progress_when_repacking_relative_path(self, pool):
+        pool.return_value.imap_unordered.side_effect = lambda func, jobs: map(func, jobs)
+        os.makedirs(self.path('sub'))
+        make_book(self.path(os.path.join('sub', 'a.cbr')))
+        self.add_progress(os.path.join('sub', 'a.cbr'), 2, datetime(2020, 1, 1))
+        with mock.patch('sys.stdout', io.StringIO()):
+            self.assertEqual(main(['--path', os.path.relpath(self.path('sub'))]), 0)
+        self.assertEqual(get_metadata(self.user.user_id,
+                                      os.path.join('sub', 'a.cbz')).last_page, 2)
+
+    @mock.patch('linga.tools.multiprocessing.Pool')
+    def test_should_warn_for_books_outside_book_path(self, pool):
+        pool.return_value.imap_unordered.side_effect = lambda func, jobs: map(func, jobs)
+        make_book(self.path('a.cbr'))
+        self.add_progress('a.cbr', 2, datetime(2020, 1, 1))
+        other = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other)
+        with mock.patch.dict(app.config, {'BOOK_PATH': other}), \
+                mock.patch('linga.repack.app.logger.warning') as warning, \
+                mock.patch('sys.stdout', io.StringIO()):
+            self.assertEqual(main(['--path', self.base]), 0)
+        self.assertTrue(warning.called)
+        self.assertEqual(get_metadata(self.user.user_id, 'a.cbz').last_page, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
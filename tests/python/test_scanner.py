@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga.comics import ComicLister
+from linga.scanner import (scan_dir, scan_book_list, stat_dir, ScanStats, main)
+from helpers import touch
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        for path in ['foo.cbz', 'notes.txt', 'bar/baz.cbr', 'bar/fizz/buzz.CBZ',
+                     'bar/fizz/deep/a.zip', 'qux/b.rar', 'qux/c.cbz', 'qux/cover.jpg']:
+            touch(os.path.join(self.base, *path.split('/')))
+        # A directory with a book extension is walked, not listed as a book.
+        touch(os.path.join(self.base, 'odd.cbz', 'inner.cbz'))
+        os.makedirs(os.path.join(self.base, 'empty'))
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_should_list_books_and_subdirs(self):
+        books, dirs, count = scan_dir(os.path.join(self.base, 'qux'))
+        self.assertEqual(sorted(books), [os.path.join(self.base, 'qux', 'b.rar'),
+                                         os.path.join(self.base, 'qux', 'c.cbz')])
+        self.assertEqual(dirs, [])
+        self.assertEqual(count, 3)
+
+    def test_should_stat_books_and_list_subdirs(self):
+        mtime, listing = stat_dir(self.base)
+        books, dirs = listing
+        self.assertEqual(mtime, os.stat(self.base).st_mtime)
+        self.assertEqual(sorted(books), ['foo.cbz'])
+        self.assertEqual(books['foo.cbz'].st_size, 1)
+        self.assertEqual(sorted(dirs), ['bar', 'empty', 'odd.cbz', 'qux'])
+
+    def test_should_not_list_unchanged_dir(self):
+        mtime = os.stat(self.base).st_mtime
+        self.assertEqual(stat_dir(self.base, mtime), (mtime, None))
+
+    def test_should_match_sequential_book_list(self):
+        expected = ComicLister(self.base).get_book_list()
+        self.assertEqual(len(expected), 7)
+        for workers in (1, 4):
+            self.assertEqual(scan_book_list(self.base, workers), expected)
+
+    def test_should_follow_symlinks_like_sequential_scan(self):
+        if not hasattr(os, 'symlink'):
+            self.skipTest('No symlink support')
+        os.symlink(os.path.join(self.base, 'qux'), os.path.join(self.base, 'link'))
+        os.symlink(os.path.join(self.base, 'foo.cbz'), os.path.join(self.base, 'alias.cbz'))
+        os.symlink(os.path.join(self.base, 'missing.cbz'), os.path.join(self.base, 'broken.cbz'))
+        self.assertEqual(scan_book_list(self.base, 4), ComicLister(self.base).get_book_list())
+
+    def test_should_count_directories_and_entries(self):
+        stats = ScanStats()
+        scan_book_list(self.base, 2, stats)
+        self.assertEqual(stats.books, 7)
+        self.assertEqual(stats.dirs, 7)
+        self.assertEqual(stats.entries, 15)
+        self.assertIn('7 books in 7 directories', stats.report())
+
+    def test_should_raise_for_missing_library(self):
+        self.assertRaises(OSError, scan_book_list, os.path.join(self.base, 'nope'), 2)
+
+    def test_should_verify_against_sequential_scan(self):
+        out = io.StringIO()
+        self.assertEqual(main(['--path', self.base, '--verify'], out), 0)
+        self.assertIn('Results match', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
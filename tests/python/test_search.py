@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db, User
+from linga.catalog import LibraryCatalog
+from linga.search import (search_books, match_expression)
+from helpers import touch, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        for path in ['Spider-Man_01.cbz', 'batman/robin.cbz', 'robin/batman_01.cbz',
+                     'robin/batman_02.cbz', 'bar/fizz/buzz.cbz']:
+            self.add_book(path)
+        self.catalog = LibraryCatalog(self.base)
+        self.catalog.rescan()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def add_book(self, relpath):
+        touch(os.path.join(self.base, *relpath.split('/')))
+
+    def search(self, query, offset=0, limit=50):
+        total, relpaths = search_books(query, offset, limit)
+        return total, [relpath.replace(os.sep, '/') for relpath in relpaths]
+
+    def test_should_quote_query_tokens_as_prefixes(self):
+        self.assertEqual(match_expression(['spider', 'OR']), '"spider"* "OR"*')
+
+    def test_should_match_word_prefixes(self):
+        self.assertEqual(self.search('buz'), (1, ['bar/fizz/buzz.cbz']))
+        self.assertEqual(self.search('spid man'), (1, ['Spider-Man_01.cbz']))
+
+    def test_should_match_directory_names(self):
+        self.assertEqual(self.search('fizz')[1], ['bar/fizz/buzz.cbz'])
+
+    def test_should_rank_title_matches_first(self):
+        total, relpaths = self.search('robin')
+        self.assertEqual(total, 3)
+        self.assertEqual(relpaths[0], 'batman/robin.cbz')
+
+    def test_should_page_results(self):
+        self.assertEqual(self.search('batman', 1, 2),
+                         (3, ['robin/batman_02.cbz', 'batman/robin.cbz']))
+
+    def test_should_ignore_empty_query(self):
+        self.assertEqual(self.search(' -- '), (0, []))
+
+    def test_should_follow_catalog_changes(self):
+        os.remove(os.path.join(self.base, 'Spider-Man_01.cbz'))
+        self.add_book('Spider-Man_02.cbz')
+        shutil.rmtree(os.path.join(self.base, 'bar'))
+        self.catalog.update_dirs([''])
+        self.assertEqual(self.search('spider')[1], ['Spider-Man_02.cbz'])
+        self.assertEqual(self.search('buzz'), (0, []))
+
+    def test_should_keep_index_in_step_after_vacuum(self):
+        os.remove(os.path.join(self.base, 'Spider-Man_01.cbz'))
+        self.catalog.update_dirs([''])
+        db.session.commit()
+        connection = db.engine.connect()
+        try:
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+        os.remove(os.path.join(self.base, 'bar', 'fizz', 'buzz.cbz'))
+        self.catalog.update_dirs([os.path.join('bar', 'fizz')])
+        self.assertEqual(self.search('buzz'), (0, []))
+        self.assertEqual(self.search('robin')[0], 3)
+
+    def test_should_fall_back_to_substring_search(self):
+        with mock.patch('linga.search.has_search_index', return_value=False):
+            self.assertEqual(self.search('atman_0'), (2, ['robin/batman_01.cbz',
+                                                          'robin/batman_02.cbz']))
+
+    def test_should_return_results_as_json(self):
+        user = User('foo@bar.com', 'Password1')
+        user.user_id = 1
+        with mock.patch.dict(app.config, {'TESTING': True, 'BOOK_PATH': self.base}), \
+                mock.patch('flask_login.utils._get_user', return_value=user):
+            res = app.test_client().get('/books/search?q=batman&limit=2')
+        data = res.get_json()
+        self.assertEqual(data['book_count'], 3)
+        self.assertEqual(data['items'][0]['name'], 'batman 01')
+        self.assertEqual(data['items'][0]['url'], '/books/read/robin--batman_01.cbz/')
+        self.assertEqual(data['next'], '/books/search?q=batman&offset=2&limit=2')
+
+
+if __name__ == '__main__':
+    unittest.main()
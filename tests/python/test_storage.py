@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+from sqlalchemy.pool import NullPool, QueuePool
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db
+from linga.migrations import upgrade_database, main, MIGRATIONS
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+# Tables as created by the first version, without the query indexes
+OLD_SCHEMA = [
+    'CREATE TABLE linga_users (user_id INTEGER NOT NULL, email VARCHAR(128) NOT NULL, '
+    'password VARCHAR(128) NOT NULL, created DATETIME NOT NULL, last_login DATETIME, '
+    'PRIMARY KEY (user_id), UNIQUE (email))',
+    'CREATE TABLE linga_book_metadata (user_id INTEGER NOT NULL, '
+    'book_relpath VARCHAR(256) NOT NULL, last_page INTEGER NOT NULL, '
+    'last_access DATETIME NOT NULL, finished_book BOOLEAN NOT NULL, '
+    'fit_mode VARCHAR(10) NOT NULL, right_to_left BOOLEAN NOT NULL, '
+    'dual_page BOOLEAN NOT NULL, PRIMARY KEY (user_id, book_relpath))',
+    "INSERT INTO linga_book_metadata VALUES (1, 'a.cbz', 3, '2020-01-01 00:00:00', 0, "
+    "'full', 0, 0)",
+]
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.base, 'linga.db')
+        self.config = mock.patch.dict(app.config, {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+        })
+        self.config.start()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.config.stop()
+        shutil.rmtree(self.base)
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def index_names(self, table):
+        return set(row[1] for row in self.query('PRAGMA index_list(%s)' % table))
+
+    def test_should_upgrade_old_database_in_place(self):
+        conn = sqlite3.connect(self.db_path)
+        for sql in OLD_SCHEMA:
+            conn.execute(sql)
+        conn.commit()
+        conn.close()
+        with app.app_context():
+            upgrade_database(db)
+        self.assertIn('ix_linga_book_metadata_user_access',
+                      self.index_names('linga_book_metadata'))
+        books = self.index_names('linga_catalog_books')
+        self.assertIn('ix_linga_catalog_books_parent_relpath', books)
+        self.assertIn('ix_linga_catalog_books_relpath', books)
+        self.assertEqual(self.query('SELECT last_page FROM linga_book_metadata'), [(3,)])
+        columns = [row[1] for row in self.query('PRAGMA table_info(linga_catalog_books)')]
+        self.assertIn('book_id', columns)
+        if self.query("SELECT sqlite_compileoption_used('ENABLE_FTS5')") == [(1,)]:
+            self.assertEqual(self.query('SELECT count(*) FROM linga_catalog_search'), [(0,)])
+        self.assertEqual(self.query('PRAGMA user_version'), [(len(MIGRATIONS),)])
+
+    def test_should_not_open_database_on_import(self):
+        config = os.path.join(self.base, 'config.py')
+        with open(config, 'w') as fh:
+            fh.write('SQLALCHEMY_DATABASE_URI = %r\n' % ('sqlite:///' + self.db_path))
+        env = dict(os.environ, LINGA_CONFIG_FILE=config)
+        subprocess.check_call([sys.executable, '-c', 'import linga'], env=env,
+                              cwd=dirname(dirname(dirname(abspath(__file__)))))
+        self.assertFalse(os.path.exists(self.db_path))
+
+    def test_should_upgrade_from_command_line(self):
+        with app.app_context():
+            self.assertEqual(main([]), 0)
+        self.assertIn('linga_catalog_books', set(
+            row[0] for row in self.query("SELECT name FROM sqlite_master WHERE type='table'")))
+        self.assertEqual(self.query('PRAGMA user_version'), [(len(MIGRATIONS),)])
+
+    def test_should_only_run_new_migrations(self):
+        step = mock.MagicMock()
+        with app.app_context():
+            upgrade_database(db)
+            with mock.patch('linga.migrations.MIGRATIONS', MIGRATIONS + [step]):
+                upgrade_database(db)
+                upgrade_database(db)
+        self.assertEqual(step.call_count, 1)
+
+    def test_should_use_wal_and_pooled_connections(self):
+        with app.app_context():
+            upgrade_database(db)
+            self.assertIsInstance(db.engine.pool, QueuePool)
+            conn = db.engine.connect()
+            self.assertEqual(conn.execute('PRAGMA journal_mode').scalar(), 'wal')
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').scalar(),
+                             app.config['SQLITE_BUSY_TIMEOUT'])
+            conn.close()
+
+    def test_should_leave_sqlite_alone_when_tuning_is_off(self):
+        with mock.patch.dict(app.config, {'SQLITE_TUNING': False}), app.app_context():
+            self.assertIsInstance(db.engine.pool, NullPool)
+            conn = db.engine.connect()
+            self.assertEqual(conn.execute('PRAGMA journal_mode').scalar(), 'delete')
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
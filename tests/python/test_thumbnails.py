@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+from PIL import Image
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga.diskcache import DiskCache, make_key
+from linga import app, db
+from linga.thumbnails import (make_thumbnail, get_thumbnail, get_sprite, sprite_start,
+                              sprite_position, sprite_page_count, image_dimensions)
+from helpers import make_image, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.cache = DiskCache(self.base, 130, '.jpg')
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_should_miss_for_unknown_key(self):
+        self.assertIsNone(self.cache.get(make_key('foo')))
+
+    def test_should_return_stored_file(self):
+        key = make_key('foo', 1)
+        path = self.cache.put(key, b'1234')
+        self.assertEqual(self.cache.get(key), path)
+        self.assertTrue(path.endswith('.jpg'))
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'1234')
+
+    def test_should_move_existing_file_into_cache(self):
+        src = os.path.join(self.base, 'page.jpg')
+        with open(src, 'wb') as fh:
+            fh.write(b'1234')
+        key = make_key('moved')
+        path = self.cache.put_file(key, src)
+        self.assertEqual(self.cache.get(key), path)
+        self.assertFalse(os.path.exists(src))
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'1234')
+
+    def test_should_only_build_on_miss(self):
+        build = mock.MagicMock(return_value=b'1234')
+        self.cache.get_or_create(make_key('foo'), build)
+        self.cache.get_or_create(make_key('foo'), build)
+        self.assertEqual(build.call_count, 1)
+
+    def test_should_evict_least_recently_used(self):
+        keys = [make_key(i) for i in range(3)]
+        for i, key in enumerate(keys):
+            path = self.cache.put(key, b'x' * 40)
+            os.utime(path, (i, i))
+        os.utime(self.cache.path_for(keys[0]), (10, 10))
+        self.cache.put(make_key('new'), b'x' * 40)
+
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNone(self.cache.get(keys[2]))
+        self.assertLessEqual(self.cache.total, 130)
+
+
+class TestMakeThumbnail(unittest.TestCase):
+    def test_should_fit_jpeg_in_bounding_box(self):
+        img = Image.open(io.BytesIO(make_thumbnail(make_image('JPEG'), (64, 64))))
+        self.assertEqual(img.format, 'JPEG')
+        self.assertEqual(img.size, (43, 64))
+
+    def test_should_use_draft_mode_for_jpeg(self):
+        with mock.patch('PIL.JpegImagePlugin.JpegImageFile.draft', autospec=True) as draft:
+            draft.return_value = None
+            make_thumbnail(make_image('JPEG'), (64, 64))
+            self.assertEqual(draft.call_args_list[0][0][1:], ('RGB', (64, 64)))
+
+    def test_should_convert_transparent_png(self):
+        data = make_thumbnail(make_image('PNG', mode='RGBA'), (64, 64))
+        self.assertEqual(Image.open(io.BytesIO(data)).mode, 'RGB')
+
+
+class TestImageDimensions(unittest.TestCase):
+    def test_should_read_size_from_header(self):
+        data = make_image('JPEG', (1600, 2400))
+        self.assertEqual(image_dimensions(io.BytesIO(data[:1024])), (1600, 2400))
+        self.assertEqual(image_dimensions(io.BytesIO(make_image('PNG', (30, 20)))), (30, 20))
+
+    def test_should_return_none_for_unreadable_image(self):
+        self.assertEqual(image_dimensions(io.BytesIO(b'not an image')), (None, None))
+
+
+class TestGetThumbnail(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        db.session.remove()
+        self.base = tempfile.mkdtemp()
+        self.book = mock.MagicMock()
+        self.book.path = os.path.join(self.base, 'test.cbz')
+        with open(self.book.path, 'wb') as fh:
+            fh.write(b'x')
+        self.book.get_file.return_value = make_image('JPEG')
+        self.cache = DiskCache(os.path.join(self.base, 'cache'), 1024 * 1024, '.jpg')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def test_should_generate_page_thumbnail_once(self):
+        with mock.patch('linga.thumbnails.get_thumbnail_cache', return_value=self.cache):
+            first = get_thumbnail(self.book, 2, 64)
+            second = get_thumbnail(self.book, 2, 64)
+        self.assertEqual(first, second)
+        self.book.get_file.assert_called_once_with(2)
+
+    def test_should_regenerate_when_book_changes(self):
+        with mock.patch('linga.thumbnails.get_thumbnail_cache', return_value=self.cache):
+            first = get_thumbnail(self.book, 2, 64)
+            os.utime(self.book.path, (1, 1))
+            second = get_thumbnail(self.book, 2, 64)
+        self.assertNotEqual(first, second)
+
+
+class TestSprites(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        db.session.remove()
+        self.base = tempfile.mkdtemp()
+        self.book = mock.MagicMock()
+        self.book.path = os.path.join(self.base, 'test.cbz')
+        with open(self.book.path, 'wb') as fh:
+            fh.write(b'x')
+        self.book.get_file.return_value = make_image('JPEG')
+        self.book.get_file_list.return_value = ['%d.jpg' % i for i in range(25)]
+        self.cache = DiskCache(os.path.join(self.base, 'cache'), 1024 * 1024, '.jpg')
+        self.config = mock.patch.dict(app.config, {
+            'THUMBNAIL_SIZE': 64, 'SPRITE_PAGES': 20, 'SPRITE_COLUMNS': 4})
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def test_should_group_pages_into_sheets(self):
+        self.assertEqual(sprite_start(1), 1)
+        self.assertEqual(sprite_start(20), 1)
+        self.assertEqual(sprite_start(21), 21)
+
+    def test_should_lay_out_pages_in_rows(self):
+        self.assertEqual(sprite_position(21, 21), (0, 0))
+        self.assertEqual(sprite_position(24, 21), (192, 0))
+        self.assertEqual(sprite_position(26, 21), (64, 64))
+
+    def test_should_limit_sheet_to_pages_in_book(self):
+        self.assertEqual(sprite_page_count(self.book, 1), 20)
+        self.assertEqual(sprite_page_count(self.book, 21), 5)
+        self.assertRaises(IndexError, sprite_page_count, self.book, 26)
+
+    def test_should_build_sheet_of_thumbnails(self):
+        with mock.patch('linga.thumbnails.get_thumbnail_cache', return_value=self.cache):
+            path = get_sprite(self.book, 21)
+            self.assertEqual(get_sprite(self.book, 21), path)
+        self.assertEqual(Image.open(path).size, (256, 128))
+        self.assertEqual(self.book.get_file.call_count, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
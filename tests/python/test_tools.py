@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import sys
+import unittest
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga.pregenerate import PregenerateProgress
+from linga.repack import RepackProgress
+from linga.tools import Progress
+
+
+class TestProgress(unittest.TestCase):
+    def test_should_report_every_few_books_and_at_the_end(self):
+        out = io.StringIO()
+        progress = Progress(3, out, every=2)
+        progress.update(4, None)
+        self.assertEqual(out.getvalue(), '')
+        progress.update(5, 'broken')
+        progress.update(6, None)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('3/3 books, 15 pages, 1 errors ('))
+
+    def test_should_add_tool_details(self):
+        out = io.StringIO()
+        progress = PregenerateProgress(1, out)
+        progress.update(3, 4, 100, None)
+        self.assertIn('1/1 books, 3 pages, 4 images generated', out.getvalue())
+        self.assertEqual(progress.generated_bytes, 100)
+
+        out = io.StringIO()
+        progress = RepackProgress(2, out)
+        progress.update(3, 1048576, 2097152, None)
+        progress.update(5, 1048576, 0, 'broken')
+        self.assertIn('2/2 books, 3 pages, 1.0 MB -> 2.0 MB, 1 errors', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import io
+import sys
+import unittest
+from os.path import dirname, abspath
+
+from PIL import Image
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app
+from linga.variants import (variant_params, variant_tag, variant_mime, make_variant,
+                            screen_variant_args)
+from helpers import make_image
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestVariantParams(unittest.TestCase):
+    def setUp(self):
+        self.config = mock.patch.dict(app.config, {
+            'PAGE_VARIANT_STEP': 100,
+            'PAGE_VARIANT_MAX_SIZE': 1000,
+        })
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+
+    def test_should_use_original_without_parameters(self):
+        self.assertIsNone(variant_params())
+
+    def test_should_round_sizes_up_to_step(self):
+        self.assertEqual(variant_params(301, None, 'WebP'), (400, 0, 'webp'))
+        self.assertEqual(variant_params(None, 400), (0, 400, 'jpeg'))
+
+    def test_should_limit_sizes(self):
+        self.assertEqual(variant_params(5000, 5000), (1000, 1000, 'jpeg'))
+
+    def test_should_reject_bad_parameters(self):
+        self.assertRaises(ValueError, variant_params, None, None, 'gif')
+        self.assertRaises(ValueError, variant_params, -10)
+        self.assertRaises(ValueError, variant_params, 0)
+
+    def test_should_match_reader_page_urls_for_screen(self):
+        self.assertEqual(screen_variant_args('width', '800,600,webp'), {'w': 800, 'fmt': 'webp'})
+        self.assertEqual(screen_variant_args('height', '800,601,jpeg'), {'h': 700})
+        self.assertEqual(screen_variant_args('full', '800,600,webp'), {})
+        for value in [None, '', '1200,800', 'a,b,jpeg', '0,800,jpeg', '1200,800,gif']:
+            self.assertEqual(screen_variant_args('width', value), {}, value)
+
+    def test_should_describe_variant(self):
+        self.assertEqual(variant_tag((400, 0, 'webp')), 'w400-h0-webp')
+        self.assertEqual(variant_mime((400, 0, 'webp')), 'image/webp')
+
+
+class TestMakeVariant(unittest.TestCase):
+    def test_should_scale_to_width(self):
+        img = Image.open(io.BytesIO(make_variant(make_image('PNG'), (400, 0, 'webp'))))
+        self.assertEqual(img.format, 'WEBP')
+        self.assertEqual(img.size, (400, 600))
+
+    def test_should_scale_to_height(self):
+        img = Image.open(io.BytesIO(make_variant(make_image('JPEG'), (0, 300, 'jpeg'))))
+        self.assertEqual(img.format, 'JPEG')
+        self.assertEqual(img.size, (200, 300))
+
+    def test_should_not_enlarge(self):
+        img = Image.open(io.BytesIO(make_variant(make_image('PNG'), (2000, 0, 'jpeg'))))
+        self.assertEqual(img.size, (800, 1200))
+
+    def test_should_convert_transparent_images(self):
+        data = make_image('PNG', mode='RGBA')
+        img = Image.open(io.BytesIO(make_variant(data, (400, 0, 'jpeg'))))
+        self.assertEqual(img.mode, 'RGB')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ from os.path import dirname, abspath
 
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
+import shutil
 import unittest
 import tempfile
 import linga
@@ -12,6 +13,7 @@ import flask_login
 
 from linga.comics import ComicMetadata
 from linga import User
+from helpers import TEST_DATABASE_URI
 
 try:
     import unittest.mock as mock
@@ -23,39 +25,48 @@ class LingaTestCase(unittest.TestCase):
 
     def setUp(self):
         linga.app.config['TESTING'] = True
+        linga.app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        linga.db.init_app(linga.app)
+        linga.db.create_all()
+        linga.db.session.remove()
         linga.app.login_manager.init_app(linga.app)
+        self.base = tempfile.mkdtemp()
+        self.config = mock.patch.dict(linga.app.config, {'BOOK_PATH': self.base})
+        self.config.start()
         self.app = linga.app.test_client()
 
     def tearDown(self):
-        pass
+        self.config.stop()
+        linga.db.session.remove()
+        linga.db.drop_all()
+        shutil.rmtree(self.base)
         
-    @mock.patch('linga.comics.os.listdir')
-    @mock.patch('linga.comics.os.path.isfile')
     @mock.patch('linga.views.get_recent_books')
     @mock.patch('flask_login.utils._get_user')
-    def test_when_a_book_exists_it_should_appear_in_book_list(self, curr_user, db_query, isfile, listdir):
-        listdir.return_value = ['foo.txt', 'bar.jpg', 'test.cbz']
-        isfile.return_value = True
+    def test_when_a_book_exists_it_should_appear_in_book_list(self, curr_user, db_query):
+        for name in ['foo.txt', 'bar.jpg', 'test.cbz']:
+            open(os.path.join(self.base, name), 'w').close()
         curr_user.return_value = User()
         db_query.return_value = None
 
         with self.app:
-            res = self.app.get('/books/')
+            self.app.get('/books/')
+            res = self.app.get('/books/dir/')
 
-            self.assertIn('test.cbz', res.data)
+            self.assertIn(b'test.cbz', res.data)
+            self.assertNotIn(b'foo.txt', res.data)
     
     @mock.patch('linga.views.get_book')
     @mock.patch('flask_login.utils._get_user')
-    @mock.patch('linga.app.logger.error')
+    @mock.patch('linga.views.app.logger.error')
     def test_when_requested_book_does_not_exist_should_log_and_404(self,logger, curr_user, get_book):
         get_book.side_effect = Exception('does not exist')
         curr_user.return_value = User(123)
 
         with self.app:
             res = self.app.get('/books/read/test.cbz/')
-            print res.__dict__
 
-        assert logger.called_with('does not exist')
+        logger.assert_called_with('does not exist')
         assert res.status_code == 404, "Expected 404 respose"
 
 
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+#pylint: disable=missing-docstring,invalid-name,wrong-import-position,import-error
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from linga import app, db
+from linga.catalog import LibraryCatalog
+from linga.watcher import (CatalogWatcher, InotifyMonitor, PollingMonitor,
+                           WatcherUnavailable)
+from helpers import touch, TEST_DATABASE_URI
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestInotifyMonitor(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.base, 'bar'))
+        try:
+            self.monitor = InotifyMonitor(self.base)
+        except WatcherUnavailable:
+            self.skipTest('inotify is not available')
+        self.monitor.watch(['', 'bar'])
+
+    def tearDown(self):
+        self.monitor.close()
+        shutil.rmtree(self.base)
+
+    def test_should_report_nothing_without_changes(self):
+        self.assertEqual(self.monitor.wait(0), set())
+
+    def test_should_report_directory_of_new_file(self):
+        touch(os.path.join(self.base, 'bar', 'new.cbz'))
+        self.assertEqual(self.monitor.wait(1), set(['bar']))
+
+    def test_should_report_both_directories_on_rename(self):
+        touch(os.path.join(self.base, 'old.cbz'))
+        self.monitor.wait(1)
+        os.rename(os.path.join(self.base, 'old.cbz'), os.path.join(self.base, 'bar', 'new.cbz'))
+        self.assertEqual(self.monitor.wait(1), set(['', 'bar']))
+
+    def test_should_drop_watches_not_requested(self):
+        self.monitor.watch([''])
+        self.assertEqual(list(self.monitor.paths), [''])
+
+
+class TestPollingMonitor(unittest.TestCase):
+    def test_should_request_full_rescan_after_interval(self):
+        monitor = PollingMonitor(0)
+        self.assertIsNone(monitor.wait(1))
+
+    @mock.patch('linga.watcher.time.sleep')
+    def test_should_report_nothing_before_interval(self, sleep):
+        monitor = PollingMonitor(3600)
+        self.assertEqual(monitor.wait(1), set())
+        sleep.assert_called_with(1)
+
+
+class TestCatalogWatcher(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        db.init_app(app)
+        db.create_all()
+        self.base = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.base, 'bar'))
+        self.watcher = CatalogWatcher(self.base, 10)
+        self.catalog = LibraryCatalog(self.base)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base)
+
+    def test_should_update_changed_directories(self):
+        self.watcher.apply(None)
+        touch(os.path.join(self.base, 'bar', 'new.cbz'))
+        self.watcher.apply(set(['bar']))
+        self.assertEqual(self.catalog.get_book_list(), [os.path.join('bar', 'new.cbz')])
+
+    def test_should_watch_new_directories(self):
+        self.watcher.monitor = mock.MagicMock()
+        self.watcher.apply(None)
+        watched = self.watcher.monitor.watch.call_args[0][0]
+        self.assertEqual(sorted(watched), ['', 'bar'])
+
+    def test_should_fall_back_to_polling_when_out_of_watches(self):
+        monitor = mock.MagicMock()
+        monitor.watch.side_effect = WatcherUnavailable('Too many directories to watch')
+        self.watcher.monitor = monitor
+        self.watcher.apply(None)
+        self.assertIsInstance(self.watcher.monitor, PollingMonitor)
+        monitor.close.assert_called_with()
+
+
+if __name__ == '__main__':
+    unittest.main()